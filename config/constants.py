@@ -29,6 +29,59 @@ PATHS_DBF = {
     )
 }
 
+# --- Cache locale (indici e stato di sincronizzazione) ---
+PATH_CACHE = os.getenv('PATH_CACHE', './data/cache')
+
+# Database SQLite della mappa appuntamenti → eventi Google (sostituisce synced_events.json)
+PATH_SYNC_DB = os.getenv('PATH_SYNC_DB', './data/sync.sqlite3')
+
+# Snapshot Parquet delle tabelle DBF (richiede pyarrow)
+SNAPSHOT_DBF = os.getenv('SNAPSHOT_DBF', 'false').lower() in ('1', 'true', 'si')
+
+# --- Sincronizzazione Google Calendar ---
+# Thread per calendario e richieste batch contemporanee su tutti i calendari
+SYNC_WORKER_PER_CALENDARIO = int(os.getenv('SYNC_WORKER_PER_CALENDARIO', '2'))
+SYNC_BATCH_IN_VOLO = int(os.getenv('SYNC_BATCH_IN_VOLO', '4'))
+# Limitatore adattivo: velocità iniziale e massima (chiamate/s) e tentativi sugli errori di quota
+GOOGLE_RICHIESTE_AL_SECONDO = float(os.getenv('GOOGLE_RICHIESTE_AL_SECONDO', '5'))
+GOOGLE_RICHIESTE_MAX_AL_SECONDO = float(os.getenv('GOOGLE_RICHIESTE_MAX_AL_SECONDO', '10'))
+GOOGLE_TENTATIVI_MAX = int(os.getenv('GOOGLE_TENTATIVI_MAX', '6'))
+# Giorni elaborati per blocco (e per checkpoint) nel backfill storico
+BACKFILL_GIORNI_BLOCCO = int(os.getenv('BACKFILL_GIORNI_BLOCCO', '7'))
+
+# --- Invio WhatsApp ---
+# Invii Twilio contemporanei e messaggi al secondo per numero mittente
+WHATSAPP_INVII_IN_VOLO = int(os.getenv('WHATSAPP_INVII_IN_VOLO', '8'))
+WHATSAPP_MESSAGGI_AL_SECONDO = float(os.getenv('WHATSAPP_MESSAGGI_AL_SECONDO', '10'))
+# Tentativi per messaggio quando Twilio risponde 429 (troppe richieste)
+WHATSAPP_TENTATIVI_MAX = int(os.getenv('WHATSAPP_TENTATIVI_MAX', '4'))
+# Outbox persistente dei messaggi: database, tentativi per messaggio e attesa prima del secondo tentativo
+# (raddoppiata a ogni tentativo successivo)
+PATH_OUTBOX_DB = os.getenv('PATH_OUTBOX_DB', './data/outbox.sqlite3')
+OUTBOX_TENTATIVI_MAX = int(os.getenv('OUTBOX_TENTATIVI_MAX', '4'))
+OUTBOX_BACKOFF_SECONDI = float(os.getenv('OUTBOX_BACKOFF_SECONDI', '60'))
+# Sessione HTTP condivisa verso Twilio: connessioni keep-alive nel pool (almeno WHATSAPP_INVII_IN_VOLO)
+# e timeout di ogni richiesta
+TWILIO_POOL_CONNESSIONI = int(os.getenv('TWILIO_POOL_CONNESSIONI', str(WHATSAPP_INVII_IN_VOLO)))
+TWILIO_TIMEOUT_SECONDI = float(os.getenv('TWILIO_TIMEOUT_SECONDI', '15'))
+# Campagne di richiami: piano persistente, messaggi al giorno, giorni della settimana (0 = lunedì)
+# e fasce orarie in cui il piano viene smaltito
+PATH_CAMPAGNE_DB = os.getenv('PATH_CAMPAGNE_DB', './data/campagne.sqlite3')
+RICHIAMI_MAX_AL_GIORNO = int(os.getenv('RICHIAMI_MAX_AL_GIORNO', '150'))
+RICHIAMI_GIORNI_INVIO = os.getenv('RICHIAMI_GIORNI_INVIO', '0,1,2,3,4,5')
+RICHIAMI_FASCE_ORARIE = os.getenv('RICHIAMI_FASCE_ORARIE', '09:30-12:30,15:00-19:00')
+
+# --- Scheduler (scripts/main.py) ---
+# Stato dei job e cadenze in stile cron ("minuto ora giorno mese giorno_settimana", 0 = domenica)
+PATH_SCHEDULER_DB = os.getenv('PATH_SCHEDULER_DB', './data/scheduler.sqlite3')
+SCHEDULER_PROMEMORIA = os.getenv('SCHEDULER_PROMEMORIA', '30 18 * * *')
+SCHEDULER_SYNC_CALENDARIO = os.getenv('SCHEDULER_SYNC_CALENDARIO', '*/15 7-21 * * *')
+SCHEDULER_PIANIFICA_RICHIAMI = os.getenv('SCHEDULER_PIANIFICA_RICHIAMI', '0 8 * * 1-6')
+SCHEDULER_INVIA_RICHIAMI = os.getenv('SCHEDULER_INVIA_RICHIAMI', '*/15 9-19 * * 1-6')
+SCHEDULER_AGGIORNA_CACHE = os.getenv('SCHEDULER_AGGIORNA_CACHE', '*/10 * * * *')
+# Ore entro cui un promemoria perso (processo fermo all'orario previsto) viene ancora inviato all'avvio
+SCHEDULER_RECUPERO_PROMEMORIA_ORE = float(os.getenv('SCHEDULER_RECUPERO_PROMEMORIA_ORE', '3'))
+
 # --- Colonne DBF ---
 COLONNE = {
     'appuntamenti': {
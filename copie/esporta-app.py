@@ -1,5 +1,6 @@
 import argparse
-from dbfread import DBF
+import os
+import sys
 from datetime import datetime, date, timedelta, time
 from config import (
     PATH_APPUNTAMENTI_DBF,
@@ -17,6 +18,8 @@ from config import (
     COLORI_APPUNTAMENTO,
     MEDICI,
 )
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.dbf_reader import TabellaDBF
 from openpyxl import Workbook
 from openpyxl.styles import PatternFill
 
@@ -37,22 +40,20 @@ def main():
         end_date = date(anno, mese + 1, 1)
 
     # Carica pazienti in dizionario {id: nome}
-    pazienti_dbf = DBF(PATH_ANAGRAFICA_DBF, encoding='latin-1')
-    PAZIENTI_NOMI = {
-        str(record[COL_PAZIENTI_ID]).strip(): record[COL_PAZIENTI_NOME].strip()
-        for record in pazienti_dbf
-    }
+    with TabellaDBF(PATH_ANAGRAFICA_DBF, codepage='latin-1') as pazienti_dbf:
+        PAZIENTI_NOMI = {
+            str(record[COL_PAZIENTI_ID]).strip(): record[COL_PAZIENTI_NOME].strip()
+            for record in pazienti_dbf
+        }
 
     # Carica appuntamenti in struttura: appuntamenti_per_giorno[giorno][orario][studio] = (testo, tipo_codice)
     appuntamenti_per_giorno = {}
 
-    dbf = DBF(PATH_APPUNTAMENTI_DBF, encoding='latin-1')
-    for record in dbf:
+    dbf = TabellaDBF(PATH_APPUNTAMENTI_DBF, codepage='latin-1')
+    filtro_mese = {COL_APPUNTAMENTI_DATA: lambda d: isinstance(d, date) and start_date <= d < end_date}
+    for recno in dbf.filtra(filtro_mese):
+        record = dbf[recno]
         data = record.get(COL_APPUNTAMENTI_DATA)
-        if not isinstance(data, date):
-            continue
-        if not (start_date <= data < end_date):
-            continue
 
         ora_inizio = record.get(COL_APPUNTAMENTI_ORA, 0)
         orario_minuti = (ora_inizio // 100) * 60 + (ora_inizio % 100)
@@ -82,6 +83,7 @@ def main():
         ora_int = int(ora_inizio)
         testo = f"{ora_int//100:02d}:{ora_int%100:02d} {nome_paziente}"
         appuntamenti_per_giorno[giorno][orario_minuti][studio] = (testo, tipo_codice)
+    dbf.close()
 
     if not args.esporta_csv:
         # Se non voglio esportare, stampo a video solo
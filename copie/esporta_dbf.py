@@ -1,9 +1,12 @@
 import os
 from tkinter import Tk, filedialog, messagebox
-import dbf
+import sys
 import pandas as pd
 import csv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.dbf_reader import TabellaDBF
+
 def scegli_file_dbf():
     root = Tk()
     root.withdraw()
@@ -15,9 +18,8 @@ def scegli_file_dbf():
 
 def converti_dbf_ottimizzato(file_path):
     try:
-        # Apertura del file DBF
-        table = dbf.Table(file_path)
-        table.open()
+        # Apertura del file DBF (mappato in memoria, campi decodificati all'accesso)
+        table = TabellaDBF(file_path)
         
         print(f"Conversione di {len(table)} record con {len(table.field_names)} campi")
         print(f"Campi: {table.field_names}")
@@ -1,17 +1,30 @@
 from datetime import datetime, timedelta, time as dt_time
+from zoneinfo import ZoneInfo
 import time
 import json
 import os
 import logging
+import threading
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
-from google.api_core import retry
 
-from config.constants import GOOGLE, COLONNE
+from config.constants import GOOGLE, COLONNE, GOOGLE_TENTATIVI_MAX
+from core.rate_limiter import limitatore_google, e_ritentabile, e_limite_quota, attesa_backoff
+from core.sync_utils import map_appointment, compute_appointment_hash, compute_app_id, filter_appointments_for_sync, load_sync_map, migra_chiavi_legacy
+from core.sync_executor import EsecutoreSync
+from core.db_handler import limiti_mese
+from core.sync_store import ArchivioSync
+from core.sync_reconciler import (
+    riconcilia, impronta_campi, campi_modificati, applica_modifiche_google,
+    proprieta_evento, voce_da_evento, ETICHETTA_SYNC, VALORE_ETICHETTA, PROPRIETA_APP_ID, SUFFISSO_SPOSTATO
+)
+
+# Limite di chiamate per singola richiesta batch dell'API Calendar
+MAX_BATCH = 50
 
 class GoogleCalendarSync:
     def __init__(self, db_handler):
@@ -19,6 +32,8 @@ class GoogleCalendarSync:
         self.calendar_service = None
         self.SCOPES = ['https://www.googleapis.com/auth/calendar']
         self.db_handler = db_handler
+        self._locale = threading.local()
+        self.limitatore = limitatore_google()
 
     def authenticate(self):
         try:
@@ -41,8 +56,9 @@ class GoogleCalendarSync:
                     token.write(self.credentials.to_json())
 
             self.calendar_service = build('calendar', 'v3', credentials=self.credentials)
+            self._locale.servizio = self.calendar_service
 
-            calendar = self.calendar_service.calendars().get(calendarId='primary').execute()
+            calendar = self.esegui_richiesta(self.calendar_service.calendars().get(calendarId='primary'))
             logging.info(f"Autenticato come: {calendar['id']}")
             return True
 
@@ -50,6 +66,18 @@ class GoogleCalendarSync:
             logging.error(f"Errore autenticazione: {e}")
             raise
 
+    def servizio(self):
+        """
+        Client Calendar del thread corrente: il trasporto httplib2 non è thread-safe,
+        quindi ogni thread di sincronizzazione usa un proprio client con le stesse credenziali.
+        """
+        servizio = getattr(self._locale, 'servizio', None)
+        if servizio is None:
+            if self.credentials is None:
+                raise RuntimeError("Client Google Calendar non autenticato")
+            servizio = self._locale.servizio = build('calendar', 'v3', credentials=self.credentials, cache_discovery=False)
+        return servizio
+
     def _decimal_to_time(self, decimal_time):
         hours = int(decimal_time)
         minutes = int(round((decimal_time - hours) * 100))
@@ -67,7 +95,447 @@ class GoogleCalendarSync:
         from config import GOOGLE_COLOR_MAP
         return GOOGLE_COLOR_MAP.get(tipo, '1')
 
-    def sync_appointments_for_month(self, month=None, year=None, studio_calendar_ids=None, progress_callback=None, debug_export_first_50=False):
+    def _evento_da_appuntamento(self, mapped):
+        """Costruisce il body dell'evento Google da un appuntamento normalizzato con map_appointment."""
+        data_evento = mapped['DATA'].date() if isinstance(mapped['DATA'], datetime) else mapped['DATA']
+        dt_inizio = datetime.combine(data_evento, mapped['ORA_INIZIO'])
+        dt_fine = datetime.combine(data_evento, mapped['ORA_FINE'])
+        if dt_fine <= dt_inizio:
+            dt_fine = dt_inizio + timedelta(minutes=10)
+
+        return {
+            'summary': (mapped.get('DESCRIZIONE') or mapped.get('PAZIENTE') or "Appuntamento").strip(),
+            'description': mapped.get('NOTE', ''),
+            'start': {
+                'dateTime': dt_inizio.isoformat(),
+                'timeZone': GOOGLE['timezone'],
+            },
+            'end': {
+                'dateTime': dt_fine.isoformat(),
+                'timeZone': GOOGLE['timezone'],
+            },
+            'colorId': self._get_google_color_id(mapped.get('TIPO'))
+        }
+
+    def _prepara_appuntamento(self, app):
+        """
+        Body dell'evento, chiave e hash di un appuntamento grezzo.
+
+        Returns:
+            tuple: (body, app_id, hash)
+        """
+        return self._evento_da_appuntamento(map_appointment(app)), compute_app_id(app), compute_appointment_hash(app)
+
+    def create_event(self, appointment, cal_id='primary'):
+        """
+        Crea un singolo evento (appuntamento grezzo o già passato da map_appointment).
+        Gli appuntamenti grezzi ricevono le proprietà private della sincronizzazione.
+        """
+        if isinstance(appointment.get('ORA_INIZIO'), dt_time):
+            body = self._evento_da_appuntamento(appointment)
+        else:
+            body, app_id, app_hash = self._prepara_appuntamento(appointment)
+            body['extendedProperties'] = self._proprieta_appuntamento(appointment, app_id, app_hash, body, cal_id)
+        event = self.esegui_richiesta(self.servizio().events().insert(calendarId=cal_id, body=body))
+        logging.info(f"Evento creato: {event.get('htmlLink')}")
+        return event
+
+    def _invia_batch(self, blocco):
+        """Invia un singolo batch HTTP dopo aver consumato un token per ogni chiamata."""
+        esiti = {}
+        chiavi = {str(i): chiave for i, (chiave, _) in enumerate(blocco)}
+
+        def callback(request_id, response, exception):
+            esiti[chiavi[request_id]] = (response, exception)
+
+        self.limitatore.acquisisci(len(blocco))
+        batch = self.servizio().new_batch_http_request(callback=callback)
+        for i, (_, richiesta) in enumerate(blocco):
+            batch.add(richiesta, request_id=str(i))
+        try:
+            batch.execute()
+        except HttpError as e:
+            # Errore sull'intera richiesta batch (es. 429): vale per tutte le chiamate
+            if not e_ritentabile(e):
+                raise
+            esiti = {chiave: (None, e) for chiave, _ in blocco}
+        return esiti
+
+    def esegui_richiesta(self, richiesta):
+        """Esegue una singola chiamata API tramite il limitatore condiviso, con backoff sugli errori di quota."""
+        return self.limitatore.esegui(richiesta)
+
+    def esegui_batch(self, richieste, progress_callback=None):
+        """
+        Esegue le richieste API raggruppandole in batch HTTP da MAX_BATCH chiamate.
+
+        Args:
+            richieste (list[tuple]): coppie (chiave, HttpRequest non ancora eseguita)
+            progress_callback (callable, opzionale): chiamata con (completate, totale) dopo ogni batch
+
+        Returns:
+            dict: chiave → (risposta, eccezione); eccezione è None se la chiamata è riuscita
+        """
+        risultati = {}
+        totale = len(richieste)
+
+        for inizio in range(0, totale, MAX_BATCH):
+            blocco = richieste[inizio:inizio + MAX_BATCH]
+
+            # Le chiamate respinte per quota o per errori transitori vengono
+            # ritentate in un nuovo batch dopo il backoff del limitatore
+            for tentativo in range(GOOGLE_TENTATIVI_MAX):
+                esiti = self._invia_batch(blocco)
+                risultati.update(esiti)
+
+                riusciti = sum(1 for _, errore in esiti.values() if errore is None)
+                if riusciti:
+                    self.limitatore.segnala_successo(riusciti)
+                da_ritentare = [(chiave, r) for chiave, r in blocco if e_ritentabile(esiti.get(chiave, (None, None))[1])]
+                if not da_ritentare or tentativo == GOOGLE_TENTATIVI_MAX - 1:
+                    break
+
+                logging.warning(f"Batch: {len(da_ritentare)} chiamate da ritentare (tentativo {tentativo + 1})")
+                if any(e_limite_quota(esiti[chiave][1]) for chiave, _ in da_ritentare):
+                    self.limitatore.segnala_limite(tentativo)
+                else:
+                    time.sleep(attesa_backoff(tentativo))
+                blocco = da_ritentare
+
+            if progress_callback:
+                progress_callback(min(inizio + MAX_BATCH, totale), totale)
+
+        return risultati
+
+    @staticmethod
+    def _voce_sync_map(app, app_hash, body, event_id, calendar_id, etag=None):
+        """Voce della sync map per un evento sincronizzato (etag: versione scritta da noi, vedi scarica_modifiche)."""
+        return {
+            'event_id': event_id,
+            'hash': app_hash,
+            'calendar_id': calendar_id,
+            'data': str(app.get('DATA', ''))[:10],
+            'studio': int(app.get('STUDIO') or 0),
+            'campi': impronta_campi(body),
+            'etag': etag,
+        }
+
+    def _proprieta_appuntamento(self, app, app_id, app_hash, body, calendar_id):
+        """extendedProperties dell'evento: chiave, hash, data e studio della voce della sync map."""
+        return proprieta_evento(app_id, self._voce_sync_map(app, app_hash, body, None, calendar_id))
+
+    def sincronizza_batch(self, calendar_id, to_create=(), to_update=(), to_delete=(), to_move=(), sync_map=None, progress_callback=None):
+        """
+        Applica creazioni, aggiornamenti e cancellazioni su un calendario tramite batch HTTP
+        e riporta l'esito di ogni elemento nella mappa di sincronizzazione.
+
+        Args:
+            calendar_id (str): calendario di destinazione
+            to_create (list[dict]): appuntamenti da creare
+            to_update (list[tuple]): coppie (appuntamento, event_id) da aggiornare con
+                events().patch, inviando solo i campi cambiati
+            to_delete (list[str]): chiavi della sync map i cui eventi vanno eliminati
+            to_move (list[tuple]): coppie (app_id, voce precedente) di appuntamenti passati
+                a un altro calendario: il vecchio evento viene eliminato (il nuovo è in to_create)
+            sync_map (dict, opzionale): mappa app_id → {'event_id', 'hash', 'calendar_id', 'data', 'studio', 'campi'}
+
+        Returns:
+            dict: conteggi 'creati', 'aggiornati', 'eliminati', 'errori'
+        """
+        events = self.servizio().events()
+        richieste = []
+        pendenti = {}
+
+        for app in to_create:
+            try:
+                body, app_id, app_hash = self._prepara_appuntamento(app)
+            except Exception as e:
+                logging.warning(f"[SKIP] Appuntamento non valido: {e}")
+                continue
+            body['extendedProperties'] = self._proprieta_appuntamento(app, app_id, app_hash, body, calendar_id)
+            chiave = ('create', app_id, len(richieste))
+            pendenti[chiave] = (app, app_hash, body)
+            richieste.append((chiave, events.insert(calendarId=calendar_id, body=body)))
+
+        for app, event_id in to_update:
+            try:
+                body, app_id, app_hash = self._prepara_appuntamento(app)
+            except Exception as e:
+                logging.warning(f"[SKIP] Appuntamento non aggiornato: {e}")
+                continue
+            voce = (sync_map or {}).get(app_id)
+            modifiche = campi_modificati(body, voce)
+            if not modifiche:
+                # Cambiato solo un campo che non finisce nell'evento: basta aggiornare l'hash
+                if sync_map is not None:
+                    sync_map[app_id] = self._voce_sync_map(app, app_hash, body, event_id, calendar_id, (voce or {}).get('etag'))
+                continue
+            # Le proprietà private seguono l'hash, per poter ricostruire la mappa da Google
+            modifiche['extendedProperties'] = self._proprieta_appuntamento(app, app_id, app_hash, body, calendar_id)
+            chiave = ('update', app_id, len(richieste))
+            pendenti[chiave] = (app, app_hash, body)
+            richieste.append((chiave, events.patch(
+                calendarId=(voce or {}).get('calendar_id', calendar_id), eventId=event_id, body=modifiche
+            )))
+
+        for app_id in to_delete:
+            voce = (sync_map or {}).get(app_id)
+            if not voce:
+                continue
+            chiave = ('delete', app_id, len(richieste))
+            richieste.append((chiave, events.delete(calendarId=voce.get('calendar_id', calendar_id), eventId=voce['event_id'])))
+
+        for app_id, voce in to_move:
+            chiave = ('move', app_id, len(richieste))
+            pendenti[chiave] = voce
+            richieste.append((chiave, events.delete(calendarId=voce['calendar_id'], eventId=voce['event_id'])))
+
+        esito = {'creati': 0, 'aggiornati': 0, 'eliminati': 0, 'errori': 0}
+        for chiave, (risposta, errore) in self.esegui_batch(richieste, progress_callback).items():
+            operazione, app_id, _ = chiave
+            evento_assente = isinstance(errore, HttpError) and errore.resp.status in (404, 410)
+            if errore is not None:
+                if operazione in ('delete', 'move') and evento_assente:
+                    # Evento già eliminato su Google: basta togliere la voce dalla mappa
+                    errore = None
+                else:
+                    logging.error(f"Errore Google API ({operazione} {app_id}): {errore}")
+                    if operazione == 'update' and evento_assente and sync_map is not None:
+                        # Evento rimosso a mano dal calendario: verrà ricreato alla prossima sync
+                        sync_map.pop(app_id, None)
+                    elif operazione == 'move' and sync_map is not None:
+                        # Il vecchio evento resta sull'altro calendario: con la voce provvisoria
+                        # la prossima riconciliazione del nuovo calendario riprova a eliminarlo
+                        sync_map[app_id + SUFFISSO_SPOSTATO] = pendenti[chiave]
+                    esito['errori'] += 1
+                    continue
+
+            if operazione == 'delete':
+                if sync_map is not None:
+                    sync_map.pop(app_id, None)
+                esito['eliminati'] += 1
+                continue
+            if operazione == 'move':
+                # La voce app_id appartiene al nuovo evento (scritta dalla creazione)
+                esito['eliminati'] += 1
+                continue
+
+            if sync_map is not None:
+                app, app_hash, body = pendenti[chiave]
+                sync_map[app_id] = self._voce_sync_map(app, app_hash, body, risposta['id'], calendar_id, risposta.get('etag'))
+            esito['creati' if operazione == 'create' else 'aggiornati'] += 1
+
+        logging.info(f"Sync batch {calendar_id}: {esito}")
+        return esito
+
+    def scarica_modifiche(self, calendar_id, sync_map):
+        """
+        Legge da Google solo gli eventi cambiati dall'ultima chiamata (syncToken
+        salvato per calendario nell'archivio della sync map) e li riconcilia con
+        la mappa tramite applica_modifiche_google.
+
+        Alla prima chiamata, o se Google ha invalidato il token (HTTP 410), il
+        calendario viene letto per intero per ottenere un nuovo token.
+
+        Richiede un ArchivioSync (syncToken e ricerca per event_id): con una
+        mappa semplice (dict) le modifiche fatte su Google non vengono lette.
+
+        Returns:
+            dict: conteggi di applica_modifiche_google più 'letti' e 'completa',
+                None se sync_map non è un ArchivioSync
+        """
+        if not isinstance(sync_map, ArchivioSync):
+            logging.info(f"Sync map senza archivio: modifiche da Google su {calendar_id} non lette")
+            return None
+        chiave = f"sync_token:{calendar_id}"
+        token = sync_map.leggi_stato(chiave)
+        try:
+            eventi, nuovo_token = self._elenca_modifiche(calendar_id, token)
+        except HttpError as e:
+            if e.resp.status != 410 or not token:
+                raise
+            logging.warning(f"syncToken di {calendar_id} scaduto: lettura completa del calendario")
+            token = None
+            eventi, nuovo_token = self._elenca_modifiche(calendar_id, None)
+
+        esito = applica_modifiche_google(eventi, sync_map, calendar_id)
+        # Il token viene salvato solo dopo aver riconciliato le modifiche lette
+        if nuovo_token:
+            sync_map.scrivi_stato(chiave, nuovo_token)
+        esito.update({'letti': len(eventi), 'completa': token is None})
+        logging.info(f"Modifiche da Google su {calendar_id}: {esito}")
+        return esito
+
+    def _elenca_modifiche(self, calendar_id, sync_token):
+        eventi, page_token = [], None
+        while True:
+            parametri = {'calendarId': calendar_id, 'maxResults': 2500, 'pageToken': page_token}
+            if sync_token:
+                parametri['syncToken'] = sync_token
+            risposta = self.esegui_richiesta(self.servizio().events().list(**parametri))
+            eventi.extend(risposta.get('items', []))
+            page_token = risposta.get('nextPageToken')
+            if not page_token:
+                return eventi, risposta.get('nextSyncToken')
+
+    def get_calendars(self):
+        """Recupera la lista dei calendari disponibili (tutte le pagine di calendarList)"""
+        calendari, page_token = [], None
+        while True:
+            risposta = self.esegui_richiesta(self.servizio().calendarList().list(pageToken=page_token))
+            for voce in risposta.get('items', []):
+                calendari.append({
+                    'id': voce['id'],
+                    'summary': voce.get('summary', voce['id']),
+                    'primary': voce.get('primary', False)
+                })
+            page_token = risposta.get('nextPageToken')
+            if not page_token:
+                break
+        logging.info(f"Recuperati {len(calendari)} calendari")
+        return calendari
+
+    @staticmethod
+    def _rfc3339(valore):
+        """timeMin/timeMax per l'API: date e datetime senza fuso sono intesi nel fuso dello studio."""
+        if valore is None or isinstance(valore, str):
+            return valore
+        if not isinstance(valore, datetime):
+            valore = datetime.combine(valore, dt_time.min)
+        if valore.tzinfo is None:
+            valore = valore.replace(tzinfo=ZoneInfo(GOOGLE['timezone']))
+        return valore.isoformat()
+
+    def _elenca_eventi(self, calendar_id, time_min=None, time_max=None, campi='id', **filtri):
+        """
+        Tutti gli eventi del calendario (tutte le pagine), eventualmente limitati a un
+        intervallo; campi sono i campi di ogni evento richiesti a Google, filtri altri
+        parametri di events().list (es. privateExtendedProperty).
+        """
+        eventi, page_token = [], None
+        while True:
+            parametri = dict(filtri, calendarId=calendar_id, maxResults=2500, pageToken=page_token,
+                             fields=f"items({campi}),nextPageToken")
+            if time_min is not None:
+                parametri['timeMin'] = self._rfc3339(time_min)
+            if time_max is not None:
+                parametri['timeMax'] = self._rfc3339(time_max)
+            risposta = self.esegui_richiesta(self.servizio().events().list(**parametri))
+            eventi.extend(risposta.get('items', []))
+            page_token = risposta.get('nextPageToken')
+            if not page_token:
+                return eventi
+
+    def cerca_evento(self, calendar_id, app_id):
+        """
+        Evento Google creato dalla sincronizzazione per l'appuntamento indicato,
+        cercato per proprietà privata senza bisogno della sync map.
+
+        Returns:
+            dict | None: l'evento, o None se non esiste
+        """
+        eventi = self._elenca_eventi(calendar_id, campi='*', privateExtendedProperty=f"{PROPRIETA_APP_ID}={app_id}")
+        return eventi[0] if eventi else None
+
+    def ricostruisci_sync_map(self, calendar_id, sync_map):
+        """
+        Ricostruisce le voci della sync map di un calendario dagli eventi con le
+        proprietà private della sincronizzazione, letti con un solo elenco filtrato.
+        Una mappa persa non richiede quindi di svuotare il calendario e risincronizzare tutto.
+
+        Se più eventi portano la stessa chiave (es. uno spostamento di studio
+        interrotto) il primo resta associato all'appuntamento e gli altri vengono
+        registrati come duplicati, che la riconciliazione elimina.
+
+        Returns:
+            dict: conteggi 'letti', 'ricostruiti', 'duplicati'
+        """
+        eventi = self._elenca_eventi(calendar_id, campi='id,etag,status,summary,description,start,end,colorId,extendedProperties',
+                                     privateExtendedProperty=f"{ETICHETTA_SYNC}={VALORE_ETICHETTA}")
+        esito = {'letti': len(eventi), 'ricostruiti': 0, 'duplicati': 0}
+        voci = {}
+        for evento in eventi:
+            app_id, voce = voce_da_evento(evento, calendar_id)
+            if app_id is None:
+                continue
+            attuale = voci.get(app_id) or sync_map.get(app_id)
+            if attuale and attuale['event_id'] != voce['event_id']:
+                app_id = f"{app_id}#duplicato-{voce['event_id']}"
+                esito['duplicati'] += 1
+            else:
+                esito['ricostruiti'] += 1
+            voci[app_id] = voce
+
+        if hasattr(sync_map, 'aggiorna_molti'):
+            sync_map.aggiorna_molti(voci)
+        else:
+            sync_map.update(voci)
+        logging.info(f"Sync map ricostruita da {calendar_id}: {esito}")
+        return esito
+
+    def svuota_calendario(self, calendar_id, time_min=None, time_max=None, solo_nostri=False, sync_map=None, progress_callback=None):
+        """
+        Elimina gli eventi di un calendario leggendo tutte le pagine di events().list
+        e cancellandoli con batch HTTP sotto il limitatore condiviso.
+
+        Gli eventi ricorrenti vengono eliminati una sola volta tramite l'evento
+        principale. Le voci della sync map degli eventi eliminati (o già assenti
+        su Google) vengono rimosse, così la prossima sincronizzazione li ricrea.
+
+        Args:
+            calendar_id (str): calendario da svuotare
+            time_min, time_max (date | datetime | str, opzionali): limita agli eventi
+                che si sovrappongono all'intervallo (time_max escluso)
+            solo_nostri (bool): elimina solo gli eventi creati dalla sincronizzazione
+                (proprietà private o voce nella sync map)
+            sync_map (dict, opzionale): mappa da ripulire
+            progress_callback (callable, opzionale): chiamata con (completate, totale) dopo ogni batch
+
+        Returns:
+            dict: conteggi 'letti', 'eliminati', 'errori'
+        """
+        eventi = self._elenca_eventi(calendar_id, time_min, time_max, campi='id,extendedProperties' if solo_nostri else 'id')
+        letti = len(eventi)
+
+        nostri = {}
+        if sync_map is not None:
+            for app_id, voce in sync_map.items():
+                if voce.get('calendar_id', calendar_id) == calendar_id:
+                    nostri[voce['event_id']] = app_id
+        if solo_nostri:
+            eventi = [evento for evento in eventi
+                      if evento['id'] in nostri or voce_da_evento(evento, calendar_id)[0] is not None]
+        event_ids = [evento['id'] for evento in eventi]
+
+        events = self.servizio().events()
+        richieste = [(event_id, events.delete(calendarId=calendar_id, eventId=event_id)) for event_id in event_ids]
+
+        esito = {'letti': letti, 'eliminati': 0, 'errori': 0}
+        for event_id, (_, errore) in self.esegui_batch(richieste, progress_callback).items():
+            if errore is not None and not (isinstance(errore, HttpError) and errore.resp.status in (404, 410)):
+                logging.error(f"Errore eliminazione evento {event_id}: {errore}")
+                esito['errori'] += 1
+                continue
+            esito['eliminati'] += 1
+            if event_id in nostri:
+                sync_map.pop(nostri[event_id], None)
+
+        logging.info(f"Pulizia calendario {calendar_id}: {esito}")
+        return esito
+
+    def delete_all_events(self, calendar_id, progress_callback=None):
+        """Cancella tutti gli eventi (passati e futuri) dal calendario e ripulisce la sync map."""
+        return self.svuota_calendario(calendar_id, sync_map=load_sync_map(), progress_callback=progress_callback)['eliminati']
+
+    def sync_appointments_for_month(self, month=None, year=None, studio_calendar_ids=None, progress_callback=None, debug_export_first_50=False, sync_map=None):
+        """
+        Sincronizza gli appuntamenti del mese (tutti se month e year mancano)
+        sui calendari degli studi.
+
+        sync_map è la mappa persistente (ArchivioSync, default load_sync_map());
+        con un dict semplice la riconciliazione funziona ma le modifiche fatte
+        su Google non vengono lette (vedi scarica_modifiche).
+        """
         try:
             if not studio_calendar_ids:
                 raise ValueError("ID calendari non forniti")
@@ -112,57 +580,31 @@ class GoogleCalendarSync:
                     appointments_by_studio.setdefault(studio, []).append(app)
 
             total = sum(len(a) for a in appointments_by_studio.values())
-            success = errors = 0
-
+            inizio, fine = limiti_mese(month, year) if month and year else (None, None)
+
+            if sync_map is None:
+                # Senza mappa ogni esecuzione ricreerebbe tutti gli eventi: si usa quella persistente
+                sync_map = load_sync_map()
+            migra_chiavi_legacy(sync_map, self.db_handler)
+            for calendar_id in set(studio_calendar_ids.values()):
+                self.scarica_modifiche(calendar_id, sync_map)
+
+            # Più studi possono condividere lo stesso calendario: il lavoro è raggruppato per calendar_id
+            lavori = {}
+            presenti = {compute_app_id(app) for apps in appointments_by_studio.values() for app in apps}
             for studio, apps in appointments_by_studio.items():
                 calendar_id = studio_calendar_ids[studio]
-
-                for app in apps:
-                    try:
-                        if not app.get('PAZIENTE'):
-                            continue
-
-                        data_evento = app['DATA']
-                        if isinstance(data_evento, str):
-                            data_evento = datetime.strptime(data_evento, "%Y-%m-%d").date()
-
-                        t_inizio = self._safe_to_time(app.get('ORA_INIZIO'))
-                        t_fine = self._safe_to_time(app.get('ORA_FINE'))
-
-                        dt_inizio = datetime.combine(data_evento, t_inizio)
-                        dt_fine = datetime.combine(data_evento, t_fine) if t_fine > t_inizio else dt_inizio + timedelta(minutes=10)
-
-                        summary = app.get('PAZIENTE') or app.get('DESCRIZIONE') or "Appuntamento"
-
-                        event = {
-                            'summary': summary.strip(),
-                            'description': app.get('NOTE', ''),
-                            'start': {
-                                'dateTime': dt_inizio.isoformat(),
-                                'timeZone': GOOGLE['timezone'],
-                            },
-                            'end': {
-                                'dateTime': dt_fine.isoformat(),
-                                'timeZone': GOOGLE['timezone'],
-                            },
-                            'colorId': self._get_google_color_id(app.get('TIPO'))
-                        }
-
-                        self.calendar_service.events().insert(
-                            calendarId=calendar_id,
-                            body=event
-                        ).execute()
-
-                        success += 1
-
-                    except HttpError as error:
-                        logging.error(f"Errore Google API: {error}")
-                        errors += 1
-                    except Exception as e:
-                        logging.error(f"Errore generico: {e}")
-                        errors += 1
-
-            return {'total': total, 'success': success, 'errors': errors}
+                piano = riconcilia(apps, sync_map, calendar_id, inizio, fine, studi={studio}, presenti=presenti)
+                lavoro = lavori.setdefault(calendar_id, {'to_create': [], 'to_update': [], 'to_delete': [], 'to_move': []})
+                for operazione, elementi in piano.items():
+                    lavoro[operazione].extend(elementi)
+
+            esito = EsecutoreSync(self, dimensione_blocco=MAX_BATCH, progress_callback=progress_callback).esegui(lavori, sync_map)
+            return {
+                'total': total,
+                'success': esito['creati'] + esito['aggiornati'] + esito['eliminati'],
+                'errors': esito['errori']
+            }
 
         except Exception as e:
             logging.error(f"Errore sincronizzazione: {e}")
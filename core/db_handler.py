@@ -1,141 +1,320 @@
 import pandas as pd
 import logging
 from datetime import datetime, date, timedelta
-import dbf
+import struct
 import os
 import json
+import threading
+
+from config import PATHS_DBF, COLONNE, SNAPSHOT_DBF
+from core.dbf_reader import leggi_colonne
+from core.dbf_index import IndiceDate, indice_pazienti, indice_richiami
+from core.dbf_snapshot import snapshot_dbf, snapshot_disponibile
+
+
+def limiti_mese(month, year):
+    """Primo e ultimo giorno del mese indicato, come coppia di date (estremi inclusi)."""
+    primo = date(year, month, 1)
+    successivo = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return primo, successivo - timedelta(days=1)
 
-from config import PATHS_DBF, COLONNE
 
 class DBHandler:
-    def __init__(self, path_appuntamenti=None, path_anagrafica=None):
+    def __init__(self, path_appuntamenti=None, path_anagrafica=None, usa_snapshot=None):
         self.path_appuntamenti = path_appuntamenti or PATHS_DBF['appuntamenti']
         self.path_anagrafica = path_anagrafica or PATHS_DBF['anagrafica']
+        self._indice_date = None
+        self._lock_indice = threading.Lock()
+
+        self.usa_snapshot = SNAPSHOT_DBF if usa_snapshot is None else usa_snapshot
+        if self.usa_snapshot and not snapshot_disponibile():
+            logging.warning("SNAPSHOT_DBF attivo ma pyarrow non è installato: lettura diretta dai DBF.")
+            self.usa_snapshot = False
+
+    def aggiorna_snapshot(self):
+        """
+        Rigenera lo snapshot Parquet degli appuntamenti se il DBF è cambiato.
+        Pensato per essere chiamato periodicamente, fuori dal percorso critico.
+        """
+        if not self.usa_snapshot:
+            return False
+        return snapshot_dbf(self.path_appuntamenti, COLONNE['appuntamenti']['data']).aggiorna()
+
+    def _leggi_appuntamenti(self, colonne, data_inizio=None, data_fine=None):
+        """
+        Legge le colonne richieste degli appuntamenti con data valorizzata,
+        dallo snapshot se attivo, altrimenti dal DBF tramite l'indice date.
+        """
+        col_data = COLONNE['appuntamenti']['data']
+
+        if self.usa_snapshot:
+            try:
+                snapshot = snapshot_dbf(self.path_appuntamenti, col_data)
+                intervallo = (col_data, data_inizio, data_fine) if data_inizio and data_fine else None
+                dati = snapshot.leggi(colonne, intervallo=intervallo)
+                if intervallo is None:
+                    valide = [i for i, d in enumerate(dati[col_data]) if d is not None]
+                    dati = {nome: [valori[i] for i in valide] for nome, valori in dati.items()}
+                return dati
+            except Exception as e:
+                logging.warning(f"Snapshot appuntamenti non disponibile, lettura dal DBF: {e}")
 
-    def leggi_tabella_dbf(self, percorso_file):
+        recnos = None
+        if data_inizio and data_fine:
+            filtro_data = lambda d: d is not None and data_inizio <= d <= data_fine
+            recnos = self._recnos_appuntamenti(data_inizio, data_fine)
+        else:
+            filtro_data = lambda d: d is not None
+
+        return leggi_colonne(
+            self.path_appuntamenti,
+            colonne=colonne,
+            filtri={col_data: filtro_data},
+            recnos=recnos
+        )
+
+    @property
+    def pazienti(self):
+        """Indice pazienti condiviso (vedi core.dbf_index.IndicePazienti)."""
+        return indice_pazienti(self.path_anagrafica)
+
+    @property
+    def richiami(self):
+        """Indice richiami condiviso (vedi core.dbf_index.IndiceRichiami)."""
+        return indice_richiami(self.path_anagrafica)
+
+    def _recnos_appuntamenti(self, inizio, fine):
+        """
+        Record degli appuntamenti tra due date tramite l'indice sidecar.
+        Restituisce None se l'indice non è disponibile (si ripiega sulla scansione completa).
+        """
         try:
-            dbf_table = dbf.Table(percorso_file, codepage='cp1252')
-            dbf_table.open()
-            records = []
-
-            for record in dbf_table:
-                try:
-                    record_dict = {field: record[field] for field in dbf_table.field_names}
-                    records.append(record_dict)
-                except Exception as field_error:
-                    logging.warning(f"Errore lettura record in {percorso_file}: {field_error}")
-                    continue
-
-            df = pd.DataFrame(records)
-            dbf_table.close()
+            with self._lock_indice:
+                # Un DBHandler può essere condiviso dai job dello scheduler: l'indice va creato una volta sola
+                if self._indice_date is None:
+                    self._indice_date = IndiceDate(self.path_appuntamenti, COLONNE['appuntamenti']['data'])
+            return self._indice_date.recnos_tra(inizio, fine)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Indice date non disponibile, scansione completa: {e}")
+            return None
+
+    def leggi_tabella_dbf(self, percorso_file, colonne=None, filtri=None, recnos=None):
+        """
+        Legge una tabella DBF in un DataFrame indicizzato per numero di record.
+
+        Args:
+            percorso_file (str): percorso del file DBF
+            colonne (list[str], opzionale): campi da decodificare (default: tutti)
+            filtri (dict[str, callable], opzionale): predicati per campo applicati
+                prima di decodificare il resto del record
+            recnos (list[int], opzionale): limita la lettura a questi record
+        """
+        try:
+            dati = leggi_colonne(percorso_file, colonne=colonne, filtri=filtri, codepage='cp1252', recnos=recnos)
+            recno = dati.pop('RECNO')
+            df = pd.DataFrame(dati, index=pd.Index(recno, name='RECNO'))
             logging.info(f"DBF letto: {percorso_file} → {len(df)} record.")
             return df
 
-        except dbf.DbfError as e:
-            logging.error(f"Errore lettura DBF '{percorso_file}': {e}")
         except FileNotFoundError:
             logging.error(f"File DBF non trovato: {percorso_file}")
+        except KeyError as e:
+            logging.error(f"Colonne mancanti in '{percorso_file}': {e}")
+        except (ValueError, struct.error) as e:
+            logging.error(f"Errore lettura DBF '{percorso_file}': {e}")
         except Exception as e:
             logging.error(f"Errore imprevisto '{percorso_file}': {e}")
         return pd.DataFrame()
 
+    def _df_appuntamenti(self, data_inizio, data_fine):
+        try:
+            dati = self._leggi_appuntamenti(list(COLONNE['appuntamenti'].values()), data_inizio, data_fine)
+            recno = dati.pop('RECNO')
+            df = pd.DataFrame(dati, index=pd.Index(recno, name='RECNO'))
+            logging.info(f"DBF letto: {self.path_appuntamenti} → {len(df)} record.")
+            return df
+        except FileNotFoundError:
+            logging.error(f"File DBF non trovato: {self.path_appuntamenti}")
+        except KeyError as e:
+            logging.error(f"Colonne mancanti in '{self.path_appuntamenti}': {e}")
+        except Exception as e:
+            logging.error(f"Errore lettura appuntamenti '{self.path_appuntamenti}': {e}")
+        return pd.DataFrame()
+
     def estrai_appuntamenti_domani(self, data_test=None):
-        df = self.leggi_tabella_dbf(self.path_appuntamenti)
         col_data = COLONNE['appuntamenti']['data']
+        target_date = data_test or (date.today() + timedelta(days=1))
 
-        if df.empty or col_data not in df.columns:
+        df = self._df_appuntamenti(target_date, target_date)
+
+        if col_data not in df.columns:
             logging.warning("DBF appuntamenti vuoto o colonna data mancante.")
             return pd.DataFrame()
 
         df[col_data] = pd.to_datetime(df[col_data], errors='coerce').dt.date
-        target_date = data_test or (date.today() + timedelta(days=1))
-
-        filtrati = df[
-            (df[col_data] == target_date) & df[col_data].notna()
-        ]
+        filtrati = df[df[col_data].notna()]
 
         logging.info(f"Trovati {len(filtrati)} appuntamenti per {target_date}")
         return filtrati
 
     def estrai_appuntamenti_mese(self, month, year):
-        df = self.leggi_tabella_dbf(self.path_appuntamenti)
         col_data = COLONNE['appuntamenti']['data']
 
+        df = self._df_appuntamenti(*limiti_mese(month, year))
+
         if df.empty or col_data not in df.columns:
             return pd.DataFrame()
 
         df[col_data] = pd.to_datetime(df[col_data], errors='coerce')
-        return df[(df[col_data].dt.month == month) & (df[col_data].dt.year == year)].copy()
+        return df
 
     def recupera_dati_pazienti(self, lista_id_pazienti):
         if not lista_id_pazienti:
             return pd.DataFrame()
 
-        df = self.leggi_tabella_dbf(self.path_anagrafica)
         cols = COLONNE['pazienti']
-        richieste = [cols['id'], cols['nome'], cols['cellulare'], cols['telefono']]
-
-        if any(c not in df.columns for c in richieste):
-            logging.error(f"Colonne mancanti in anagrafica: {richieste}")
+        try:
+            trovati = self.pazienti.cerca(lista_id_pazienti)
+        except FileNotFoundError:
+            logging.error(f"File DBF non trovato: {self.path_anagrafica}")
+            return pd.DataFrame()
+        except Exception as e:
+            logging.error(f"Errore lettura anagrafica '{self.path_anagrafica}': {e}")
             return pd.DataFrame()
 
-        df[cols['id']] = df[cols['id']].astype(str).str.strip()
-        df_filtrati = df[df[cols['id']].isin([str(x).strip() for x in lista_id_pazienti])].copy()
+        righe = [
+            {
+                cols['id']: pid,
+                'nome_completo': p['nome'].title(),
+                'numero_contatto': p['cellulare'] or p['telefono'],
+            }
+            for pid, p in trovati.items()
+        ]
+        return pd.DataFrame(righe, columns=[cols['id'], 'nome_completo', 'numero_contatto'])
+
+    def _appuntamenti_con_pazienti(self, data_inizio=None, data_fine=None, colonne=None):
+        """
+        Legge gli appuntamenti (tutti o tra due date incluse) e li unisce in un solo
+        passaggio ai dati di contatto tramite l'indice pazienti (hash join).
 
-        df_filtrati['nome_completo'] = df_filtrati[cols['nome']].fillna('').str.strip().str.title()
-        df_filtrati['numero_contatto'] = ''
+        Returns:
+            dict[str, list]: colonne degli appuntamenti più 'PAZIENTE',
+            'nome_completo', 'numero_contatto' e 'RECNO'
+        """
+        col = COLONNE['appuntamenti']
+        colonne = list(colonne or COLONNE['appuntamenti'].values())
+        if col['id_paziente'] not in colonne:
+            colonne.append(col['id_paziente'])
 
-        mask_cell = df_filtrati[cols['cellulare']].notna() & (df_filtrati[cols['cellulare']].str.strip() != '')
-        df_filtrati.loc[mask_cell, 'numero_contatto'] = df_filtrati.loc[mask_cell, cols['cellulare']]
+        apps = self._leggi_appuntamenti(colonne, data_inizio, data_fine)
 
-        mask_fisso = (df_filtrati['numero_contatto'] == '') & df_filtrati[cols['telefono']].notna()
-        df_filtrati.loc[mask_fisso, 'numero_contatto'] = df_filtrati.loc[mask_fisso, cols['telefono']]
+        pazienti = self.pazienti
+        pazienti.aggiorna()
+        trovati = [pazienti.get(pid) for pid in apps[col['id_paziente']]]
+        apps['PAZIENTE'] = [p['nome'] if p else '' for p in trovati]
+        apps['nome_completo'] = [p['nome'].title() if p else None for p in trovati]
+        apps['numero_contatto'] = [(p['cellulare'] or p['telefono']) if p else None for p in trovati]
+        return apps
 
-        return df_filtrati[[cols['id'], 'nome_completo', 'numero_contatto']]
+    def get_appuntamenti_con_pazienti(self, data_inizio, data_fine=None):
+        """
+        Appuntamenti tra data_inizio e data_fine (incluse) già uniti ai dati
+        di contatto del paziente.
 
-    def get_appointments(self, month=None, year=None):
+        Returns:
+            pd.DataFrame: colonne di COLONNE['appuntamenti'] più 'nome_completo'
+            e 'numero_contatto', indicizzato per RECNO
+        """
+        data_fine = data_fine or data_inizio
+        try:
+            dati = self._appuntamenti_con_pazienti(data_inizio, data_fine)
+            recno = dati.pop('RECNO')
+            dati.pop('PAZIENTE')
+            df = pd.DataFrame(dati, index=pd.Index(recno, name='RECNO'))
+            logging.info(f"Trovati {len(df)} appuntamenti dal {data_inizio} al {data_fine}")
+            return df
+        except FileNotFoundError as e:
+            logging.error(f"File DBF non trovato: {e.filename}")
+        except Exception as e:
+            logging.error(f"Errore lettura appuntamenti con pazienti: {e}")
+        return pd.DataFrame()
+
+    def get_appointments_frame(self, month=None, year=None, data_inizio=None, data_fine=None):
+        """
+        Appuntamenti (di un mese, di un intervallo di date incluse o tutti) come
+        DataFrame con le stesse chiavi di get_appointments, costruito per colonne.
+
+        Returns:
+            pd.DataFrame: colonne DATA, ORA_INIZIO, ORA_FINE, TIPO, STUDIO, NOTE,
+            DESCRIZIONE, PAZIENTE, ID_PAZIENTE, DATA_INSERIMENTO, RECNO
+        """
         col = COLONNE['appuntamenti']
-        paz = COLONNE['pazienti']
+        if month and year:
+            data_inizio, data_fine = limiti_mese(month, year)
+        apps = self._appuntamenti_con_pazienti(data_inizio, data_fine)
 
-        appointments = []
-        patients_dict = {}
+        def testo(nome):
+            return pd.Series(apps[nome], dtype=object).fillna('').astype(str).str.strip().astype(object)
 
-        try:
-            pazienti = dbf.Table(self.path_anagrafica, codepage='cp1252')
-            pazienti.open()
-            for r in pazienti:
-                pid = str(r[paz['id']]).strip()
-                name = str(r[paz['nome']]).strip() if r[paz['nome']] else ''
-                if pid:
-                    patients_dict[pid] = name
-            pazienti.close()
-
-            apps = dbf.Table(self.path_appuntamenti, codepage='cp1252')
-            apps.open()
-            for r in apps:
-                if not r[col['data']]:
-                    continue
-                app_date = r[col['data']]
-                if month and year and (app_date.month != month or app_date.year != year):
-                    continue
-                idpaz = str(r[col['id_paziente']]).strip()
-                appointments.append({
-                    'DATA': app_date,
-                    'ORA_INIZIO': float(r[col['ora_inizio']] or 0),
-                    'ORA_FINE': float(r[col['ora_fine']] or 0),
-                    'TIPO': r[col['tipo']].strip() if r[col['tipo']] else '',
-                    'STUDIO': r[col['studio']] or 1,
-                    'NOTE': r[col['note']].strip() if r[col['note']] else '',
-                    'DESCRIZIONE': r[col['descrizione']].strip() if r[col['descrizione']] else '',
-                    'PAZIENTE': patients_dict.get(idpaz, '')
-                })
-            apps.close()
-            return appointments
+        def orario(nome):
+            return pd.to_numeric(pd.Series(apps[nome], dtype=object), errors='coerce').fillna(0).astype(float)
 
+        studio = pd.to_numeric(pd.Series(apps[col['studio']], dtype=object), errors='coerce').fillna(0).astype(int)
+        return pd.DataFrame({
+            'DATA': pd.Series(apps[col['data']], dtype=object),
+            'ORA_INIZIO': orario(col['ora_inizio']),
+            'ORA_FINE': orario(col['ora_fine']),
+            'TIPO': testo(col['tipo']),
+            'STUDIO': studio.where(studio != 0, 1),
+            'NOTE': testo(col['note']),
+            'DESCRIZIONE': testo(col['descrizione']),
+            'PAZIENTE': pd.Series(apps['PAZIENTE'], dtype=object),
+            'ID_PAZIENTE': testo(col['id_paziente']),
+            'DATA_INSERIMENTO': pd.Series(apps[col['data_inserimento']], dtype=object),
+            'RECNO': pd.Series(apps['RECNO'], dtype=int),
+        })
+
+    def get_appointments(self, month=None, year=None):
+        try:
+            return self.get_appointments_frame(month, year).to_dict('records')
         except Exception as e:
             logging.error(f"Errore lettura appuntamenti: {e}")
             return []
 
+    def get_recalls_frame(self, data_inizio=None, data_fine=None, month=None, year=None, tipo=None):
+        """
+        Pazienti da richiamare con data effettiva del richiamo tra data_inizio e
+        data_fine (incluse) o nel mese indicato (default anno corrente), ed
+        eventualmente del tipo indicato (codice di TIPO_RICHIAMI).
+
+        Returns:
+            pd.DataFrame: colonne di valuta_richiami (ID_PAZIENTE, NOME, TELEFONO,
+            DATA_RICHIAMO, TIPI, TIPO_RICHIAMO, RECNO) più quelle dell'anagrafica
+            e dei richiami, ordinate per data
+        """
+        if month:
+            data_inizio, data_fine = limiti_mese(month, year or date.today().year)
+        return self.richiami.tra(data_inizio, data_fine, tipo)
+
+    def get_recalls_data(self):
+        """
+        Returns:
+            list[dict]: tutti i pazienti da richiamare (vedi get_recalls_frame)
+        """
+        return self.get_recalls()
+
+    def get_recalls(self, month=None, tipo=None, year=None, data_inizio=None, data_fine=None):
+        """Come get_recalls_frame, come lista di dizionari."""
+        try:
+            return self.get_recalls_frame(data_inizio, data_fine, month, year, tipo).to_dict('records')
+        except FileNotFoundError:
+            logging.error(f"File DBF non trovato: {self.path_anagrafica}")
+        except Exception as e:
+            logging.error(f"Errore lettura richiami '{self.path_anagrafica}': {e}")
+        return []
+
     def test_connessione(self):
         """Debug connessione DBF"""
         self.leggi_tabella_dbf(self.path_appuntamenti)
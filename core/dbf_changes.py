@@ -0,0 +1,143 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+from core.dbf_reader import TabellaDBF
+from core.dbf_index import firma_file, percorso_sidecar, scrivi_atomico
+
+# 2: impronte calcolate con numpy (TabellaDBF.checksum_record) invece di CRC32
+VERSIONE_STATO = 2
+
+
+class Modifiche:
+    """
+    Differenza tra lo stato del DBF all'ultima conferma e quello attuale.
+
+    Attributes:
+        aggiunti (list[int]): record nuovi (o ripristinati dopo una cancellazione)
+        modificati (list[int]): record esistenti con contenuto cambiato
+        cancellati (list[int]): record marcati come cancellati o non più presenti
+        completo (bool): True se non esisteva uno stato precedente; in questo
+            caso tutti i record attivi sono riportati come aggiunti
+    """
+
+    def __init__(self, aggiunti, modificati, cancellati, completo=False):
+        self.aggiunti = aggiunti
+        self.modificati = modificati
+        self.cancellati = cancellati
+        self.completo = completo
+
+    @property
+    def da_elaborare(self):
+        """Record aggiunti o modificati, da rielaborare."""
+        return set(self.aggiunti) | set(self.modificati)
+
+    def __bool__(self):
+        return bool(self.aggiunti or self.modificati or self.cancellati)
+
+    def __repr__(self):
+        return (f"Modifiche(aggiunti={len(self.aggiunti)}, modificati={len(self.modificati)}, "
+                f"cancellati={len(self.cancellati)}, completo={self.completo})")
+
+
+class TracciatoreModifiche:
+    """
+    Rileva i record aggiunti, modificati o cancellati in un DBF rispetto all'ultima esecuzione.
+
+    Lo stato (numero di record e impronta di ogni record) è salvato in un sidecar
+    per ciascun nome: usare un nome diverso per ogni consumatore, perché ognuno
+    conferma lo stato solo quando ha elaborato con successo la propria differenza.
+    """
+
+    def __init__(self, percorso_dbf, nome='default', cartella=None, codepage='cp1252'):
+        self.percorso_dbf = percorso_dbf
+        self.nome = nome
+        self.codepage = codepage
+        self.percorso_stato = percorso_sidecar(percorso_dbf, f"{nome}.chk", cartella)
+        self._in_attesa = None
+
+    def _carica(self):
+        if not os.path.exists(self.percorso_stato):
+            return None
+        try:
+            with open(self.percorso_stato, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                if meta.get('versione') != VERSIONE_STATO:
+                    return None
+                n = meta['numero_record']
+                dati = f.read()
+            checksum = np.frombuffer(dati[:n * 4], dtype=np.uint32)
+            cancellati = np.frombuffer(dati[n * 4:n * 5], dtype=np.bool_)
+            if len(checksum) != n or len(cancellati) != n:
+                raise ValueError("stato troncato")
+            return meta, checksum, cancellati
+        except Exception as e:
+            logging.warning(f"Stato modifiche non leggibile ({self.percorso_stato}), verrà ricreato: {e}")
+            return None
+
+    def rileva(self):
+        """
+        Confronta il DBF con lo stato confermato. Lo stato non viene aggiornato
+        finché non si chiama conferma().
+
+        Returns:
+            Modifiche
+        """
+        firma = firma_file(self.percorso_dbf)
+        precedente = self._carica()
+
+        if precedente is not None and precedente[0]['firma'] == firma:
+            self._in_attesa = None
+            return Modifiche([], [], [])
+
+        with TabellaDBF(self.percorso_dbf, codepage=self.codepage) as tabella:
+            checksum = tabella.checksum_record()
+            cancellati = tabella.byte_campi([])[:, 0] == 0x2A
+            lunghezza_record = tabella.lunghezza_record
+
+        self._in_attesa = (firma, lunghezza_record, checksum, cancellati)
+        attivi = ~cancellati
+
+        if precedente is None or precedente[0].get('lunghezza_record') != lunghezza_record:
+            return Modifiche(np.nonzero(attivi)[0].tolist(), [], [], completo=True)
+
+        _, vecchi_checksum, vecchi_cancellati = precedente
+        n_vecchi, n_nuovi = len(vecchi_checksum), len(checksum)
+        comuni = min(n_vecchi, n_nuovi)
+
+        vecchi_attivi = ~vecchi_cancellati[:comuni]
+        ora_attivi = attivi[:comuni]
+        diversi = checksum[:comuni] != vecchi_checksum[:comuni]
+
+        aggiunti = np.nonzero(ora_attivi & ~vecchi_attivi)[0].tolist()
+        aggiunti += (np.nonzero(attivi[comuni:])[0] + comuni).tolist()
+        modificati = np.nonzero(diversi & ora_attivi & vecchi_attivi)[0].tolist()
+        cancellati_ora = np.nonzero(vecchi_attivi & ~ora_attivi)[0].tolist()
+        # Record spariti in coda (es. dopo un PACK della tabella)
+        cancellati_ora += (np.nonzero(~vecchi_cancellati[comuni:])[0] + comuni).tolist()
+
+        modifiche = Modifiche(aggiunti, modificati, cancellati_ora)
+        logging.info(f"Modifiche {os.path.basename(self.percorso_dbf)} [{self.nome}]: {modifiche}")
+        return modifiche
+
+    def conferma(self):
+        """
+        Salva come riferimento lo stato letto dall'ultima chiamata a rileva().
+        """
+        if self._in_attesa is None:
+            return
+        firma, lunghezza_record, checksum, cancellati = self._in_attesa
+        meta = {
+            'versione': VERSIONE_STATO,
+            'dbf': os.path.abspath(self.percorso_dbf),
+            'firma': firma,
+            'lunghezza_record': lunghezza_record,
+            'numero_record': int(len(checksum)),
+        }
+        scrivi_atomico(
+            self.percorso_stato,
+            json.dumps(meta).encode('utf-8') + b'\n' + checksum.astype(np.uint32).tobytes() + cancellati.astype(np.bool_).tobytes()
+        )
+        self._in_attesa = None
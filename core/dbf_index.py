@@ -0,0 +1,382 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config.constants import PATH_CACHE, COLONNE, TIPO_RICHIAMI
+from core.dbf_reader import TabellaDBF, leggi_colonne
+from core.recall_rules import valuta_richiami, matrice_tipi
+
+VERSIONE_INDICE = 1
+
+
+def firma_file(percorso_file):
+    """
+    Restituisce (dimensione, mtime in ns) del file, usata per invalidare indici e cache.
+    """
+    st = os.stat(percorso_file)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def percorso_sidecar(percorso_file, suffisso, cartella=None):
+    """
+    Percorso del file di cache associato a un DBF, univoco anche per DBF omonimi
+    in cartelle diverse.
+    """
+    cartella = cartella or PATH_CACHE
+    assoluto = os.path.abspath(percorso_file)
+    impronta = hashlib.md5(assoluto.encode('utf-8')).hexdigest()[:8]
+    nome = os.path.basename(percorso_file)
+    return os.path.join(cartella, f"{nome}.{impronta}.{suffisso}")
+
+
+def file_temporaneo(percorso):
+    """
+    Crea un file temporaneo con nome univoco nella cartella di percorso, così
+    più scrittori (thread dello scheduler, GUI, script) non si sovrascrivono.
+
+    Returns:
+        tuple: (descrittore aperto, percorso del temporaneo)
+    """
+    cartella = os.path.dirname(percorso) or '.'
+    os.makedirs(cartella, exist_ok=True)
+    return tempfile.mkstemp(dir=cartella, prefix=os.path.basename(percorso) + '.', suffix='.tmp')
+
+
+def scrivi_atomico(percorso, dati):
+    """Scrive il file tramite un temporaneo e os.replace, per non lasciarlo mai a metà."""
+    descrittore, temporaneo = file_temporaneo(percorso)
+    try:
+        with os.fdopen(descrittore, 'wb') as f:
+            f.write(dati)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        raise
+
+
+def _chiavi_da_byte(grezzi):
+    """
+    Converte la matrice [flag, AAAAMMGG] in interi AAAAMMGG (0 per record
+    cancellati o con data vuota/non valida).
+    """
+    if len(grezzi) == 0:
+        return np.zeros(0, dtype=np.int32)
+    cifre = grezzi[:, 1:9].astype(np.int32) - 48
+    valide = ((cifre >= 0) & (cifre <= 9)).all(axis=1) & (grezzi[:, 0] != 0x2A)
+    pesi = 10 ** np.arange(7, -1, -1, dtype=np.int32)
+    chiavi = (cifre * pesi).sum(axis=1).astype(np.int32)
+    chiavi[~valide] = 0
+    return chiavi
+
+
+def _chiave(giorno):
+    return giorno.year * 10000 + giorno.month * 100 + giorno.day
+
+
+class IndiceDate:
+    """
+    Indice persistente che associa un campo data di un DBF ai numeri di record.
+
+    Il sidecar conserva i byte grezzi del campo (e il flag di cancellazione) per
+    ogni record: quando dimensione o mtime del DBF cambiano, viene riletto solo
+    quel campo e aggiornate le voci dei record aggiunti o modificati, senza
+    decodificare la tabella. Le interrogazioni per intervallo costano O(log n + k).
+    """
+
+    def __init__(self, percorso_dbf, campo_data, cartella=None, codepage='cp1252'):
+        self.percorso_dbf = percorso_dbf
+        self.campo_data = campo_data.upper()
+        self.codepage = codepage
+        self.percorso_indice = percorso_sidecar(percorso_dbf, f"{self.campo_data}.idx", cartella)
+
+        self.firma = None
+        self._layout = None
+        self._grezzi = None
+        self._chiavi_ordinate = None
+        self._ordine = None
+        self._lock = threading.Lock()
+
+    def _carica(self):
+        if not os.path.exists(self.percorso_indice):
+            return False
+        try:
+            with open(self.percorso_indice, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                if meta.get('versione') != VERSIONE_INDICE or meta.get('campo') != self.campo_data:
+                    return False
+                grezzi = np.frombuffer(f.read(), dtype=np.uint8)
+            self._grezzi = grezzi.reshape(meta['numero_record'], 9).copy()
+            self.firma = meta['firma']
+            self._layout = meta['layout']
+            return True
+        except Exception as e:
+            logging.warning(f"Indice date non leggibile ({self.percorso_indice}), verrà ricostruito: {e}")
+            return False
+
+    def _salva(self, layout):
+        meta = {
+            'versione': VERSIONE_INDICE,
+            'dbf': os.path.abspath(self.percorso_dbf),
+            'campo': self.campo_data,
+            'firma': self.firma,
+            'layout': layout,
+            'numero_record': int(len(self._grezzi)),
+        }
+        scrivi_atomico(
+            self.percorso_indice,
+            json.dumps(meta).encode('utf-8') + b'\n' + self._grezzi.tobytes()
+        )
+
+    def _ordina(self):
+        chiavi = _chiavi_da_byte(self._grezzi)
+        self._ordine = np.argsort(chiavi, kind='stable')
+        self._chiavi_ordinate = chiavi[self._ordine]
+
+    def aggiorna(self):
+        """
+        Allinea l'indice al DBF se è cambiato dall'ultimo aggiornamento.
+
+        Returns:
+            int: numero di record aggiunti o modificati (0 se già allineato)
+        """
+        with self._lock:
+            return self._aggiorna()
+
+    def _aggiorna(self):
+        firma = firma_file(self.percorso_dbf)
+        if self._grezzi is None:
+            self._carica()
+        if self._grezzi is not None and firma == self.firma:
+            if self._ordine is None:
+                self._ordina()
+            return 0
+
+        with TabellaDBF(self.percorso_dbf, codepage=self.codepage) as tabella:
+            campo = tabella.campi.get(self.campo_data)
+            if campo is None:
+                raise KeyError(f"Campo non presente in {self.percorso_dbf}: {self.campo_data}")
+            if campo.tipo != 'D':
+                raise ValueError(f"Il campo {self.campo_data} non è di tipo data ({campo.tipo})")
+            layout = [tabella.lunghezza_intestazione, tabella.lunghezza_record, campo.offset, campo.lunghezza]
+            nuovi = tabella.byte_campi([self.campo_data])[:, :9]
+
+        if self._grezzi is None or self._layout != layout:
+            cambiati = len(nuovi)
+        else:
+            comuni = min(len(nuovi), len(self._grezzi))
+            cambiati = int((nuovi[:comuni] != self._grezzi[:comuni]).any(axis=1).sum()) + abs(len(nuovi) - len(self._grezzi))
+
+        self._grezzi = nuovi
+        self._layout = layout
+        self.firma = firma
+        self._ordina()
+
+        try:
+            self._salva(layout)
+        except OSError as e:
+            logging.warning(f"Impossibile salvare l'indice date {self.percorso_indice}: {e}")
+        logging.info(f"Indice date {os.path.basename(self.percorso_dbf)}: {cambiati} record aggiornati su {len(nuovi)}")
+        return cambiati
+
+    def recnos_tra(self, inizio, fine):
+        """
+        Numeri di record con data compresa tra inizio e fine (inclusi),
+        ordinati per data e poi per posizione nel file.
+        """
+        with self._lock:
+            self._aggiorna()
+            da = np.searchsorted(self._chiavi_ordinate, _chiave(inizio), side='left')
+            a = np.searchsorted(self._chiavi_ordinate, _chiave(fine), side='right')
+            return self._ordine[da:a].tolist()
+
+
+class IndicePazienti:
+    """
+    Indice in memoria dell'anagrafica pazienti per codice (DB_CODE).
+
+    Contiene solo i campi di contatto; viene ricostruito quando dimensione o
+    mtime del DBF cambiano. Le ricerche per codice costano O(1).
+    """
+
+    def __init__(self, percorso_dbf, colonne=None, codepage='cp1252'):
+        self.percorso_dbf = percorso_dbf
+        self.colonne = colonne or COLONNE['pazienti']
+        self.codepage = codepage
+        self.firma = None
+        self._pazienti = {}
+        self._lock = threading.Lock()
+
+    def aggiorna(self):
+        """
+        Ricostruisce l'indice se il DBF è cambiato.
+
+        Returns:
+            bool: True se l'indice è stato ricostruito
+        """
+        with self._lock:
+            firma = firma_file(self.percorso_dbf)
+            if firma == self.firma:
+                return False
+
+            col = self.colonne
+            campi = [col['id'], col['nome'], col['cellulare'], col['telefono']]
+            dati = leggi_colonne(self.percorso_dbf, colonne=campi, codepage=self.codepage)
+
+            pazienti = {}
+            for pid, nome, cellulare, telefono in zip(*(dati[c.upper()] for c in campi)):
+                pid = str(pid or '').strip()
+                if pid:
+                    pazienti[pid] = {
+                        'nome': (nome or '').strip(),
+                        'cellulare': (cellulare or '').strip(),
+                        'telefono': (telefono or '').strip(),
+                    }
+
+            self._pazienti = pazienti
+            self.firma = firma
+            logging.info(f"Indice pazienti {os.path.basename(self.percorso_dbf)}: {len(pazienti)} pazienti")
+            return True
+
+    def get(self, id_paziente, default=None):
+        return self._pazienti.get(str(id_paziente).strip(), default)
+
+    def cerca(self, lista_id):
+        """
+        Aggiorna l'indice se necessario e restituisce i pazienti trovati.
+
+        Returns:
+            dict[str, dict]: codice → {'nome', 'cellulare', 'telefono'}
+        """
+        self.aggiorna()
+        trovati = {}
+        for pid in lista_id:
+            pid = str(pid).strip()
+            paziente = self._pazienti.get(pid)
+            if paziente is not None:
+                trovati[pid] = paziente
+        return trovati
+
+    def __contains__(self, id_paziente):
+        return str(id_paziente).strip() in self._pazienti
+
+    def __len__(self):
+        return len(self._pazienti)
+
+
+class IndiceRichiami:
+    """
+    Indice in memoria dei richiami dell'anagrafica pazienti.
+
+    Per ogni paziente da richiamare (DB_PARICHI) calcola una volta la data
+    effettiva del prossimo richiamo: la prima tra DB_PAMODA1 e DB_PAMODA2 se
+    presenti, altrimenti ultima visita (DB_PAULTVI) più DB_PARITAR mesi.
+    I richiami sono ordinati per data, con un ordinamento separato per ogni
+    tipo di DB_PARIMOT (che può contenere più codici, es. "15"), così le
+    interrogazioni per intervallo, mese e tipo costano O(log n + k).
+    L'indice viene ricostruito quando dimensione o mtime del DBF cambiano.
+    """
+
+    def __init__(self, percorso_dbf, codepage='cp1252'):
+        self.percorso_dbf = percorso_dbf
+        self.codepage = codepage
+        self.firma = None
+        self._richiami = pd.DataFrame()
+        self._chiavi = np.zeros(0, dtype=np.int32)
+        self._per_tipo = {}
+        self._lock = threading.Lock()
+
+    def aggiorna(self):
+        """
+        Ricostruisce l'indice se il DBF è cambiato.
+
+        Returns:
+            bool: True se l'indice è stato ricostruito
+        """
+        with self._lock:
+            return self._aggiorna()
+
+    def _aggiorna(self):
+        firma = firma_file(self.percorso_dbf)
+        if firma == self.firma:
+            return False
+
+        col, paz = COLONNE['richiami'], COLONNE['pazienti']
+        campi = [col['id_paziente'], paz['nome'], paz['cellulare'], paz['telefono'], col['da_richiamare'],
+                 col['mesi'], col['tipo'], col['data1'], col['data2'], col['ultima_visita']]
+        df = pd.DataFrame(leggi_colonne(self.percorso_dbf, colonne=campi, codepage=self.codepage))
+
+        # Le colonne che dipendono dalla data di oggi non si conservano in un indice di lunga durata
+        valutati = valuta_richiami(df).drop(columns=['GIORNI_MANCANTI', 'SCADUTO', 'IN_SCADENZA'])
+        # Accanto al risultato compatto restano le colonne del DBF, usate da messaggi e anteprima
+        df = valutati.merge(df, on='RECNO', how='left')
+
+        effettiva = pd.to_datetime(df['DATA_RICHIAMO'])
+        self._chiavi = (effettiva.dt.year * 10000 + effettiva.dt.month * 100 + effettiva.dt.day).to_numpy(dtype=np.int32)
+        tipi = matrice_tipi(df['TIPI'])
+        self._per_tipo = {codice: np.flatnonzero(tipi[codice].to_numpy()) for codice in TIPO_RICHIAMI}
+        self._richiami = df
+        self.firma = firma
+        logging.info(f"Indice richiami {os.path.basename(self.percorso_dbf)}: {len(df)} pazienti da richiamare")
+        return True
+
+    def _posizioni(self, inizio=None, fine=None, tipo=None):
+        da = 0 if inizio is None else np.searchsorted(self._chiavi, _chiave(inizio), side='left')
+        a = len(self._chiavi) if fine is None else np.searchsorted(self._chiavi, _chiave(fine), side='right')
+        if tipo is None:
+            return np.arange(da, a)
+        posizioni = self._per_tipo.get(str(tipo), np.zeros(0, dtype=np.int64))
+        # Le posizioni di ogni tipo sono crescenti, quindi ordinate per data come _chiavi
+        return posizioni[np.searchsorted(posizioni, da, side='left'):np.searchsorted(posizioni, a, side='left')]
+
+    def tra(self, inizio=None, fine=None, tipo=None):
+        """
+        Richiami con data effettiva tra inizio e fine (inclusi, None = senza limite),
+        eventualmente di un solo tipo (codice di TIPO_RICHIAMI), ordinati per data.
+
+        Returns:
+            pd.DataFrame: colonne di valuta_richiami (senza quelle relative a oggi)
+                più le colonne del DBF (anagrafica e richiamo)
+        """
+        with self._lock:
+            self._aggiorna()
+            return self._richiami.iloc[self._posizioni(inizio, fine, tipo)].reset_index(drop=True)
+
+    def __len__(self):
+        return len(self._richiami)
+
+
+_indici_pazienti = {}
+_indici_richiami = {}
+_lock_indici = threading.Lock()
+
+
+def indice_pazienti(percorso_dbf):
+    """
+    Restituisce l'indice pazienti condiviso per il DBF indicato, così che tutte
+    le istanze di DBHandler del processo usino la stessa copia.
+    """
+    chiave = os.path.abspath(percorso_dbf)
+    with _lock_indici:
+        indice = _indici_pazienti.get(chiave)
+        if indice is None:
+            indice = _indici_pazienti[chiave] = IndicePazienti(percorso_dbf)
+        return indice
+
+
+def indice_richiami(percorso_dbf):
+    """Restituisce l'indice richiami condiviso per l'anagrafica indicata."""
+    chiave = os.path.abspath(percorso_dbf)
+    with _lock_indici:
+        indice = _indici_richiami.get(chiave)
+        if indice is None:
+            indice = _indici_richiami[chiave] = IndiceRichiami(percorso_dbf)
+        return indice
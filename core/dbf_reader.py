@@ -0,0 +1,506 @@
+import os
+import mmap
+import struct
+import logging
+import numpy as np
+from datetime import date, datetime, timedelta
+
+# Numero di record restituiti per ogni blocco da iter_blocchi
+RECORD_PER_BLOCCO = 4096
+
+TIPI_MEMO = ('M', 'G', 'P')
+
+
+class CampoDBF:
+    """
+    Descrittore di un campo DBF: nome, tipo e posizione nel record.
+    """
+    __slots__ = ('nome', 'tipo', 'offset', 'lunghezza', 'decimali')
+
+    def __init__(self, nome, tipo, offset, lunghezza, decimali):
+        self.nome = nome
+        self.tipo = tipo
+        self.offset = offset
+        self.lunghezza = lunghezza
+        self.decimali = decimali
+
+    def __repr__(self):
+        return f"CampoDBF({self.nome!r}, {self.tipo!r}, offset={self.offset}, lunghezza={self.lunghezza})"
+
+
+def leggi_intestazione(buffer):
+    """
+    Analizza l'intestazione e i descrittori dei campi di un DBF.
+
+    Args:
+        buffer: bytes o mmap che inizia con l'intestazione del file
+
+    Returns:
+        tuple: (numero_record, lunghezza_intestazione, lunghezza_record, dict[str, CampoDBF])
+    """
+    if len(buffer) < 32:
+        raise ValueError("Intestazione DBF incompleta")
+
+    numero_record, lunghezza_intestazione, lunghezza_record = struct.unpack('<IHH', buffer[4:12])
+
+    campi = {}
+    offset = 1  # il primo byte del record è il flag di cancellazione
+    posizione = 32
+    while posizione + 32 <= min(len(buffer), lunghezza_intestazione):
+        descrittore = buffer[posizione:posizione + 32]
+        if descrittore[0] == 0x0D:
+            break
+        nome = descrittore[:11].split(b'\x00', 1)[0].decode('ascii', errors='replace').strip().upper()
+        tipo = chr(descrittore[11])
+        lunghezza = descrittore[16]
+        decimali = descrittore[17]
+        if tipo == 'C':
+            # Nei campi carattere il byte dei decimali estende la lunghezza
+            lunghezza += decimali << 8
+            decimali = 0
+        campi[nome] = CampoDBF(nome, tipo, offset, lunghezza, decimali)
+        offset += lunghezza
+        posizione += 32
+
+    return numero_record, lunghezza_intestazione, lunghezza_record, campi
+
+
+def _mappa_file(f):
+    """Mappa in memoria un file aperto in binario (None se vuoto)."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class LettoreMemo:
+    """
+    Legge i campi memo dal file .FPT (Visual FoxPro) o .DBT (dBase III) associato.
+    """
+
+    def __init__(self, percorso_dbf, codepage):
+        self.codepage = codepage
+        self.file = None
+        self.mm = None
+        self.formato = None
+        self.dimensione_blocco = 512
+
+        base = os.path.splitext(percorso_dbf)[0]
+        for estensione, formato in (('.FPT', 'fpt'), ('.fpt', 'fpt'), ('.DBT', 'dbt'), ('.dbt', 'dbt')):
+            if os.path.exists(base + estensione):
+                self.file = open(base + estensione, 'rb')
+                self.mm = _mappa_file(self.file)
+                self.formato = formato
+                break
+
+        if self.formato == 'fpt' and self.mm is not None:
+            self.dimensione_blocco = struct.unpack('>H', self.mm[6:8])[0] or 512
+
+    def leggi(self, blocco):
+        if self.mm is None or not blocco:
+            return ''
+        inizio = blocco * self.dimensione_blocco
+        if self.formato == 'fpt':
+            _, lunghezza = struct.unpack('>II', self.mm[inizio:inizio + 8])
+            dati = self.mm[inizio + 8:inizio + 8 + lunghezza]
+        else:
+            fine = self.mm.find(b'\x1a', inizio)
+            dati = self.mm[inizio:fine if fine >= 0 else len(self.mm)]
+        return dati.decode(self.codepage, errors='replace').rstrip()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def _decodifica_data(raw):
+    testo = raw.strip()
+    if not testo or testo == b'00000000':
+        return None
+    try:
+        return date(int(testo[:4]), int(testo[4:6]), int(testo[6:8]))
+    except ValueError:
+        return None
+
+
+def _decodifica_datetime(raw):
+    giorno_giuliano, millisecondi = struct.unpack('<ii', raw)
+    if giorno_giuliano == 0:
+        return None
+    return datetime(1, 1, 1) + timedelta(days=giorno_giuliano - 1721426, milliseconds=millisecondi)
+
+
+def crea_decodificatore(campo, codepage='cp1252', memo=None):
+    """
+    Restituisce una funzione che converte i byte grezzi del campo nel tipo Python
+    equivalente a quello restituito da dbf.Table.
+    """
+    tipo = campo.tipo
+
+    if tipo in ('C', 'V'):
+        return lambda raw: raw.decode(codepage, errors='replace').rstrip('\x00 ')
+
+    if tipo in ('N', 'F'):
+        def numero(raw):
+            testo = raw.strip()
+            if not testo or testo.startswith(b'*'):
+                return None
+            try:
+                if campo.decimali == 0 and b'.' not in testo:
+                    return int(testo)
+                return float(testo)
+            except ValueError:
+                return None
+        return numero
+
+    if tipo == 'D':
+        return _decodifica_data
+
+    if tipo == 'L':
+        def logico(raw):
+            valore = raw[:1].upper()
+            if valore in (b'T', b'Y'):
+                return True
+            if valore in (b'F', b'N'):
+                return False
+            return None
+        return logico
+
+    if tipo == 'I':
+        return lambda raw: struct.unpack('<i', raw)[0]
+
+    if tipo == 'B':
+        return lambda raw: struct.unpack('<d', raw)[0]
+
+    if tipo == 'Y':
+        return lambda raw: struct.unpack('<q', raw)[0] / 10000
+
+    if tipo in ('T', '@'):
+        return _decodifica_datetime
+
+    if tipo in TIPI_MEMO:
+        def memo_campo(raw):
+            if memo is None:
+                return ''
+            if len(raw) == 4:
+                blocco = struct.unpack('<I', raw)[0]
+            else:
+                testo = raw.strip()
+                blocco = int(testo) if testo.isdigit() else 0
+            return memo.leggi(blocco)
+        return memo_campo
+
+    return lambda raw: raw
+
+
+class RecordDBF:
+    """
+    Vista su un record della tabella mappata: i campi vengono decodificati solo
+    quando richiesti. Espone la stessa interfaccia di lettura dei record dbfread
+    (record[campo], record.get(campo), dict(record)).
+    """
+    __slots__ = ('_tabella', 'recno', '_offset')
+
+    def __init__(self, tabella, recno):
+        self._tabella = tabella
+        self.recno = recno
+        self._offset = tabella.lunghezza_intestazione + recno * tabella.lunghezza_record
+
+    @property
+    def cancellato(self):
+        return self._tabella._mm[self._offset] == 0x2A  # '*'
+
+    def raw(self, nome):
+        campo = self._tabella.campi[nome.upper()]
+        inizio = self._offset + campo.offset
+        return self._tabella._mm[inizio:inizio + campo.lunghezza]
+
+    def __getitem__(self, nome):
+        return self._tabella.decodificatore(nome)(self.raw(nome))
+
+    def get(self, nome, default=None):
+        if nome.upper() not in self._tabella.campi:
+            return default
+        return self[nome]
+
+    def keys(self):
+        return self._tabella.field_names
+
+    def items(self):
+        return [(nome, self[nome]) for nome in self._tabella.field_names]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"RecordDBF(recno={self.recno}, {self.as_dict()!r})"
+
+
+class TabellaDBF:
+    """
+    Accesso in sola lettura a un file DBF mappato in memoria.
+
+    L'intestazione viene analizzata una sola volta all'apertura; i record sono
+    viste sul buffer mappato e i campi vengono decodificati solo all'accesso,
+    quindi la memoria residente non cresce con la dimensione del file.
+    """
+
+    def __init__(self, percorso_file, codepage='cp1252'):
+        self.percorso_file = percorso_file
+        self.codepage = codepage
+        self._file = open(percorso_file, 'rb')
+        try:
+            self._mm = _mappa_file(self._file)
+            if self._mm is None:
+                raise ValueError(f"File DBF vuoto: {percorso_file}")
+            numero_record, self.lunghezza_intestazione, self.lunghezza_record, self.campi = leggi_intestazione(self._mm)
+        except Exception:
+            self.close()
+            raise
+
+        # Un'applicazione che sta scrivendo può aver aggiornato il contatore prima dei dati
+        disponibili = max(0, (len(self._mm) - self.lunghezza_intestazione) // self.lunghezza_record)
+        self.numero_record = min(numero_record, disponibili)
+
+        self._memo = None
+        self._decodificatori = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._memo:
+            self._memo.close()
+            self._memo = None
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    @property
+    def field_names(self):
+        return list(self.campi.keys())
+
+    def __len__(self):
+        return self.numero_record
+
+    def __getitem__(self, recno):
+        if recno < 0:
+            recno += self.numero_record
+        if not 0 <= recno < self.numero_record:
+            raise IndexError(f"Record {recno} fuori intervallo (0-{self.numero_record - 1})")
+        return RecordDBF(self, recno)
+
+    def __iter__(self):
+        return self.iter_record()
+
+    def iter_record(self, includi_cancellati=False):
+        for recno in range(self.numero_record):
+            record = RecordDBF(self, recno)
+            if includi_cancellati or not record.cancellato:
+                yield record
+
+    def decodificatore(self, nome):
+        nome = nome.upper()
+        decodifica = self._decodificatori.get(nome)
+        if decodifica is None:
+            if nome not in self.campi:
+                raise KeyError(f"Campo non presente in {self.percorso_file}: {nome}")
+            campo = self.campi[nome]
+            if campo.tipo in TIPI_MEMO and self._memo is None:
+                self._memo = LettoreMemo(self.percorso_file, self.codepage)
+            decodifica = crea_decodificatore(campo, self.codepage, self._memo)
+            self._decodificatori[nome] = decodifica
+        return decodifica
+
+    def filtra(self, filtri=None, recnos=None, includi_cancellati=False):
+        """
+        Restituisce i numeri di record che soddisfano tutti i predicati.
+
+        Args:
+            filtri (dict[str, callable], opzionale): predicati per campo
+            recnos (iterable[int], opzionale): limita la ricerca a questi record
+            includi_cancellati (bool): se True considera anche i record cancellati
+        """
+        filtri = filtri or {}
+        mancanti = [n for n in filtri if n.upper() not in self.campi]
+        if mancanti:
+            raise KeyError(f"Campi non presenti in {self.percorso_file}: {mancanti}")
+
+        condizioni = [
+            (self.campi[n.upper()].offset, self.campi[n.upper()].offset + self.campi[n.upper()].lunghezza,
+             self.decodificatore(n), predicato)
+            for n, predicato in filtri.items()
+        ]
+        mm = self._mm
+        base = self.lunghezza_intestazione
+        lunghezza = self.lunghezza_record
+
+        for recno in (range(self.numero_record) if recnos is None else recnos):
+            if not 0 <= recno < self.numero_record:
+                continue
+            inizio = base + recno * lunghezza
+            if not includi_cancellati and mm[inizio] == 0x2A:
+                continue
+            if all(predicato(decodifica(mm[inizio + da:inizio + a])) for da, a, decodifica, predicato in condizioni):
+                yield recno
+
+    def colonne(self, nomi, recnos):
+        """
+        Decodifica i campi richiesti per i record indicati.
+
+        Returns:
+            dict[str, list]: una lista per ogni campo più 'RECNO'
+        """
+        nomi = [n.upper() for n in nomi]
+        mancanti = [n for n in nomi if n not in self.campi]
+        if mancanti:
+            raise KeyError(f"Campi non presenti in {self.percorso_file}: {mancanti}")
+
+        proiezione = [
+            (n, self.campi[n].offset, self.campi[n].offset + self.campi[n].lunghezza, self.decodificatore(n))
+            for n in nomi
+        ]
+        risultato = {n: [] for n in nomi}
+        risultato['RECNO'] = []
+        mm = self._mm
+        base = self.lunghezza_intestazione
+        lunghezza = self.lunghezza_record
+
+        for recno in recnos:
+            inizio = base + recno * lunghezza
+            for nome, da, a, decodifica in proiezione:
+                risultato[nome].append(decodifica(mm[inizio + da:inizio + a]))
+            risultato['RECNO'].append(recno)
+        return risultato
+
+    def byte_campi(self, nomi):
+        """
+        Copia i byte grezzi dei campi indicati per tutti i record, senza decodificarli.
+
+        Returns:
+            numpy.ndarray: matrice uint8 (numero_record, 1 + somma lunghezze) con il
+            flag di cancellazione nella prima colonna
+        """
+        campi = [self.campi[n.upper()] for n in nomi]
+        if self.numero_record == 0:
+            return np.zeros((0, 1 + sum(c.lunghezza for c in campi)), dtype=np.uint8)
+
+        vista = np.frombuffer(
+            self._mm, dtype=np.uint8,
+            count=self.numero_record * self.lunghezza_record,
+            offset=self.lunghezza_intestazione
+        ).reshape(self.numero_record, self.lunghezza_record)
+        indici = [0] + [i for c in campi for i in range(c.offset, c.offset + c.lunghezza)]
+        risultato = vista[:, indici]  # l'indicizzazione avanzata crea una copia
+        del vista
+        return risultato
+
+    def checksum_record(self):
+        """
+        Impronta a 32 bit dei byte grezzi di ogni record (flag di cancellazione incluso),
+        calcolata con numpy a blocchi di RECORD_PER_BLOCCO record: ogni record è letto
+        come parole a 64 bit, combinate con pesi fissi e rimescolate (vedi _mescola).
+
+        Returns:
+            numpy.ndarray: array uint32 di lunghezza numero_record
+        """
+        n, lunghezza = self.numero_record, self.lunghezza_record
+        risultato = np.empty(n, dtype=np.uint32)
+        if n == 0:
+            return risultato
+
+        vista = np.frombuffer(self._mm, dtype=np.uint8, count=n * lunghezza,
+                              offset=self.lunghezza_intestazione).reshape(n, lunghezza)
+        parole = -(-lunghezza // 8)
+        pesi = _pesi_checksum(parole)
+        blocco = np.zeros((RECORD_PER_BLOCCO, parole * 8), dtype=np.uint8)
+        for inizio in range(0, n, RECORD_PER_BLOCCO):
+            righe = min(RECORD_PER_BLOCCO, n - inizio)
+            blocco[:righe, :lunghezza] = vista[inizio:inizio + righe]
+            # Le moltiplicazioni e la somma in uint64 vanno in overflow di proposito (modulo 2^64)
+            somma = (blocco[:righe].view('<u8') * pesi).sum(axis=1, dtype=np.uint64)
+            somma = _mescola(somma)
+            risultato[inizio:inizio + righe] = (somma ^ (somma >> np.uint64(32))).astype(np.uint32)
+        del vista
+        return risultato
+
+
+def _mescola(x):
+    """Finalizzatore di splitmix64 su un array uint64: ogni bit in ingresso influenza tutti quelli in uscita."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _pesi_checksum(parole):
+    """Pesi dispari e deterministici (uno per parola a 64 bit del record) per checksum_record."""
+    return _mescola(np.arange(1, parole + 1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+
+
+def iter_blocchi(percorso_file, colonne=None, filtri=None, codepage='cp1252', includi_cancellati=False, recnos=None):
+    """
+    Legge il DBF a blocchi decodificando solo i campi richiesti.
+
+    Args:
+        percorso_file (str): percorso del file DBF
+        colonne (list[str], opzionale): campi da restituire (default: tutti)
+        filtri (dict[str, callable], opzionale): predicati per campo; un record
+            viene decodificato solo se tutti i predicati restituiscono True
+        codepage (str): codifica dei campi carattere
+        includi_cancellati (bool): se True restituisce anche i record marcati come cancellati
+        recnos (iterable[int], opzionale): limita la lettura a questi record
+
+    Yields:
+        dict[str, list]: colonne tipizzate del blocco, più la colonna 'RECNO'
+    """
+    with TabellaDBF(percorso_file, codepage=codepage) as tabella:
+        nomi = colonne or tabella.field_names
+        selezionati = []
+        for recno in tabella.filtra(filtri, recnos=recnos, includi_cancellati=includi_cancellati):
+            selezionati.append(recno)
+            if len(selezionati) >= RECORD_PER_BLOCCO:
+                yield tabella.colonne(nomi, selezionati)
+                selezionati = []
+        if selezionati:
+            yield tabella.colonne(nomi, selezionati)
+
+
+def leggi_colonne(percorso_file, colonne=None, filtri=None, codepage='cp1252', includi_cancellati=False, recnos=None):
+    """
+    Legge il DBF in un unico dizionario di colonne tipizzate.
+
+    Vedi iter_blocchi per il significato dei parametri.
+
+    Returns:
+        dict[str, list]: una lista per ogni colonna richiesta più 'RECNO'
+    """
+    risultato = None
+    for blocco in iter_blocchi(percorso_file, colonne, filtri, codepage, includi_cancellati, recnos):
+        if risultato is None:
+            risultato = blocco
+        else:
+            for nome, valori in blocco.items():
+                risultato[nome].extend(valori)
+
+    if risultato is None:
+        with TabellaDBF(percorso_file, codepage=codepage) as tabella:
+            nomi = [c.upper() for c in colonne] if colonne else tabella.field_names
+            mancanti = [n for n in nomi if n not in tabella.campi]
+            if mancanti:
+                raise KeyError(f"Campi non presenti in {percorso_file}: {mancanti}")
+        risultato = {n: [] for n in nomi}
+        risultato['RECNO'] = []
+
+    logging.debug(f"DBF {percorso_file}: {len(risultato['RECNO'])} record letti ({len(risultato) - 1} colonne)")
+    return risultato
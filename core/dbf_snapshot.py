@@ -0,0 +1,155 @@
+import os
+import logging
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow è opzionale: senza, le letture restano sul DBF
+    pa = pq = None
+
+from core.dbf_reader import TabellaDBF, leggi_colonne
+from core.dbf_index import firma_file, percorso_sidecar, file_temporaneo
+
+# Righe per row group: con il file ordinato per data, le statistiche dei row
+# group permettono a pyarrow di saltare i blocchi fuori dall'intervallo richiesto
+RIGHE_PER_GRUPPO = 16384
+
+
+def snapshot_disponibile():
+    return pq is not None
+
+
+def _tipo_arrow(campo):
+    if campo.tipo in ('N', 'F'):
+        return pa.int64() if campo.decimali == 0 else pa.float64()
+    if campo.tipo == 'D':
+        return pa.date32()
+    if campo.tipo == 'L':
+        return pa.bool_()
+    if campo.tipo == 'I':
+        return pa.int32()
+    if campo.tipo in ('B', 'Y'):
+        return pa.float64()
+    if campo.tipo in ('T', '@'):
+        return pa.timestamp('ms')
+    return pa.string()
+
+
+def _colonna_arrow(valori, tipo):
+    try:
+        return pa.array(valori, type=tipo)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Campi N senza decimali dichiarati ma con valori frazionari
+        return pa.array(valori, type=pa.float64())
+
+
+class SnapshotDBF:
+    """
+    Copia colonnare (Parquet) di una tabella DBF, rigenerata quando il DBF cambia.
+
+    Le letture per intervallo di date usano il predicate pushdown di pyarrow e
+    non toccano il DBF; la decodifica cp1252 avviene solo alla rigenerazione,
+    che può essere anticipata chiamando aggiorna() fuori dal percorso critico.
+    """
+
+    def __init__(self, percorso_dbf, campo_ordinamento=None, cartella=None, codepage='cp1252'):
+        if pq is None:
+            raise RuntimeError("pyarrow non installato: snapshot colonnari non disponibili")
+        self.percorso_dbf = percorso_dbf
+        self.campo_ordinamento = campo_ordinamento.upper() if campo_ordinamento else None
+        self.codepage = codepage
+        self.percorso_snapshot = percorso_sidecar(percorso_dbf, 'parquet', cartella)
+        self.firma = None
+        self._lock = threading.Lock()
+
+    def _firma_salvata(self):
+        if not os.path.exists(self.percorso_snapshot):
+            return None
+        try:
+            meta = pq.read_metadata(self.percorso_snapshot).metadata or {}
+            firma = meta.get(b'firma_dbf')
+            return [int(x) for x in firma.decode('ascii').split(':')] if firma else None
+        except Exception as e:
+            logging.warning(f"Snapshot non leggibile ({self.percorso_snapshot}), verrà rigenerato: {e}")
+            return None
+
+    def aggiorna(self):
+        """
+        Rigenera lo snapshot se il DBF è cambiato.
+
+        Returns:
+            bool: True se lo snapshot è stato rigenerato
+        """
+        with self._lock:
+            firma = firma_file(self.percorso_dbf)
+            if self.firma is None:
+                self.firma = self._firma_salvata()
+            if firma == self.firma:
+                return False
+
+            with TabellaDBF(self.percorso_dbf, codepage=self.codepage) as tabella:
+                campi = dict(tabella.campi)
+            dati = leggi_colonne(self.percorso_dbf, codepage=self.codepage)
+
+            colonne = {'RECNO': pa.array(dati.pop('RECNO'), type=pa.int64())}
+            for nome, valori in dati.items():
+                colonne[nome] = _colonna_arrow(valori, _tipo_arrow(campi[nome]))
+            tabella_arrow = pa.table(colonne)
+            if self.campo_ordinamento in tabella_arrow.column_names:
+                tabella_arrow = tabella_arrow.sort_by([(self.campo_ordinamento, 'ascending'), ('RECNO', 'ascending')])
+            tabella_arrow = tabella_arrow.replace_schema_metadata({'firma_dbf': f"{firma[0]}:{firma[1]}"})
+
+            descrittore, temporaneo = file_temporaneo(self.percorso_snapshot)
+            os.close(descrittore)
+            try:
+                pq.write_table(tabella_arrow, temporaneo, row_group_size=RIGHE_PER_GRUPPO)
+                os.replace(temporaneo, self.percorso_snapshot)
+            except BaseException:
+                if os.path.exists(temporaneo):
+                    os.remove(temporaneo)
+                raise
+
+            self.firma = firma
+            logging.info(f"Snapshot {os.path.basename(self.percorso_dbf)} rigenerato: {tabella_arrow.num_rows} record")
+            return True
+
+    def leggi(self, colonne=None, intervallo=None):
+        """
+        Legge dallo snapshot, rigenerandolo prima se il DBF è cambiato.
+
+        Args:
+            colonne (list[str], opzionale): campi da leggere (default: tutti)
+            intervallo (tuple, opzionale): (campo, inizio, fine) con estremi inclusi,
+                applicato come filtro sul file Parquet
+
+        Returns:
+            dict[str, list]: stesso formato di core.dbf_reader.leggi_colonne
+        """
+        self.aggiorna()
+        nomi = [c.upper() for c in colonne] + ['RECNO'] if colonne else None
+        filtri = None
+        if intervallo:
+            campo, inizio, fine = intervallo
+            filtri = [(campo.upper(), '>=', inizio), (campo.upper(), '<=', fine)]
+
+        tabella = pq.read_table(self.percorso_snapshot, columns=nomi, filters=filtri)
+        if self.campo_ordinamento and self.campo_ordinamento in tabella.column_names:
+            tabella = tabella.sort_by([(self.campo_ordinamento, 'ascending'), ('RECNO', 'ascending')])
+        return tabella.to_pydict()
+
+
+_snapshot = {}
+_lock_snapshot = threading.Lock()
+
+
+def snapshot_dbf(percorso_dbf, campo_ordinamento=None):
+    """
+    Restituisce lo snapshot condiviso per il DBF indicato.
+    """
+    chiave = os.path.abspath(percorso_dbf)
+    with _lock_snapshot:
+        snapshot = _snapshot.get(chiave)
+        if snapshot is None:
+            snapshot = _snapshot[chiave] = SnapshotDBF(percorso_dbf, campo_ordinamento)
+        return snapshot
@@ -0,0 +1,144 @@
+import json
+import time
+import random
+import logging
+import threading
+
+from config.constants import GOOGLE_RICHIESTE_AL_SECONDO, GOOGLE_RICHIESTE_MAX_AL_SECONDO, GOOGLE_TENTATIVI_MAX
+
+# Motivi con cui l'API Calendar segnala il superamento della quota (HTTP 403/429)
+MOTIVI_QUOTA = {'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'}
+# Errori transitori lato Google da ritentare senza ridurre la velocità
+STATI_TRANSITORI = {500, 502, 503, 504}
+
+BACKOFF_BASE = 1.0
+BACKOFF_MASSIMO = 64.0
+
+
+def motivi_errore(errore):
+    """Elenco dei 'reason' riportati nel corpo di una HttpError di googleapiclient."""
+    try:
+        contenuto = errore.content.decode('utf-8') if isinstance(errore.content, bytes) else errore.content
+        return [e.get('reason') for e in json.loads(contenuto)['error'].get('errors', [])]
+    except Exception:
+        return []
+
+
+def e_limite_quota(errore):
+    """True se l'errore indica il superamento della quota (429, o 403 rateLimitExceeded)."""
+    stato = getattr(getattr(errore, 'resp', None), 'status', None)
+    if stato == 429:
+        return True
+    return stato == 403 and bool(MOTIVI_QUOTA.intersection(motivi_errore(errore)))
+
+
+def e_ritentabile(errore):
+    stato = getattr(getattr(errore, 'resp', None), 'status', None)
+    return e_limite_quota(errore) or stato in STATI_TRANSITORI
+
+
+def attesa_backoff(tentativo):
+    """Backoff esponenziale con jitter completo: casuale in [0, min(massimo, base * 2^tentativo)]."""
+    return random.uniform(0, min(BACKOFF_MASSIMO, BACKOFF_BASE * 2 ** tentativo))
+
+
+class LimitatoreAdattivo:
+    """
+    Token bucket con velocità adattiva (AIMD), condiviso tra i thread.
+
+    Ogni chiamata API consuma un token (una richiesta batch ne consuma uno per
+    ogni chiamata contenuta, come conteggiato dalla quota Google). Ogni successo
+    aumenta la velocità di un passo fisso fino al massimo; un errore di quota la
+    dimezza e sospende tutti i thread per il tempo di backoff.
+    """
+
+    def __init__(self, richieste_al_secondo, massimo=None, minimo=0.5, incremento=0.05, fattore_riduzione=0.5, nome='Google'):
+        self.nome = nome
+        self.velocita = float(richieste_al_secondo)
+        self.massimo = float(massimo or richieste_al_secondo)
+        self.minimo = minimo
+        self.incremento = incremento
+        self.fattore_riduzione = fattore_riduzione
+        self._token = self.velocita
+        self._ultimo = time.monotonic()
+        self._pausa_fino = 0.0
+        self._lock = threading.Lock()
+
+    def _ricarica(self, ora):
+        capacita = max(self.velocita, 1.0)
+        self._token = min(capacita, self._token + (ora - self._ultimo) * self.velocita)
+        self._ultimo = ora
+
+    def acquisisci(self, n=1):
+        """
+        Attende finché sono disponibili n token. Richieste più grandi della capacità
+        del bucket (es. un batch da 50) passano appena il bucket è pieno e lo lasciano
+        in debito, così i chiamanti successivi attendono il recupero.
+        """
+        while True:
+            with self._lock:
+                ora = time.monotonic()
+                self._ricarica(ora)
+                attesa = self._pausa_fino - ora
+                if attesa <= 0:
+                    necessari = min(n, max(self.velocita, 1.0))
+                    if self._token >= necessari:
+                        self._token -= n
+                        return
+                    attesa = (necessari - self._token) / self.velocita
+            time.sleep(attesa)
+
+    def segnala_successo(self, n=1):
+        with self._lock:
+            self.velocita = min(self.massimo, self.velocita + self.incremento * n)
+
+    def segnala_limite(self, tentativo):
+        """
+        Registra un errore di quota: riduce la velocità e sospende tutti i chiamanti.
+
+        Returns:
+            float: secondi di pausa applicati
+        """
+        attesa = attesa_backoff(tentativo)
+        with self._lock:
+            self.velocita = max(self.minimo, self.velocita * self.fattore_riduzione)
+            self._token = min(self._token, 0.0)
+            self._pausa_fino = max(self._pausa_fino, time.monotonic() + attesa)
+        logging.warning(f"Quota {self.nome} superata: velocità ridotta a {self.velocita:.2f} richieste/s, pausa {attesa:.1f}s")
+        return attesa
+
+    def esegui(self, richiesta, tentativi=None):
+        """
+        Esegue una HttpRequest di googleapiclient rispettando il limite e ritentando
+        con backoff gli errori di quota e quelli transitori.
+        """
+        tentativi = tentativi or GOOGLE_TENTATIVI_MAX
+        for tentativo in range(tentativi):
+            self.acquisisci()
+            try:
+                risposta = richiesta.execute()
+            except Exception as e:
+                if tentativo == tentativi - 1 or not e_ritentabile(e):
+                    raise
+                if e_limite_quota(e):
+                    self.segnala_limite(tentativo)
+                else:
+                    attesa = attesa_backoff(tentativo)
+                    logging.warning(f"Errore transitorio Google API, nuovo tentativo tra {attesa:.1f}s: {e}")
+                    time.sleep(attesa)
+                continue
+            self.segnala_successo()
+            return risposta
+
+
+_limitatore = None
+_lock_limitatore = threading.Lock()
+
+
+def limitatore_google():
+    """Limitatore condiviso da tutte le chiamate Google Calendar del processo."""
+    global _limitatore
+    with _lock_limitatore:
+        if _limitatore is None:
+            _limitatore = LimitatoreAdattivo(GOOGLE_RICHIESTE_AL_SECONDO, massimo=GOOGLE_RICHIESTE_MAX_AL_SECONDO)
+        return _limitatore
@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import logging
+import threading
+from datetime import datetime, date, time, timedelta
+
+from config.constants import PATH_CAMPAGNE_DB, RICHIAMI_MAX_AL_GIORNO, RICHIAMI_GIORNI_INVIO, RICHIAMI_FASCE_ORARIE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS piano (
+    id_paziente TEXT NOT NULL,
+    data_richiamo TEXT NOT NULL,
+    giorno TEXT NOT NULL,
+    previsto TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    testo TEXT NOT NULL,
+    riferimento TEXT,
+    stato TEXT NOT NULL,
+    consegnato TEXT,
+    creato TEXT NOT NULL,
+    aggiornato TEXT NOT NULL,
+    PRIMARY KEY (id_paziente, data_richiamo)
+);
+CREATE INDEX IF NOT EXISTS idx_piano_stato ON piano(stato, previsto);
+CREATE INDEX IF NOT EXISTS idx_piano_giorno ON piano(giorno);
+"""
+
+# Stati di un richiamo nel piano: da inviare nel giorno assegnato, consegnato
+# all'outbox (che ne gestisce invio e nuovi tentativi), già inviato in precedenza
+PIANIFICATO = 'pianificato'
+CONSEGNATO = 'consegnato'
+GIA_INVIATO = 'gia_inviato'
+
+
+def leggi_fasce_orarie(testo):
+    """'09:30-12:30,15:00-19:00' → [(time(9, 30), time(12, 30)), (time(15, 0), time(19, 0))], ordinate."""
+    fasce = []
+    for parte in str(testo).split(','):
+        if parte.strip():
+            inizio, fine = (time.fromisoformat(ora.strip()) for ora in parte.split('-'))
+            if fine <= inizio:
+                raise ValueError(f"Fascia oraria non valida: {parte.strip()}")
+            fasce.append((inizio, fine))
+    return sorted(fasce)
+
+
+def leggi_giorni_invio(testo):
+    """'0,1,2,3,4' → {0, 1, 2, 3, 4} (0 = lunedì, come date.weekday())."""
+    return {int(g) for g in str(testo).split(',') if g.strip()}
+
+
+def _minuti(ora):
+    return ora.hour * 60 + ora.minute
+
+
+class Calendario:
+    """
+    Giorni e fasce orarie in cui è consentito inviare i richiami, con il
+    numero massimo di messaggi al giorno.
+    """
+
+    def __init__(self, max_al_giorno=None, giorni=None, fasce=None):
+        self.max_al_giorno = max_al_giorno or RICHIAMI_MAX_AL_GIORNO
+        self.giorni = leggi_giorni_invio(RICHIAMI_GIORNI_INVIO) if giorni is None else set(giorni)
+        self.fasce = leggi_fasce_orarie(RICHIAMI_FASCE_ORARIE) if fasce is None else sorted(fasce)
+        if not self.giorni or not self.fasce:
+            raise ValueError("Servono almeno un giorno e una fascia oraria di invio")
+        self.minuti_al_giorno = sum(_minuti(fine) - _minuti(inizio) for inizio, fine in self.fasce)
+
+    def aperto(self, adesso):
+        """True se adesso cade in una fascia di un giorno di invio."""
+        return adesso.weekday() in self.giorni and any(inizio <= adesso.time() < fine for inizio, fine in self.fasce)
+
+    def giorni_da(self, adesso):
+        """Giorni di invio a partire da oggi (se l'ultima fascia non è già chiusa)."""
+        giorno = adesso.date()
+        if adesso.time() >= self.fasce[-1][1]:
+            giorno += timedelta(days=1)
+        while True:
+            if giorno.weekday() in self.giorni:
+                yield giorno
+            giorno += timedelta(days=1)
+
+    def orario(self, giorno, posizione):
+        """
+        Orario previsto per l'invio numero posizione (da 0) del giorno: gli invii
+        sono distribuiti in modo uniforme sui minuti delle fasce, un intervallo
+        di max_al_giorno.
+        """
+        minuto = posizione * self.minuti_al_giorno / self.max_al_giorno
+        for inizio, fine in self.fasce:
+            durata = _minuti(fine) - _minuti(inizio)
+            if minuto < durata:
+                return datetime.combine(giorno, inizio) + timedelta(minutes=minuto)
+            minuto -= durata
+        return datetime.combine(giorno, self.fasce[-1][0])
+
+
+def _adesso():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class PianoRichiami:
+    """
+    Piano persistente (SQLite) di una campagna di richiami.
+
+    pianifica assegna ogni richiamo in scadenza a un giorno e a un orario di
+    invio, senza superare il massimo giornaliero; da_consegnare restituisce,
+    durante le fasce di invio, i richiami già arrivati al loro orario entro il
+    massimo del giorno. Così il job periodico smaltisce il piano giorno per
+    giorno invece di inviare tutti i richiami in una sola esecuzione.
+    Ogni richiamo è identificato da (paziente, data del richiamo), come
+    nell'outbox: un richiamo già pianificato o già inviato non viene ripianificato.
+    """
+
+    def __init__(self, percorso_db, calendario=None):
+        self.percorso_db = percorso_db
+        self.calendario = calendario or Calendario()
+        if percorso_db != ':memory:':
+            os.makedirs(os.path.dirname(percorso_db) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def chiave(id_paziente, data_richiamo):
+        data = data_richiamo.isoformat() if hasattr(data_richiamo, 'isoformat') else str(data_richiamo)
+        return (str(id_paziente), data[:10])
+
+    def pianifica(self, richiami, gia_inviati=(), adesso=None):
+        """
+        Aggiunge al piano i richiami non ancora pianificati né inviati, dal più
+        vicino alla data di richiamo, riempiendo i giorni di invio a partire da oggi.
+
+        Args:
+            richiami (iterable[dict]): con 'id_paziente', 'data_richiamo', 'numero',
+                'testo' e 'riferimento' (vedi RecallManager.pianifica_campagna)
+            gia_inviati (set[tuple], opzionale): chiavi dei richiami già inviati (vedi OutboxWhatsApp.inviati)
+            adesso (datetime, opzionale): momento della pianificazione (default ora)
+
+        Returns:
+            dict: 'pianificati', 'gia_pianificati', 'gia_inviati' e 'ultimo_giorno' del piano
+        """
+        adesso = adesso or datetime.now()
+        esito = {'pianificati': 0, 'gia_pianificati': 0, 'gia_inviati': 0, 'ultimo_giorno': None}
+        gia_inviati = set(gia_inviati)
+
+        with self._lock:
+            presenti = {tuple(r) for r in self._conn.execute("SELECT id_paziente, data_richiamo FROM piano")}
+            nuovi = {}
+            for r in richiami:
+                chiave = self.chiave(r['id_paziente'], r['data_richiamo'])
+                if chiave in gia_inviati:
+                    esito['gia_inviati'] += 1
+                elif chiave in presenti or chiave in nuovi:
+                    esito['gia_pianificati'] += 1
+                else:
+                    nuovi[chiave] = r
+
+            occupati = dict(self._conn.execute(
+                "SELECT giorno, COUNT(*) FROM piano WHERE giorno >= ? GROUP BY giorno", (adesso.date().isoformat(),)
+            ).fetchall())
+            righe = []
+            giorni = self.calendario.giorni_da(adesso)
+            giorno, posizione = next(giorni), None
+            for chiave in sorted(nuovi, key=lambda k: (k[1], k[0])):
+                if posizione is None:
+                    posizione = occupati.get(giorno.isoformat(), 0)
+                while posizione >= self.calendario.max_al_giorno:
+                    giorno = next(giorni)
+                    posizione = occupati.get(giorno.isoformat(), 0)
+                previsto = max(self.calendario.orario(giorno, posizione), adesso.replace(microsecond=0))
+                r = nuovi[chiave]
+                righe.append((*chiave, giorno.isoformat(), previsto.isoformat(timespec='seconds'), r['numero'], r['testo'],
+                              r.get('riferimento'), PIANIFICATO, _adesso(), _adesso()))
+                posizione += 1
+
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO piano (id_paziente, data_richiamo, giorno, previsto, numero, testo, riferimento, stato, creato, aggiornato) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", righe
+            )
+            self._conn.execute("COMMIT")
+
+        esito['pianificati'] = len(righe)
+        esito['ultimo_giorno'] = righe[-1][2] if righe else None
+        logging.info(f"[Campagna richiami] Pianificati {len(righe)} richiami (ultimo giorno {esito['ultimo_giorno']}), "
+                     f"già pianificati {esito['gia_pianificati']}, già inviati {esito['gia_inviati']}")
+        return esito
+
+    def consegnati_il(self, giorno):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM piano WHERE stato = ? AND substr(consegnato, 1, 10) = ?", (CONSEGNATO, giorno.isoformat())
+            ).fetchone()[0]
+
+    def da_consegnare(self, adesso=None):
+        """
+        Richiami da passare all'outbox adesso: nessuno fuori dalle fasce di
+        invio, altrimenti quelli con orario previsto già passato (compresi i
+        rimasti dei giorni precedenti), fino al massimo giornaliero.
+
+        Returns:
+            list[dict]: righe della tabella piano, in ordine di orario previsto
+        """
+        adesso = adesso or datetime.now()
+        if not self.calendario.aperto(adesso):
+            return []
+        with self._lock:
+            disponibili = self.calendario.max_al_giorno - self.consegnati_il(adesso.date())
+            if disponibili <= 0:
+                return []
+            cursore = self._conn.execute(
+                "SELECT * FROM piano WHERE stato = ? AND previsto <= ? ORDER BY previsto, data_richiamo LIMIT ?",
+                (PIANIFICATO, adesso.isoformat(timespec='seconds'), disponibili)
+            )
+            colonne = [c[0] for c in cursore.description]
+            return [dict(zip(colonne, r)) for r in cursore.fetchall()]
+
+    def segna(self, chiavi, stato, adesso=None):
+        """Aggiorna lo stato dei richiami indicati (CONSEGNATO o GIA_INVIATO)."""
+        adesso = (adesso or datetime.now()).isoformat(timespec='seconds')
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE piano SET stato = ?, consegnato = ?, aggiornato = ? WHERE id_paziente = ? AND data_richiamo = ?",
+                [(stato, adesso, _adesso(), *chiave) for chiave in chiavi]
+            )
+            self._conn.execute("COMMIT")
+
+    def riepilogo(self):
+        """Numero di richiami per stato e richiami ancora da inviare per giorno."""
+        with self._lock:
+            per_stato = dict(self._conn.execute("SELECT stato, COUNT(*) FROM piano GROUP BY stato").fetchall())
+            per_giorno = dict(self._conn.execute(
+                "SELECT giorno, COUNT(*) FROM piano WHERE stato = ? GROUP BY giorno ORDER BY giorno", (PIANIFICATO,)
+            ).fetchall())
+        return {'per_stato': per_stato, 'da_inviare_per_giorno': per_giorno}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_piani = {}
+_lock_piani = threading.Lock()
+
+
+def piano_richiami(percorso_db=PATH_CAMPAGNE_DB):
+    """Restituisce il piano condiviso per il database indicato (una connessione per processo)."""
+    chiave = percorso_db if percorso_db == ':memory:' else os.path.abspath(percorso_db)
+    with _lock_piani:
+        piano = _piani.get(chiave)
+        if piano is None:
+            piano = _piani[chiave] = PianoRichiami(percorso_db)
+        return piano
+
+
+def piano_per_client(twilio_client):
+    """
+    Piano da usare con il client indicato: in simulazione o con il numero di
+    test si usa un piano in memoria (condiviso nel processo), come per l'outbox.
+    """
+    if twilio_client.simula_invio or twilio_client.test_numero:
+        return piano_richiami(':memory:')
+    return piano_richiami()
@@ -1,8 +1,13 @@
 import logging
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+
+import pandas as pd
 
 from config.constants import COLONNE
+from core.recall_rules import matrice_tipi, conteggi_per_tipo
 from core.utils import normalizza_numero_telefono, costruisci_messaggio_richiamo
+from core.whatsapp_outbox import outbox_per_client
+from core.recall_campaign import piano_per_client, CONSEGNATO, GIA_INVIATO
 
 class RecallManager:
     """
@@ -21,24 +26,30 @@ class RecallManager:
             days_threshold (int): giorni entro cui considerare i richiami
 
         Returns:
-            list[dict]: richiami filtrati
+            list[dict]: richiami con data effettiva (DATA_RICHIAMO) tra oggi e oggi + days_threshold
         """
-        richiami = self.db_handler.get_recalls_data()
-        col = COLONNE['richiami']
         oggi = date.today()
-        entro = oggi + timedelta(days=days_threshold)
-        risultati = []
-
-        for r in richiami:
-            data1 = r.get(col['data1'])
-            if not isinstance(data1, date):
-                continue
-            if oggi <= data1 <= entro:
-                risultati.append(r)
+        risultati = self.db_handler.get_recalls(data_inizio=oggi, data_fine=oggi + timedelta(days=days_threshold))
 
         logging.info(f"Trovati {len(risultati)} richiami entro {days_threshold} giorni.")
         return risultati
 
+    def _prepara_richiamo(self, richiamo):
+        """
+        Returns:
+            tuple | None: (telefono, messaggio, id_richiamo), None se il numero non è valido
+        """
+        col = COLONNE['richiami']
+        telefono = normalizza_numero_telefono(richiamo.get('TELEFONO', ''))
+
+        if not telefono:
+            logging.warning(f"Numero non valido per paziente: {richiamo.get(col['id_paziente'])}")
+            return None
+
+        messaggio = costruisci_messaggio_richiamo(richiamo)
+        id_richiamo = f"{richiamo.get(col['id_paziente'])}_{richiamo.get('DATA_RICHIAMO')}"
+        return telefono, messaggio, id_richiamo
+
     def invia_richiamo(self, richiamo: dict) -> bool:
         """
         Invia un messaggio di richiamo WhatsApp a un singolo paziente.
@@ -49,16 +60,11 @@ class RecallManager:
         Returns:
             bool: True se inviato correttamente, False altrimenti
         """
-        col = COLONNE['richiami']
-        telefono = normalizza_numero_telefono(richiamo.get('TELEFONO', ''))
-
-        if not telefono:
-            logging.warning(f"Numero non valido per paziente: {richiamo.get(col['id_paziente'])}")
+        preparato = self._prepara_richiamo(richiamo)
+        if preparato is None:
             return False
 
-        messaggio = costruisci_messaggio_richiamo(richiamo)
-
-        id_richiamo = f"{richiamo.get(col['id_paziente'])}_{richiamo.get(col['data1'])}"
+        telefono, messaggio, id_richiamo = preparato
         risultato = self.twilio_client.invia_messaggio(telefono, messaggio, id_richiamo)
 
         if risultato:
@@ -68,24 +74,147 @@ class RecallManager:
 
         return risultato
 
-    def invia_tutti_i_richiami(self, days_threshold=30, solo_primo=False):
+    def invia_tutti_i_richiami(self, days_threshold=30, solo_primo=False, progress_callback=None):
         """
-        Invia tutti i richiami in scadenza entro X giorni.
+        Invia tutti i richiami in scadenza entro X giorni tramite l'outbox:
+        i richiami già inviati (stesso paziente e data) vengono saltati e gli
+        invii falliti ritentati con backoff.
 
         Args:
             days_threshold (int): soglia giorni
             solo_primo (bool): se True, invia solo il primo per test
+            progress_callback (callable, opzionale): chiamata con (completati, totale)
+
+        Returns:
+            dict: conteggi di OutboxWhatsApp.invia più 'gia_inviati', 'senza_numero' e 'totali'
         """
+        col = COLONNE['richiami']
         richiami = self.get_due_recalls(days_threshold=days_threshold)
-        inviati = falliti = 0
+        outbox = outbox_per_client(self.twilio_client)
+        chiavi = []
+        senza_numero = gia_inviati = 0
 
         for r in richiami:
-            if self.invia_richiamo(r):
-                inviati += 1
+            preparato = self._prepara_richiamo(r)
+            if preparato is None:
+                senza_numero += 1
             else:
-                falliti += 1
+                telefono, messaggio, id_richiamo = preparato
+                chiave = outbox.accoda(r.get(col['id_paziente']), r.get('DATA_RICHIAMO'), 'richiamo', telefono, messaggio, id_richiamo)
+                if chiave is None:
+                    gia_inviati += 1
+                else:
+                    chiavi.append(chiave)
 
             if solo_primo:
                 break
 
-        logging.info(f"Richiami inviati: {inviati} | Falliti: {falliti} | Totali: {len(richiami)}")
+        esito = outbox.invia(self.twilio_client, chiavi, progress_callback=progress_callback)
+        esito.update({'gia_inviati': gia_inviati, 'senza_numero': senza_numero, 'totali': len(richiami)})
+        logging.info(f"Richiami inviati: {esito['inviati']} | Falliti: {esito['falliti'] + senza_numero} | "
+                     f"Da ritentare: {esito['in_errore']} | Già inviati: {gia_inviati} | Totali: {len(richiami)}")
+        return esito
+
+    def pianifica_campagna(self, days_threshold=30, adesso=None):
+        """
+        Pianifica i richiami in scadenza entro X giorni nel piano della campagna,
+        distribuendoli sui giorni di invio entro RICHIAMI_MAX_AL_GIORNO al giorno.
+        I richiami già inviati (vedi outbox) o già pianificati vengono saltati.
+
+        Returns:
+            dict: conteggi di PianoRichiami.pianifica più 'senza_numero' e 'totali'
+        """
+        col = COLONNE['richiami']
+        richiami = self.get_due_recalls(days_threshold=days_threshold)
+        voci = []
+        senza_numero = 0
+        for r in richiami:
+            preparato = self._prepara_richiamo(r)
+            if preparato is None:
+                senza_numero += 1
+                continue
+            telefono, messaggio, id_richiamo = preparato
+            voci.append({'id_paziente': r.get(col['id_paziente']), 'data_richiamo': r.get('DATA_RICHIAMO'),
+                         'numero': telefono, 'testo': messaggio, 'riferimento': id_richiamo})
+
+        gia_inviati = outbox_per_client(self.twilio_client).inviati('richiamo')
+        esito = piano_per_client(self.twilio_client).pianifica(voci, gia_inviati, adesso)
+        esito.update({'senza_numero': senza_numero, 'totali': len(richiami)})
+        return esito
+
+    def esegui_campagna(self, adesso=None, progress_callback=None):
+        """
+        Smaltisce il piano della campagna: durante le fasce di invio passa
+        all'outbox i richiami arrivati al loro orario, entro il massimo del
+        giorno, e ritenta i richiami rimasti in errore. Va eseguito
+        periodicamente (es. ogni 15 minuti).
+
+        Returns:
+            dict: conteggi di OutboxWhatsApp.invia più 'consegnati' e 'gia_inviati',
+                None se non c'era niente da inviare
+        """
+        adesso = adesso or datetime.now()
+        piano = piano_per_client(self.twilio_client)
+        if not piano.calendario.aperto(adesso):
+            return None
+
+        outbox = outbox_per_client(self.twilio_client)
+        chiavi, consegnati, gia_inviati = [], [], []
+        for voce in piano.da_consegnare(adesso):
+            chiave = outbox.accoda(voce['id_paziente'], voce['data_richiamo'], 'richiamo',
+                                   voce['numero'], voce['testo'], voce['riferimento'])
+            piano_chiave = (voce['id_paziente'], voce['data_richiamo'])
+            if chiave is None:
+                gia_inviati.append(piano_chiave)
+            else:
+                chiavi.append(chiave)
+                consegnati.append(piano_chiave)
+        piano.segna(consegnati, CONSEGNATO, adesso)
+        piano.segna(gia_inviati, GIA_INVIATO, adesso)
+
+        # Richiami consegnati nelle esecuzioni precedenti e rimasti in errore
+        chiavi += [chiave for chiave in ((m['id_paziente'], m['data_riferimento'], m['tipo']) for m in outbox.da_inviare())
+                   if chiave[2] == 'richiamo' and chiave not in chiavi]
+        if not chiavi:
+            return None
+
+        esito = outbox.invia(self.twilio_client, chiavi, attendi_tentativi=False, progress_callback=progress_callback)
+        esito.update({'consegnati': len(consegnati), 'gia_inviati': len(gia_inviati)})
+        logging.info(f"[Campagna richiami] Consegnati {len(consegnati)} richiami, inviati {esito['inviati']}, "
+                     f"falliti {esito['falliti']}, da ritentare {esito['in_errore']}")
+        return esito
+
+    def test_due_recalls(self, days_threshold=7, selected_month=None, selected_type=None):
+        """
+        Anteprima dei richiami in scadenza per la GUI: nel mese selezionato
+        dell'anno corrente, altrimenti entro days_threshold giorni da oggi.
+        Tipi e conteggi vengono da valuta_richiami (vedi core.recall_rules).
+
+        Returns:
+            dict: 'total', 'recalls' (dettagli per paziente) e 'type_counts' (conteggi per tipo)
+        """
+        oggi = date.today()
+        try:
+            if selected_month:
+                df = self.db_handler.get_recalls_frame(month=selected_month, tipo=selected_type)
+            else:
+                df = self.db_handler.get_recalls_frame(data_inizio=oggi, data_fine=oggi + timedelta(days=days_threshold),
+                                                       tipo=selected_type)
+        except Exception as e:
+            logging.error(f"Errore lettura richiami: {e}")
+            return {'total': 0, 'recalls': [], 'type_counts': conteggi_per_tipo(matrice_tipi(pd.Series(dtype=object)))}
+
+        col = COLONNE['richiami']
+        dettagli = pd.DataFrame({
+            'paziente_id': df['ID_PAZIENTE'],
+            'nome': df['NOME'].where(df['NOME'] != '', 'Non specificato'),
+            'tipo_richiamo': df['TIPO_RICHIAMO'],
+            'mesi_richiamo': df[col['mesi']],
+            'ultima_visita': df[col['ultima_visita']].fillna(''),
+            'data_richiamo': df['DATA_RICHIAMO'],
+            'data_richiamo1': df[col['data1']].fillna(''),
+            'data_richiamo2': df[col['data2']].fillna(''),
+            'telefono': df['TELEFONO'].where(df['TELEFONO'] != '', 'Non disponibile'),
+        }).to_dict('records')
+
+        return {'total': len(dettagli), 'recalls': dettagli, 'type_counts': conteggi_per_tipo(matrice_tipi(df['TIPI']))}
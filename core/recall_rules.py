@@ -0,0 +1,135 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from config.constants import COLONNE, TIPO_RICHIAMI
+
+# Valori di DB_PARICHI che indicano un paziente da richiamare (campo logico o carattere)
+VALORI_DA_RICHIAMARE = {'T', 'S', 'Y', '1', 'TRUE'}
+
+
+def da_richiamare(serie):
+    """Maschera dei pazienti con il flag DB_PARICHI attivo."""
+    return (serie.eq(True) | serie.astype(str).str.strip().str.upper().isin(VALORI_DA_RICHIAMARE)).astype(bool)
+
+
+def data_effettiva_richiamo(df):
+    """
+    Data effettiva del prossimo richiamo per ogni riga dell'anagrafica: la prima
+    tra DB_PAMODA1 e DB_PAMODA2 se presenti, altrimenti ultima visita
+    (DB_PAULTVI) più DB_PARITAR mesi.
+
+    Returns:
+        pd.Series: datetime64, NaT se nessuna data è ricavabile
+    """
+    col = COLONNE['richiami']
+    data1 = pd.to_datetime(df[col['data1']], errors='coerce')
+    data2 = pd.to_datetime(df[col['data2']], errors='coerce')
+    ultima_visita = pd.to_datetime(df[col['ultima_visita']], errors='coerce')
+    mesi = pd.to_numeric(df[col['mesi']], errors='coerce').fillna(0).astype(int)
+
+    # Mesi di calendario senza ciclare sulle righe: si calcola il primo del mese
+    # di destinazione e si riporta il giorno, troncato alla fine del mese
+    mesi_assoluti = ultima_visita.dt.year * 12 + ultima_visita.dt.month - 1 + mesi.where(mesi > 0)
+    primo = pd.to_datetime(pd.DataFrame({'year': mesi_assoluti // 12, 'month': mesi_assoluti % 12 + 1, 'day': 1}),
+                           errors='coerce')
+    giorno = np.minimum(ultima_visita.dt.day, primo.dt.days_in_month)
+    calcolata = primo + pd.to_timedelta(giorno - 1, unit='D')
+
+    esplicita = data1.where(data1.notna() & ((data1 <= data2) | data2.isna()), data2)
+    return esplicita.fillna(calcolata)
+
+
+def matrice_tipi(serie):
+    """
+    Scompone DB_PARIMOT, che può contenere più codici (es. "15", "24"), in una
+    colonna booleana per ogni codice di TIPO_RICHIAMI.
+
+    Returns:
+        pd.DataFrame: stesso indice, una colonna per codice
+    """
+    testo = serie.fillna('').astype(str)
+    return pd.DataFrame({codice: testo.str.contains(codice, regex=False).astype(bool) for codice in TIPO_RICHIAMI},
+                        index=serie.index)
+
+
+def codici_tipi(matrice):
+    """Codici presenti in ogni riga, in ordine (es. "15")."""
+    codici = pd.Series('', index=matrice.index, dtype=object)
+    for codice in TIPO_RICHIAMI:
+        codici = codici + np.where(matrice[codice].to_numpy(), codice, '')
+    return codici
+
+
+def descrizione_tipi(matrice, separatore=" e "):
+    """Descrizione leggibile dei tipi di ogni riga (es. "Generico e Impianto"), 'Non specificato' se nessuno."""
+    descrizione = pd.Series('', index=matrice.index, dtype=object)
+    for codice, nome in TIPO_RICHIAMI.items():
+        presente = matrice[codice]
+        descrizione = descrizione.mask(presente & (descrizione != ''), descrizione + separatore + nome)
+        descrizione = descrizione.mask(presente & (descrizione == ''), nome)
+    return descrizione.mask(descrizione == '', 'Non specificato')
+
+
+def valuta_richiami(df, oggi=None, giorni=None, inizio=None, fine=None, tipo=None):
+    """
+    Valuta i richiami di tutta l'anagrafica con operazioni sulle colonne.
+
+    Args:
+        df (pd.DataFrame): pazienti con le colonne di COLONNE['richiami'] e, se
+            presenti, quelle di contatto di COLONNE['pazienti']
+        oggi (date, opzionale): data di riferimento (default oggi)
+        giorni (int, opzionale): un richiamo è in scadenza se la sua data cade
+            entro oggi + giorni (scaduti compresi)
+        inizio, fine (date, opzionali): limita alle date effettive nell'intervallo (inclusi)
+        tipo (str, opzionale): limita ai richiami che contengono il codice indicato
+
+    Returns:
+        pd.DataFrame: una riga per paziente da richiamare con data ricavabile, ordinate
+            per data: ID_PAZIENTE, NOME, TELEFONO, DATA_RICHIAMO, GIORNI_MANCANTI,
+            SCADUTO, IN_SCADENZA, TIPI (codici, es. "15"), TIPO_RICHIAMO e RECNO
+    """
+    col, paz = COLONNE['richiami'], COLONNE['pazienti']
+    oggi = pd.Timestamp(oggi or date.today())
+
+    attivi = df[da_richiamare(df[col['da_richiamare']])]
+    effettiva = data_effettiva_richiamo(attivi)
+    valide = effettiva.notna()
+    if inizio is not None:
+        valide &= effettiva >= pd.Timestamp(inizio)
+    if fine is not None:
+        valide &= effettiva <= pd.Timestamp(fine)
+
+    matrice = matrice_tipi(attivi[col['tipo']])
+    if tipo is not None:
+        valide &= matrice[str(tipo)] if str(tipo) in matrice else False
+
+    attivi, effettiva, matrice = attivi[valide], effettiva[valide], matrice[valide]
+    giorni_mancanti = (effettiva - oggi).dt.days
+
+    def testo(nome):
+        return attivi[nome].fillna('').astype(str).str.strip() if nome in attivi else pd.Series('', index=attivi.index)
+
+    cellulare, telefono = testo(paz['cellulare']), testo(paz['telefono'])
+    risultato = pd.DataFrame({
+        'ID_PAZIENTE': testo(col['id_paziente']),
+        'NOME': testo(paz['nome']),
+        'TELEFONO': cellulare.where(cellulare != '', telefono),
+        'DATA_RICHIAMO': effettiva.dt.date,
+        'GIORNI_MANCANTI': giorni_mancanti.astype('int32'),
+        'SCADUTO': giorni_mancanti < 0,
+        'IN_SCADENZA': giorni_mancanti <= giorni if giorni is not None else pd.Series(True, index=attivi.index),
+        'TIPI': codici_tipi(matrice),
+        'TIPO_RICHIAMO': descrizione_tipi(matrice),
+        'RECNO': attivi['RECNO'] if 'RECNO' in attivi else attivi.index,
+    })
+    return risultato.sort_values(['DATA_RICHIAMO', 'RECNO'], kind='stable').reset_index(drop=True)
+
+
+def conteggi_per_tipo(matrice):
+    """Numero di richiami per tipo (un richiamo "15" conta per entrambi) più 'Non specificato'."""
+    conteggi = {nome: int(matrice[codice].sum()) for codice, nome in TIPO_RICHIAMI.items()}
+    conteggi['Non specificato'] = int((~matrice.any(axis=1)).sum()) if len(matrice) else 0
+    return conteggi
+
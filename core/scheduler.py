@@ -0,0 +1,301 @@
+import os
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from config.constants import PATH_SCHEDULER_DB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    nome TEXT PRIMARY KEY,
+    ultima_prevista TEXT,
+    ultimo_avvio TEXT,
+    ultima_fine TEXT,
+    esito TEXT,
+    errore TEXT,
+    proprietario TEXT,
+    scadenza_lock TEXT
+);
+"""
+
+# Limiti dei cinque campi di una cadenza: minuto, ora, giorno del mese, mese, giorno della settimana
+_CAMPI_CRON = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _leggi_campo(testo, minimo, massimo):
+    valori = set()
+    for parte in testo.split(','):
+        intervallo, _, passo = parte.partition('/')
+        if intervallo == '*':
+            da, a = minimo, massimo
+        elif '-' in intervallo:
+            da, a = (int(v) for v in intervallo.split('-'))
+        else:
+            da = a = int(intervallo)
+            if passo:
+                a = massimo
+        if not (minimo <= da <= a <= massimo):
+            raise ValueError(f"Valore fuori intervallo {minimo}-{massimo}: {parte}")
+        valori.update(range(da, a + 1, int(passo) if passo else 1))
+    return valori
+
+
+class Cadenza:
+    """
+    Cadenza in stile cron: "minuto ora giorno mese giorno_settimana", con *,
+    liste (1,15), intervalli (9-18) e passi (*/15). Il giorno della settimana
+    segue cron: 0 o 7 = domenica, 1 = lunedì. Come in cron, se giorno del mese
+    e giorno della settimana sono entrambi limitati basta che uno corrisponda.
+
+    Esempi: "30 18 * * *" ogni giorno alle 18:30, "*/15 8-20 * * 1-6" ogni
+    quarto d'ora dalle 8 alle 20 dal lunedì al sabato.
+    """
+
+    def __init__(self, espressione):
+        self.espressione = espressione
+        campi = espressione.split()
+        if len(campi) != 5:
+            raise ValueError(f"Cadenza non valida (servono 5 campi): {espressione!r}")
+        self.minuti, self.ore, self.giorni, self.mesi, settimana = (
+            sorted(_leggi_campo(c, *limiti)) for c, limiti in zip(campi, _CAMPI_CRON)
+        )
+        self.settimana = {g % 7 for g in settimana}
+        self._giorno_libero, self._settimana_libera = campi[2] == '*', campi[4] == '*'
+
+    def _giorno_valido(self, giorno):
+        nel_mese = giorno.day in self.giorni
+        in_settimana = (giorno.weekday() + 1) % 7 in self.settimana
+        if self._giorno_libero or self._settimana_libera:
+            return nel_mese and in_settimana
+        return nel_mese or in_settimana
+
+    def prossima(self, dopo):
+        """Primo istante della cadenza strettamente successivo a dopo (al minuto)."""
+        inizio = dopo.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        giorno = inizio.date()
+        # Oltre quattro anni non può esserci una corrispondenza (es. 29 febbraio già incluso)
+        for _ in range(366 * 4 + 1):
+            if giorno.month in self.mesi and self._giorno_valido(giorno):
+                for ora in self.ore:
+                    for minuto in self.minuti:
+                        candidato = datetime(giorno.year, giorno.month, giorno.day, ora, minuto)
+                        if candidato >= inizio:
+                            return candidato
+            giorno += timedelta(days=1)
+        raise ValueError(f"La cadenza {self.espressione!r} non ha occorrenze")
+
+    def __repr__(self):
+        return f"Cadenza({self.espressione!r})"
+
+
+class Job:
+    """
+    Lavoro periodico dello scheduler.
+
+    Args:
+        nome (str): identificativo, usato per lo stato persistente
+        funzione (callable): eseguita senza argomenti
+        cadenza (str | Cadenza): vedi Cadenza
+        recupero (timedelta | None): un'esecuzione persa (processo fermo) viene
+            recuperata all'avvio solo se non è più vecchia di così; None = sempre,
+            timedelta(0) = mai
+        durata_max (timedelta): dopo questo tempo il lock di un'esecuzione
+            interrotta (processo terminato) scade e il job può ripartire
+    """
+
+    def __init__(self, nome, funzione, cadenza, recupero=None, durata_max=timedelta(hours=1)):
+        self.nome = nome
+        self.funzione = funzione
+        self.cadenza = cadenza if isinstance(cadenza, Cadenza) else Cadenza(cadenza)
+        self.recupero = recupero
+        self.durata_max = durata_max
+        self.prossima = None
+
+
+def _iso(istante):
+    return istante.isoformat(timespec='seconds') if istante else None
+
+
+class StatoScheduler:
+    """
+    Stato dei job su SQLite: ultima esecuzione prevista, esito e lock con
+    scadenza. Il lock è preso con un UPDATE condizionato, quindi impedisce le
+    esecuzioni sovrapposte dello stesso job anche tra processi diversi (es. lo
+    scheduler e uno script lanciato a mano sullo stesso database).
+    """
+
+    def __init__(self, percorso_db):
+        self.percorso_db = percorso_db
+        if percorso_db != ':memory:':
+            os.makedirs(os.path.dirname(percorso_db) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.proprietario = f"{socket.gethostname()}:{os.getpid()}"
+
+    def ultima_prevista(self, nome):
+        with self._lock:
+            riga = self._conn.execute("SELECT ultima_prevista FROM job WHERE nome = ?", (nome,)).fetchone()
+        return datetime.fromisoformat(riga[0]) if riga and riga[0] else None
+
+    def acquisisci(self, nome, durata_max, adesso=None):
+        """
+        Prende il lock del job se libero o scaduto.
+
+        Returns:
+            bool: True se il lock è stato preso
+        """
+        adesso = adesso or datetime.now()
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO job (nome) VALUES (?)", (nome,))
+            cursore = self._conn.execute(
+                "UPDATE job SET proprietario = ?, scadenza_lock = ?, ultimo_avvio = ? "
+                "WHERE nome = ? AND (proprietario IS NULL OR scadenza_lock <= ?)",
+                (self.proprietario, _iso(adesso + durata_max), _iso(adesso), nome, _iso(adesso))
+            )
+            return cursore.rowcount == 1
+
+    def rilascia(self, nome, prevista, esito, errore=None):
+        """Registra la fine dell'esecuzione prevista per l'istante indicato e libera il lock."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET ultima_prevista = ?, ultima_fine = ?, esito = ?, errore = ?, proprietario = NULL, "
+                "scadenza_lock = NULL WHERE nome = ? AND proprietario = ?",
+                (_iso(prevista), _iso(datetime.now()), esito, errore, nome, self.proprietario)
+            )
+
+    def riepilogo(self):
+        with self._lock:
+            cursore = self._conn.execute("SELECT * FROM job ORDER BY nome")
+            colonne = [c[0] for c in cursore.description]
+            return [dict(zip(colonne, r)) for r in cursore.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Scheduler:
+    """
+    Scheduler dei job periodici in un unico processo, così indici, snapshot,
+    sessioni HTTP e client Google restano caldi tra un'esecuzione e l'altra.
+
+    Ogni job gira in un thread del pool, quindi una sincronizzazione lunga non
+    ritarda i promemoria; lo stesso job non viene mai eseguito in
+    sovrapposizione (lock in StatoScheduler). Dopo un periodo di inattività
+    ogni job recupera al più un'esecuzione persa, entro il suo limite di recupero.
+
+    Uso:
+        scheduler = Scheduler()
+        scheduler.aggiungi(Job('promemoria', manager.elabora_promemoria_giornalieri, "30 18 * * *"))
+        scheduler.avvia()   # bloccante fino a ferma()
+    """
+
+    def __init__(self, percorso_db=PATH_SCHEDULER_DB):
+        self.stato = StatoScheduler(percorso_db)
+        self.jobs = {}
+        self._in_corso = set()
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._fermo = threading.Event()
+        self._pool = None
+
+    def aggiungi(self, job):
+        self.jobs[job.nome] = job
+        return job
+
+    def _pianifica(self, job, adesso):
+        """Prossima esecuzione del job: quella persa se è da recuperare, altrimenti la prossima della cadenza."""
+        ultima = self.stato.ultima_prevista(job.nome)
+        if ultima is None:
+            # Primo avvio: nessun recupero, si parte dalla prossima occorrenza
+            job.prossima = job.cadenza.prossima(adesso)
+            return
+        persa = job.cadenza.prossima(ultima)
+        if persa > adesso:
+            job.prossima = persa
+            return
+        # Più esecuzioni perse si riducono all'ultima: ogni job elabora lo stato attuale, non un arretrato
+        ultima_persa = persa
+        while True:
+            successiva = job.cadenza.prossima(ultima_persa)
+            if successiva > adesso:
+                break
+            ultima_persa = successiva
+        if job.recupero is None or adesso - ultima_persa <= job.recupero:
+            logging.info(f"[Scheduler] {job.nome}: recupero dell'esecuzione del {ultima_persa:%Y-%m-%d %H:%M}")
+            job.prossima = ultima_persa
+        else:
+            logging.info(f"[Scheduler] {job.nome}: esecuzione del {ultima_persa:%Y-%m-%d %H:%M} troppo vecchia, non recuperata")
+            job.prossima = successiva
+
+    def _esegui(self, job, prevista):
+        if not self.stato.acquisisci(job.nome, job.durata_max):
+            logging.warning(f"[Scheduler] {job.nome}: esecuzione precedente ancora in corso, salto {prevista:%H:%M}")
+            return
+        inizio = datetime.now()
+        esito, errore = 'ok', None
+        try:
+            logging.info(f"[Scheduler] Avvio {job.nome} (previsto {prevista:%Y-%m-%d %H:%M})")
+            job.funzione()
+        except Exception as e:
+            esito, errore = 'errore', str(e)
+            logging.error(f"[Scheduler] Errore nel job {job.nome}: {e}", exc_info=True)
+        finally:
+            self.stato.rilascia(job.nome, prevista, esito, errore)
+            durata = (datetime.now() - inizio).total_seconds()
+            logging.info(f"[Scheduler] Fine {job.nome}: {esito} in {durata:.1f}s")
+
+    def _lancia(self, job, prevista):
+        with self._lock:
+            if job.nome in self._in_corso:
+                logging.warning(f"[Scheduler] {job.nome}: ancora in corso, salto {prevista:%H:%M}")
+                return
+            self._in_corso.add(job.nome)
+
+        def esegui():
+            try:
+                self._esegui(job, prevista)
+            finally:
+                with self._lock:
+                    self._in_corso.discard(job.nome)
+                self._sveglia.set()
+
+        self._pool.submit(esegui)
+
+    def esegui_ora(self, nome):
+        """Esegue subito un job, nel thread corrente, rispettando il lock."""
+        self._esegui(self.jobs[nome], datetime.now().replace(second=0, microsecond=0))
+
+    def avvia(self):
+        """Ciclo principale: dorme fino alla prossima scadenza e lancia i job dovuti. Bloccante."""
+        self._fermo.clear()
+        self._pool = ThreadPoolExecutor(max_workers=max(len(self.jobs), 1), thread_name_prefix="job")
+        adesso = datetime.now()
+        for job in self.jobs.values():
+            self._pianifica(job, adesso)
+            logging.info(f"[Scheduler] {job.nome} ({job.cadenza.espressione}): prossima esecuzione {job.prossima:%Y-%m-%d %H:%M}")
+
+        try:
+            while not self._fermo.is_set():
+                adesso = datetime.now()
+                for job in self.jobs.values():
+                    if job.prossima <= adesso:
+                        self._lancia(job, job.prossima)
+                        job.prossima = job.cadenza.prossima(adesso)
+                prossima = min(job.prossima for job in self.jobs.values()) if self.jobs else adesso + timedelta(minutes=1)
+                # Risveglio almeno ogni minuto: regge cambi d'ora e sospensioni del sistema
+                attesa = min(max((prossima - datetime.now()).total_seconds(), 0), 60)
+                self._sveglia.wait(attesa)
+                self._sveglia.clear()
+        finally:
+            self._pool.shutdown(wait=True)
+            logging.info("[Scheduler] Arrestato")
+
+    def ferma(self):
+        self._fermo.set()
+        self._sveglia.set()
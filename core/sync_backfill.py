@@ -0,0 +1,97 @@
+import logging
+from datetime import date, timedelta
+
+from config.constants import GOOGLE, BACKFILL_GIORNI_BLOCCO
+from core.sync_executor import EsecutoreSync
+from core.sync_reconciler import piani_per_calendario
+from core.sync_utils import load_sync_map, migra_chiavi_legacy
+
+
+def chiave_checkpoint(data_inizio, data_fine):
+    return f"backfill:{data_inizio.isoformat()}:{data_fine.isoformat()}"
+
+
+def backfill(calendar_sync, data_inizio, data_fine, sync_map=None, giorni_per_blocco=None,
+             riprendi=True, simula=False, progress_callback=None):
+    """
+    Sincronizza tutti gli appuntamenti tra data_inizio e data_fine (incluse),
+    procedendo per blocchi di giorni in ordine di data.
+
+    Dopo ogni blocco riuscito la data raggiunta viene salvata nell'archivio della
+    sync map: se il processo si interrompe, una nuova esecuzione con lo stesso
+    intervallo riparte dal blocco successivo. Un blocco con errori blocca il
+    checkpoint, così alla ripresa viene riconciliato di nuovo (gli eventi già
+    creati risultano in mappa e non vengono duplicati).
+
+    Args:
+        calendar_sync (GoogleCalendarSync): client autenticato (non usato se simula=True)
+        data_inizio, data_fine (date): intervallo, estremi inclusi
+        sync_map (ArchivioSync, opzionale): default load_sync_map()
+        giorni_per_blocco (int, opzionale): ampiezza dei blocchi (default BACKFILL_GIORNI_BLOCCO)
+        riprendi (bool): riparte dall'ultimo checkpoint dello stesso intervallo
+        simula (bool): calcola le operazioni senza chiamare Google e senza modificare
+            la sync map né il checkpoint
+        progress_callback (callable, opzionale): chiamata con (giorni completati, giorni totali)
+
+    Returns:
+        dict: conteggi 'creati', 'aggiornati', 'eliminati', 'errori' e 'blocchi'
+    """
+    if data_fine < data_inizio:
+        raise ValueError(f"Intervallo non valido: {data_inizio} > {data_fine}")
+    sync_map = sync_map if sync_map is not None else load_sync_map()
+    giorni_per_blocco = giorni_per_blocco or BACKFILL_GIORNI_BLOCCO
+    chiave = chiave_checkpoint(data_inizio, data_fine)
+
+    corrente = data_inizio
+    if riprendi:
+        raggiunta = sync_map.leggi_stato(chiave)
+        if raggiunta:
+            corrente = date.fromisoformat(raggiunta) + timedelta(days=1)
+            logging.info(f"Backfill {data_inizio} - {data_fine}: ripresa da {corrente}")
+    elif not simula:
+        sync_map.scrivi_stato(chiave, None)
+
+    db_handler = calendar_sync.db_handler
+    # In simulazione si pianifica su una copia: l'archivio non viene toccato
+    mappa_piano = dict(sync_map) if simula else sync_map
+    migra_chiavi_legacy(mappa_piano, db_handler)
+    esecutore = None if simula else EsecutoreSync(calendar_sync)
+    giorni_totali = (data_fine - data_inizio).days + 1
+    totale = {'creati': 0, 'aggiornati': 0, 'eliminati': 0, 'errori': 0, 'blocchi': 0}
+    checkpoint_fermo = False
+
+    while corrente <= data_fine:
+        fine_blocco = min(corrente + timedelta(days=giorni_per_blocco - 1), data_fine)
+        appuntamenti = db_handler.get_appointments_frame(data_inizio=corrente, data_fine=fine_blocco)
+        lavori = piani_per_calendario(appuntamenti, mappa_piano, GOOGLE['calendars_by_studio'], GOOGLE['default_calendar'],
+                                      corrente, fine_blocco)
+
+        if simula:
+            esito = {
+                'creati': sum(len(p['to_create']) for p in lavori.values()),
+                'aggiornati': sum(len(p['to_update']) for p in lavori.values()),
+                'eliminati': sum(len(p['to_delete']) + len(p['to_move']) for p in lavori.values()),
+                'errori': 0,
+            }
+        else:
+            esito = esecutore.esegui(lavori, sync_map)
+
+        for k in ('creati', 'aggiornati', 'eliminati', 'errori'):
+            totale[k] += esito[k]
+        totale['blocchi'] += 1
+        logging.info(f"Backfill {corrente} - {fine_blocco}: {len(appuntamenti)} appuntamenti, creati {esito['creati']}, "
+                     f"aggiornati {esito['aggiornati']}, eliminati {esito['eliminati']}, errori {esito['errori']}")
+
+        if esito['errori']:
+            checkpoint_fermo = True
+        if not simula and not checkpoint_fermo:
+            sync_map.scrivi_stato(chiave, fine_blocco.isoformat())
+
+        if progress_callback:
+            progress_callback((fine_blocco - data_inizio).days + 1, giorni_totali)
+        corrente = fine_blocco + timedelta(days=1)
+
+    if not simula and not checkpoint_fermo:
+        # Intervallo completato: una nuova esecuzione ricomincia da capo
+        sync_map.scrivi_stato(chiave, None)
+    return totale
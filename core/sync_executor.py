@@ -0,0 +1,91 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config.constants import SYNC_WORKER_PER_CALENDARIO, SYNC_BATCH_IN_VOLO
+
+
+class EsecutoreSync:
+    """
+    Esegue la sincronizzazione di più calendari in parallelo.
+
+    Ogni calendario ha il proprio pool di thread, che invia in parallelo i
+    blocchi di operazioni (un blocco = una richiesta batch HTTP). Un semaforo
+    comune limita le richieste batch in corso su tutti i calendari, perché la
+    quota Google è per progetto e non per calendario.
+    """
+
+    def __init__(self, calendar_sync, worker_per_calendario=None, batch_in_volo=None, dimensione_blocco=50, progress_callback=None):
+        self.calendar_sync = calendar_sync
+        self.worker_per_calendario = worker_per_calendario or SYNC_WORKER_PER_CALENDARIO
+        self.dimensione_blocco = dimensione_blocco
+        self.progress_callback = progress_callback
+        self._in_volo = threading.BoundedSemaphore(batch_in_volo or SYNC_BATCH_IN_VOLO)
+
+    def _blocchi(self, lavoro):
+        """Divide le operazioni di un calendario in blocchi da dimensione_blocco."""
+        operazioni = [('to_create', x) for x in lavoro.get('to_create', ())]
+        operazioni += [('to_update', x) for x in lavoro.get('to_update', ())]
+        operazioni += [('to_delete', x) for x in lavoro.get('to_delete', ())]
+        operazioni += [('to_move', x) for x in lavoro.get('to_move', ())]
+        for inizio in range(0, len(operazioni), self.dimensione_blocco):
+            blocco = {'to_create': [], 'to_update': [], 'to_delete': [], 'to_move': []}
+            for tipo, elemento in operazioni[inizio:inizio + self.dimensione_blocco]:
+                blocco[tipo].append(elemento)
+            yield blocco
+
+    def _esegui_blocco(self, calendar_id, blocco, sync_map):
+        with self._in_volo:
+            return self.calendar_sync.sincronizza_batch(calendar_id, sync_map=sync_map, **blocco)
+
+    def esegui(self, lavori, sync_map=None):
+        """
+        Args:
+            lavori (dict): calendar_id → {'to_create': [...], 'to_update': [...], 'to_delete': [...], 'to_move': [...]}
+                (vedi riconcilia)
+            sync_map (dict, opzionale): mappa aggiornata dai singoli blocchi
+
+        Returns:
+            dict: conteggi totali ('creati', 'aggiornati', 'eliminati', 'errori')
+                e 'per_calendario' con gli stessi conteggi per ogni calendario
+        """
+        totale = sum(len(lavoro.get(k, ())) for lavoro in lavori.values() for k in ('to_create', 'to_update', 'to_delete', 'to_move'))
+        esito = {'creati': 0, 'aggiornati': 0, 'eliminati': 0, 'errori': 0, 'per_calendario': {}}
+        if totale == 0:
+            return esito
+
+        pool = {
+            calendar_id: ThreadPoolExecutor(max_workers=self.worker_per_calendario, thread_name_prefix=f"sync-{i}")
+            for i, calendar_id in enumerate(lavori)
+        }
+        completati = 0
+        try:
+            futures = {}
+            for calendar_id, lavoro in lavori.items():
+                esito['per_calendario'][calendar_id] = {'creati': 0, 'aggiornati': 0, 'eliminati': 0, 'errori': 0}
+                for blocco in self._blocchi(lavoro):
+                    n = sum(len(v) for v in blocco.values())
+                    futures[pool[calendar_id].submit(self._esegui_blocco, calendar_id, blocco, sync_map)] = (calendar_id, n)
+
+            # I conteggi sono aggiornati solo da questo thread: nessun lock necessario
+            for future in as_completed(futures):
+                calendar_id, n = futures[future]
+                try:
+                    parziale = future.result()
+                except Exception as e:
+                    logging.error(f"Errore sync blocco su {calendar_id}: {e}")
+                    parziale = {'errori': n}
+                for chiave, valore in parziale.items():
+                    esito[chiave] = esito.get(chiave, 0) + valore
+                    esito['per_calendario'][calendar_id][chiave] = esito['per_calendario'][calendar_id].get(chiave, 0) + valore
+
+                completati += n
+                if self.progress_callback:
+                    self.progress_callback(completati, totale)
+        finally:
+            for esecutore in pool.values():
+                esecutore.shutdown(wait=True)
+
+        logging.info(f"Sync parallela completata su {len(lavori)} calendari: creati {esito['creati']}, "
+                     f"aggiornati {esito['aggiornati']}, eliminati {esito['eliminati']}, errori {esito['errori']}")
+        return esito
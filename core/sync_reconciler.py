@@ -0,0 +1,252 @@
+import hashlib
+import logging
+from datetime import date
+
+import pandas as pd
+
+from core.sync_utils import compute_app_id, compute_app_ids, filter_appointments_for_sync
+
+# Campi dell'evento Google confrontati per decidere cosa inviare con events().patch
+CAMPI_EVENTO = ('summary', 'description', 'start', 'end', 'colorId')
+
+# Proprietà private (extendedProperties.private) che legano l'evento al record WinDent;
+# ETICHETTA_SYNC=VALORE_ETICHETTA è il filtro privateExtendedProperty degli eventi nostri
+ETICHETTA_SYNC = 'windent_sync'
+VALORE_ETICHETTA = '1'
+PROPRIETA_APP_ID = 'windent_app_id'
+PROPRIETA_HASH = 'windent_hash'
+PROPRIETA_DATA = 'windent_data'
+PROPRIETA_STUDIO = 'windent_studio'
+
+# Suffisso della voce provvisoria di un evento rimasto sul vecchio calendario
+# dopo uno spostamento di studio non completato (vedi sincronizza_batch)
+SUFFISSO_SPOSTATO = '#spostato'
+
+
+def impronta_campi(evento):
+    """Impronta breve di ogni campo dell'evento, salvata nella sync map per calcolare le patch."""
+    return {
+        campo: hashlib.md5(repr(evento.get(campo)).encode('utf-8')).hexdigest()[:12]
+        for campo in CAMPI_EVENTO
+    }
+
+
+def campi_modificati(evento, voce):
+    """
+    Sottoinsieme del body con i soli campi cambiati rispetto alla voce della sync map.
+    Le voci senza impronte (create prima delle patch) ricevono tutti i campi.
+    """
+    precedenti = (voce or {}).get('campi')
+    if not precedenti:
+        return {campo: evento[campo] for campo in CAMPI_EVENTO if campo in evento}
+    attuali = impronta_campi(evento)
+    return {campo: evento[campo] for campo in CAMPI_EVENTO if campo in evento and attuali[campo] != precedenti.get(campo)}
+
+
+def proprieta_evento(app_id, voce):
+    """extendedProperties da inserire nel body dell'evento per la voce della sync map indicata."""
+    return {'private': {
+        ETICHETTA_SYNC: VALORE_ETICHETTA,
+        PROPRIETA_APP_ID: app_id,
+        PROPRIETA_HASH: voce.get('hash') or '',
+        PROPRIETA_DATA: voce.get('data') or '',
+        PROPRIETA_STUDIO: str(voce.get('studio') or 0),
+    }}
+
+
+def voce_da_evento(evento, calendar_id):
+    """
+    Ricostruisce la voce della sync map dalle proprietà private di un evento Google.
+
+    Returns:
+        tuple: (app_id, voce), oppure (None, None) se l'evento non è stato creato dalla sincronizzazione
+    """
+    proprieta = (evento.get('extendedProperties') or {}).get('private') or {}
+    if proprieta.get(ETICHETTA_SYNC) != VALORE_ETICHETTA or not proprieta.get(PROPRIETA_APP_ID):
+        return None, None
+    inizio = evento.get('start') or {}
+    try:
+        studio = int(proprieta.get(PROPRIETA_STUDIO) or 0)
+    except ValueError:
+        studio = 0
+    return proprieta[PROPRIETA_APP_ID], {
+        'event_id': evento['id'],
+        'hash': proprieta.get(PROPRIETA_HASH, ''),
+        'calendar_id': calendar_id,
+        'data': proprieta.get(PROPRIETA_DATA) or (inizio.get('dateTime') or inizio.get('date') or '')[:10],
+        'studio': studio,
+        'campi': impronta_campi(evento),
+        'etag': evento.get('etag'),
+    }
+
+
+def _data_e_studio(app_id, voce):
+    """Data (ISO) e studio di una voce; per le voci vecchie si ricavano dalla chiave DATA_ORA_STUDIO_..."""
+    if voce.get('data'):
+        return voce['data'], voce.get('studio')
+    parti = app_id.split('_')
+    try:
+        return parti[0][:10], int(float(parti[2]))
+    except (IndexError, ValueError):
+        return parti[0][:10], None
+
+
+def riconcilia(appointments, sync_map, calendar_id, inizio=None, fine=None, studi=None, recnos_modificati=None, presenti=None):
+    """
+    Confronta gli appuntamenti del DBF con la sync map e calcola le operazioni
+    necessarie su un calendario.
+
+    Le voci della mappa associate a calendar_id, con data tra inizio e fine e
+    studio in studi, che non corrispondono più a nessun appuntamento (record
+    cancellato, spostato o modificato nella chiave) vengono eliminate.
+
+    Args:
+        appointments (list[dict] | pd.DataFrame): tutti gli appuntamenti dell'ambito (es. un mese)
+        sync_map (dict): mappa app_id → voce
+        calendar_id (str): calendario di destinazione
+        inizio, fine (date, opzionali): intervallo dell'ambito, estremi inclusi
+        studi (set[int], opzionale): studi inclusi nell'ambito (default: tutti)
+        recnos_modificati (set[int], opzionale): vedi filter_appointments_for_sync
+        presenti (set[str], opzionale): chiavi di tutti gli appuntamenti letti, anche
+            di altri calendari; evita di eliminare un appuntamento spostato di studio,
+            che viene invece ricreato sul nuovo calendario
+
+    La sync map viene solo letta: il piano non ha effetti finché non lo esegue EsecutoreSync.
+
+    Returns:
+        dict: {'to_create': [...], 'to_update': [(app, event_id)], 'to_delete': [app_id],
+            'to_move': [(app_id, voce precedente)]}, nel formato accettato da EsecutoreSync;
+            gli appuntamenti di to_move sono anche in to_create (nuovo evento sul calendario attuale)
+    """
+    to_create, to_update, _ = filter_appointments_for_sync(appointments, sync_map, recnos_modificati)
+    if isinstance(appointments, pd.DataFrame):
+        letti = set(compute_app_ids(appointments)) if len(appointments) else set()
+    else:
+        letti = {compute_app_id(app) for app in appointments}
+    presenti = set(presenti or ()) | letti
+
+    # Appuntamenti passati a uno studio con un altro calendario: il nuovo evento
+    # viene creato e il vecchio eliminato; la mappa non si tocca qui, ma solo
+    # in sincronizza_batch, dopo le chiamate a Google
+    to_move = []
+    for app, event_id in list(to_update):
+        app_id = compute_app_id(app)
+        voce = sync_map[app_id]
+        if voce.get('calendar_id', calendar_id) != calendar_id:
+            to_update.remove((app, event_id))
+            to_create.append(app)
+            to_move.append((app_id, dict(voce)))
+
+    da = inizio.isoformat() if isinstance(inizio, date) else None
+    a = fine.isoformat() if isinstance(fine, date) else None
+
+    to_delete = []
+    for app_id, voce in sync_map.items():
+        originale = app_id[:-len(SUFFISSO_SPOSTATO)] if app_id.endswith(SUFFISSO_SPOSTATO) else None
+        if originale in letti:
+            # Vecchio evento di un appuntamento passato a questo calendario, da eliminare di nuovo
+            to_delete.append(app_id)
+            continue
+        if app_id in presenti or originale in presenti or voce.get('calendar_id', calendar_id) != calendar_id:
+            continue
+        data, studio = _data_e_studio(app_id, voce)
+        if (da and data < da) or (a and data > a):
+            continue
+        if studi is not None and studio not in studi:
+            continue
+        to_delete.append(app_id)
+
+    if to_delete and len(appointments) == 0:
+        # Una lettura del DBF fallita restituisce una lista vuota: non svuotare il calendario
+        logging.warning(f"Riconciliazione {calendar_id}: nessun appuntamento letto, "
+                        f"{len(to_delete)} eliminazioni sospese per sicurezza")
+        to_delete = []
+
+    logging.info(f"Riconciliazione {calendar_id}: {len(to_create)} da creare, "
+                 f"{len(to_update)} da aggiornare, {len(to_delete)} da eliminare, {len(to_move)} da spostare")
+    return {'to_create': to_create, 'to_update': to_update, 'to_delete': to_delete, 'to_move': to_move}
+
+
+def piani_per_calendario(appointments, sync_map, calendars_by_studio, default_calendar, inizio=None, fine=None, recnos_modificati=None):
+    """
+    Raggruppa gli appuntamenti per calendario dello studio (default_calendar per
+    gli studi non configurati) e riconcilia ciascun calendario.
+
+    Returns:
+        dict: calendar_id → piano di riconcilia, pronto per EsecutoreSync.esegui
+    """
+    if not isinstance(appointments, pd.DataFrame):
+        appointments = pd.DataFrame(list(appointments))
+
+    studi = {}
+    for studio, calendar_id in calendars_by_studio.items():
+        studi.setdefault(calendar_id, set()).add(studio)
+
+    if len(appointments):
+        numeri_studio = pd.to_numeric(appointments['STUDIO'], errors='coerce').fillna(0).astype(int)
+        calendari = numeri_studio.map(lambda s: calendars_by_studio.get(s, default_calendar))
+        for calendar_id, studio in set(zip(calendari, numeri_studio)):
+            studi.setdefault(calendar_id, set()).add(studio)
+        presenti = set(compute_app_ids(appointments))
+    else:
+        calendari = pd.Series(dtype=object)
+        presenti = set()
+
+    return {
+        calendar_id: riconcilia(appointments[calendari == calendar_id] if len(appointments) else appointments,
+                                sync_map, calendar_id, inizio, fine, studi[calendar_id], recnos_modificati, presenti)
+        for calendar_id in studi
+    }
+
+
+def applica_modifiche_google(eventi, sync_map, calendar_id):
+    """
+    Riconcilia con la sync map gli eventi cambiati su Google (vedi
+    GoogleCalendarSync.scarica_modifiche). Il DBF resta la fonte di verità:
+
+    - evento nostro cancellato su Google: la voce viene rimossa, così la
+      prossima sincronizzazione lo ricrea;
+    - evento nostro modificato da altri (etag diverso da quello della nostra
+      ultima scrittura): la voce viene marcata da aggiornare con tutti i campi,
+      così la prossima sincronizzazione ripristina i dati del gestionale;
+    - evento con le nostre proprietà private ma assente dalla mappa (mappa
+      persa o ricreata): la voce viene ricostruita dall'evento, così non
+      viene creato un duplicato;
+    - altri eventi non presenti nella mappa: ignorati.
+
+    sync_map deve essere un ArchivioSync (ricerca per event_id).
+
+    Returns:
+        dict: conteggi 'cancellati', 'modificati', 'adottati', 'ignorati'
+    """
+    esito = {'cancellati': 0, 'modificati': 0, 'adottati': 0, 'ignorati': 0}
+    for evento in eventi:
+        trovato = sync_map.per_event_id(evento['id'])
+        if trovato is None:
+            app_id, voce = voce_da_evento(evento, calendar_id)
+            if app_id and evento.get('status') != 'cancelled' and app_id not in sync_map:
+                sync_map[app_id] = voce
+                esito['adottati'] += 1
+            else:
+                esito['ignorati'] += 1
+            continue
+        app_id, voce = trovato
+        if voce.get('calendar_id', calendar_id) != calendar_id:
+            esito['ignorati'] += 1
+            continue
+
+        if evento.get('status') == 'cancelled':
+            sync_map.pop(app_id, None)
+            esito['cancellati'] += 1
+        elif not voce.get('etag'):
+            # Voce scritta prima del tracciamento degli etag: la versione attuale diventa il riferimento
+            voce['etag'] = evento.get('etag')
+            sync_map[app_id] = voce
+            esito['ignorati'] += 1
+        elif evento.get('etag') != voce['etag']:
+            voce.update({'hash': '', 'campi': {}, 'etag': evento.get('etag')})
+            sync_map[app_id] = voce
+            esito['modificati'] += 1
+        else:
+            esito['ignorati'] += 1
+    return esito
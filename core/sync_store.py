@@ -0,0 +1,172 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS eventi (
+    app_id TEXT PRIMARY KEY,
+    event_id TEXT NOT NULL,
+    calendar_id TEXT,
+    hash TEXT,
+    dati TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_eventi_event_id ON eventi(event_id);
+CREATE INDEX IF NOT EXISTS idx_eventi_calendar_id ON eventi(calendar_id);
+CREATE TABLE IF NOT EXISTS stato (
+    chiave TEXT PRIMARY KEY,
+    valore TEXT NOT NULL
+);
+"""
+
+
+class ArchivioSync(MutableMapping):
+    """
+    Mappa di sincronizzazione app_id → voce su SQLite, usata al posto di synced_events.json.
+
+    Si usa come un dict: ogni assegnazione o cancellazione è una transazione
+    confermata subito (journal WAL), quindi un'interruzione a metà sync non
+    perde gli eventi già creati. L'accesso è serializzato da un lock, così i
+    thread della sincronizzazione parallela possono scrivere sulla stessa istanza.
+    """
+
+    def __init__(self, percorso_db, percorso_json=None):
+        self.percorso_db = percorso_db
+        os.makedirs(os.path.dirname(percorso_db) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        if percorso_json:
+            self._migra_json(percorso_json)
+
+    def _migra_json(self, percorso_json):
+        """Importa una sola volta il vecchio synced_events.json, poi lo rinomina."""
+        if not os.path.exists(percorso_json) or len(self) > 0:
+            return
+        # Un JSON illeggibile non deve diventare una mappa vuota (= inserimento duplicato di tutto)
+        with open(percorso_json, 'r', encoding='utf-8') as f:
+            vecchia = json.load(f)
+        self.aggiorna_molti(vecchia)
+        os.replace(percorso_json, percorso_json + '.migrato')
+        logging.info(f"Sync map migrata da {percorso_json}: {len(vecchia)} voci")
+
+    @staticmethod
+    def _riga(app_id, voce):
+        return (app_id, voce['event_id'], voce.get('calendar_id'), voce.get('hash'), json.dumps(voce, ensure_ascii=False))
+
+    def __getitem__(self, app_id):
+        with self._lock:
+            riga = self._conn.execute("SELECT dati FROM eventi WHERE app_id = ?", (app_id,)).fetchone()
+        if riga is None:
+            raise KeyError(app_id)
+        return json.loads(riga[0])
+
+    def __setitem__(self, app_id, voce):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO eventi VALUES (?, ?, ?, ?, ?)", self._riga(app_id, voce))
+
+    def __delitem__(self, app_id):
+        with self._lock:
+            if self._conn.execute("DELETE FROM eventi WHERE app_id = ?", (app_id,)).rowcount == 0:
+                raise KeyError(app_id)
+
+    def __contains__(self, app_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM eventi WHERE app_id = ?", (app_id,)).fetchone() is not None
+
+    def __iter__(self):
+        with self._lock:
+            chiavi = [r[0] for r in self._conn.execute("SELECT app_id FROM eventi")]
+        return iter(chiavi)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM eventi").fetchone()[0]
+
+    def items(self):
+        with self._lock:
+            righe = self._conn.execute("SELECT app_id, dati FROM eventi").fetchall()
+        return [(app_id, json.loads(dati)) for app_id, dati in righe]
+
+    def per_event_id(self, event_id):
+        """
+        Returns:
+            tuple | None: (app_id, voce) dell'evento Google indicato
+        """
+        with self._lock:
+            riga = self._conn.execute("SELECT app_id, dati FROM eventi WHERE event_id = ?", (event_id,)).fetchone()
+        return (riga[0], json.loads(riga[1])) if riga else None
+
+    def hash_ed_eventi(self):
+        """
+        Returns:
+            dict: app_id → (hash, event_id) di tutte le voci, senza decodificare i dati JSON
+        """
+        with self._lock:
+            righe = self._conn.execute("SELECT app_id, hash, event_id FROM eventi").fetchall()
+        return {app_id: (app_hash, event_id) for app_id, app_hash, event_id in righe}
+
+    def per_calendario(self, calendar_id):
+        with self._lock:
+            righe = self._conn.execute("SELECT app_id, dati FROM eventi WHERE calendar_id = ?", (calendar_id,)).fetchall()
+        return [(app_id, json.loads(dati)) for app_id, dati in righe]
+
+    def aggiorna_molti(self, voci):
+        """Scrive più voci in un'unica transazione."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT OR REPLACE INTO eventi VALUES (?, ?, ?, ?, ?)",
+                                       [self._riga(app_id, voce) for app_id, voce in dict(voci).items()])
+
+    def rinomina(self, rinomine):
+        """
+        Sposta più voci sotto nuove chiavi in un'unica transazione: senza
+        passaggi intermedi confermati, un'interruzione non può perdere eventi.
+
+        Args:
+            rinomine (iterable[tuple]): terne (vecchia chiave, nuova chiave, voce)
+        """
+        rinomine = list(rinomine)
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("DELETE FROM eventi WHERE app_id = ?", [(vecchia,) for vecchia, _, _ in rinomine])
+                self._conn.executemany("INSERT OR REPLACE INTO eventi VALUES (?, ?, ?, ?, ?)",
+                                       [self._riga(nuova, voce) for _, nuova, voce in rinomine])
+
+    def leggi_stato(self, chiave, default=None):
+        """Valore (JSON) salvato con scrivi_stato, es. checkpoint del backfill."""
+        with self._lock:
+            riga = self._conn.execute("SELECT valore FROM stato WHERE chiave = ?", (chiave,)).fetchone()
+        return json.loads(riga[0]) if riga else default
+
+    def scrivi_stato(self, chiave, valore):
+        """Salva un valore serializzabile in JSON; None cancella la chiave."""
+        with self._lock:
+            if valore is None:
+                self._conn.execute("DELETE FROM stato WHERE chiave = ?", (chiave,))
+            else:
+                self._conn.execute("INSERT OR REPLACE INTO stato VALUES (?, ?)", (chiave, json.dumps(valore)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_archivi = {}
+_lock_archivi = threading.Lock()
+
+
+def archivio_sync(percorso_db, percorso_json=None):
+    """Restituisce l'archivio condiviso per il database indicato (una connessione per processo)."""
+    chiave = os.path.abspath(percorso_db)
+    with _lock_archivi:
+        archivio = _archivi.get(chiave)
+        if archivio is None:
+            archivio = _archivi[chiave] = ArchivioSync(percorso_db, percorso_json)
+        return archivio
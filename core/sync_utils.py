@@ -1,8 +1,14 @@
+import re
 import hashlib
-import json
 from datetime import datetime, date, time
 import logging
 
+import numpy as np
+import pandas as pd
+
+from config.constants import PATH_SYNC_DB
+from core.sync_store import ArchivioSync, archivio_sync
+
 SYNC_MAP_FILE = 'synced_events.json'
 
 # Colonne standard (adatta se necessario)
@@ -13,6 +19,14 @@ COL_STUDIO = 'STUDIO'
 COL_PAZIENTE = 'PAZIENTE'
 COL_DESCRIZIONE = 'DESCRIZIONE'
 COL_NOTE = 'NOTE'
+COL_RECNO = 'RECNO'
+COL_DATA_INSERIMENTO = 'DATA_INSERIMENTO'
+COL_ID_PAZIENTE = 'ID_PAZIENTE'
+
+# Chiavi nel formato di compute_app_id; le altre (senza '#') sono vecchie chiavi composte
+_CHIAVE_STABILE = re.compile(r'^R\d+-[0-9a-f]{8}$')
+# Chiave di stato dell'ArchivioSync che registra la migrazione delle chiavi composte
+CHIAVE_MIGRAZIONE = 'migrazione_chiavi_legacy'
 
 
 def _float_to_time(val):
@@ -46,17 +60,95 @@ def compute_appointment_hash(app):
     return hashlib.md5(relevant.encode('utf-8')).hexdigest()
 
 
-def load_sync_map(sync_map_file=SYNC_MAP_FILE):
-    try:
-        with open(sync_map_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
+def compute_legacy_app_id(app):
+    """Vecchia chiave composta (DATA_ORA_STUDIO_PAZIENTE), usata solo per migrare le voci esistenti."""
+    return f"{app[COL_DATA]}_{app[COL_ORA_INIZIO]}_{app[COL_STUDIO]}_{app.get(COL_PAZIENTE,'') or app.get(COL_DESCRIZIONE,'')}"
+
+
+def compute_app_id(app):
+    """
+    Chiave stabile dell'appuntamento nella sync map: numero di record del DBF più
+    un'impronta dei campi che non cambiano spostando l'appuntamento (data di
+    inserimento e codice paziente). Se WinDent riusa il record per un altro
+    appuntamento l'impronta cambia, e la chiave con essa.
+
+    Senza RECNO (appuntamenti non letti dal DBF) si usa la chiave composta.
+    """
+    recno = app.get(COL_RECNO)
+    if recno is None:
+        return compute_legacy_app_id(app)
+    impronta = hashlib.md5(f"{app.get(COL_DATA_INSERIMENTO) or ''}|{app.get(COL_ID_PAZIENTE) or ''}".encode('utf-8')).hexdigest()[:8]
+    return f"R{int(recno)}-{impronta}"
+
+
+def migra_chiavi_legacy(sync_map, db_handler):
+    """
+    Sposta sotto la chiave stabile (compute_app_id) le voci registrate con la vecchia
+    chiave composta, così gli eventi esistenti vengono aggiornati invece di essere ricreati.
+
+    È un passo unico, da eseguire prima di pianificare una sincronizzazione reale:
+    filter_appointments_for_sync e riconcilia non modificano la mappa. Con un
+    ArchivioSync le voci sono spostate in un'unica transazione e la migrazione
+    viene registrata, così le esecuzioni successive non rileggono il DBF.
+
+    Returns:
+        int: voci migrate
+    """
+    archivio = isinstance(sync_map, ArchivioSync)
+    if archivio and sync_map.leggi_stato(CHIAVE_MIGRAZIONE):
+        return 0
+    legacy = {app_id for app_id in sync_map if '#' not in app_id and not _CHIAVE_STABILE.match(app_id)}
+    rinomine = []
+    if legacy:
+        try:
+            df = db_handler.get_appointments_frame()
+        except Exception as e:
+            # Migrazione rimandata alla prossima esecuzione: le voci vecchie restano intatte
+            logging.error(f"Sync map: migrazione delle chiavi non eseguita, lettura appuntamenti fallita: {e}")
+            return 0
+        if not len(df):
+            logging.warning("Sync map: nessun appuntamento letto, migrazione delle chiavi rimandata")
+            return 0
+        vecchie = compute_app_ids(df.drop(columns=[COL_RECNO]))
+        nuove = compute_app_ids(df)
+        for i in np.flatnonzero(vecchie.isin(legacy).to_numpy()):
+            legacy_id, app_id = vecchie.iat[i], nuove.iat[i]
+            if legacy_id not in legacy or app_id in sync_map:
+                continue
+            legacy.discard(legacy_id)
+            voce = sync_map[legacy_id]
+            voce.setdefault('data', str(df[COL_DATA].iat[i])[:10])
+            voce.setdefault('studio', int(df[COL_STUDIO].iat[i] or 0))
+            rinomine.append((legacy_id, app_id, voce))
+
+    if archivio:
+        sync_map.rinomina(rinomine)
+        sync_map.scrivi_stato(CHIAVE_MIGRAZIONE, True)
+    else:
+        for legacy_id, app_id, voce in rinomine:
+            sync_map[app_id] = voce
+            del sync_map[legacy_id]
+    if rinomine:
+        logging.info(f"Sync map: {len(rinomine)} voci migrate alla chiave stabile")
+    return len(rinomine)
+
+
+def load_sync_map(sync_map_file=SYNC_MAP_FILE, sync_db=None):
+    """
+    Restituisce la mappa di sincronizzazione persistente (vedi core.sync_store.ArchivioSync).
+    Al primo avvio importa il vecchio synced_events.json, se presente.
+    """
+    return archivio_sync(sync_db or PATH_SYNC_DB, percorso_json=sync_map_file)
 
 
-def save_sync_map(sync_map, sync_map_file=SYNC_MAP_FILE):
-    with open(sync_map_file, 'w', encoding='utf-8') as f:
-        json.dump(sync_map, f, ensure_ascii=False, indent=2)
+def save_sync_map(sync_map, sync_map_file=SYNC_MAP_FILE, sync_db=None):
+    """
+    Le voci dell'archivio sono già confermate una per una: resta da salvare solo
+    una mappa passata come dict semplice.
+    """
+    if isinstance(sync_map, ArchivioSync):
+        return
+    archivio_sync(sync_db or PATH_SYNC_DB, percorso_json=sync_map_file).aggiorna_molti(sync_map)
 
 
 def map_appointment(app):
@@ -154,17 +246,92 @@ def map_appointment(app):
     return mapped
 
 
-def filter_appointments_for_sync(appointments, sync_map):
+def compute_appointment_hashes(df):
+    """
+    Versione vettoriale di compute_appointment_hash: stessa stringa e stesso MD5
+    per ogni riga, costruiti per colonne.
+    """
+    def text(column):
+        # Come nella versione per dict: colonna assente → '', valore mancante → 'None',
+        # DATA datetime in ISO e orari time come HH:MM (vedi _normalize_for_hash)
+        if column not in df.columns:
+            return [''] * len(df)
+        values = df[column].astype(object)
+        values = values.where(values.notna(), None).tolist()
+        if column == COL_DATA:
+            return [v.isoformat() if isinstance(v, datetime) else str(v) for v in values]
+        if column in (COL_ORA_INIZIO, COL_ORA_FINE) and df[column].dtype == object:
+            return [v.strftime('%H:%M') if isinstance(v, time) else str(v) for v in values]
+        return list(map(str, values))
+
+    columns = [text(c) for c in (COL_DATA, COL_ORA_INIZIO, COL_ORA_FINE, COL_STUDIO, COL_PAZIENTE, COL_DESCRIZIONE, COL_NOTE)]
+    md5 = hashlib.md5
+    return pd.Series([md5('_'.join(r).encode('utf-8')).hexdigest() for r in zip(*columns)], index=df.index, dtype=object)
+
+
+def compute_app_ids(df):
+    """Versione vettoriale di compute_app_id per un DataFrame con colonna RECNO."""
+    if COL_RECNO not in df.columns:
+        return pd.Series([compute_legacy_app_id(app) for app in df.to_dict('records')], index=df.index, dtype=object)
+    if df[COL_RECNO].isna().any():
+        # Appuntamenti senza RECNO mescolati agli altri: chiave calcolata riga per riga
+        righe = df.astype(object).where(df.notna(), None).to_dict('records')
+        return pd.Series([compute_app_id(app) for app in righe], index=df.index, dtype=object)
+
+    def text(column):
+        if column not in df.columns:
+            return [''] * len(df)
+        values = df[column].astype(object)
+        return list(map(str, values.where(values.notna() & (values != ''), '')))
+
+    md5 = hashlib.md5
+    return pd.Series([
+        f"R{recno}-{md5(f'{inserimento}|{paziente}'.encode('utf-8')).hexdigest()[:8]}"
+        for recno, inserimento, paziente in zip(df[COL_RECNO].astype('int64').tolist(), text(COL_DATA_INSERIMENTO), text(COL_ID_PAZIENTE))
+    ], index=df.index, dtype=object)
+
+
+def _hash_ed_eventi(sync_map):
+    """app_id → (hash, event_id) di tutte le voci, letti in un solo passaggio."""
+    if isinstance(sync_map, ArchivioSync):
+        return sync_map.hash_ed_eventi()
+    return {app_id: (voce.get('hash'), voce['event_id']) for app_id, voce in sync_map.items()}
+
+
+def filter_appointments_for_sync(appointments, sync_map, recnos_modificati=None):
+    """
+    Divide gli appuntamenti in da creare, da aggiornare e già sincronizzati.
+    La sync map viene solo letta (vedi migra_chiavi_legacy per le chiavi vecchie).
+
+    Accetta una lista di dict o un DataFrame (vedi DBHandler.get_appointments_frame):
+    chiavi e hash sono calcolati per colonne in un solo passaggio.
+
+    Se recnos_modificati è indicato (vedi core.dbf_changes), gli appuntamenti già
+    presenti nella mappa il cui RECNO non è tra i record modificati vengono
+    saltati senza confrontarne l'hash.
+    """
+    if isinstance(appointments, pd.DataFrame):
+        df, appointments = appointments, appointments.to_dict('records')
+    else:
+        appointments = list(appointments)
+        df = pd.DataFrame(appointments, dtype=object)
+    if not appointments:
+        return [], [], []
+
+    app_ids = compute_app_ids(df).tolist()
+    hashes = compute_appointment_hashes(df).tolist()
+    noti = _hash_ed_eventi(sync_map)
+
     to_create, to_update, to_skip = [], [], []
-    for app in appointments:
-        app_id = f"{app[COL_DATA]}_{app[COL_ORA_INIZIO]}_{app[COL_STUDIO]}_{app.get(COL_PAZIENTE,'') or app.get(COL_DESCRIZIONE,'')}"
-        app_hash = compute_appointment_hash(app)
-        logging.debug(f"DEBUG SYNC: app_id={app_id} | app_hash={app_hash}")
-        if app_id in sync_map:
-            if sync_map[app_id]['hash'] != app_hash:
-                to_update.append((app, sync_map[app_id]['event_id']))
-            else:
-                to_skip.append(app)
-        else:
+    for app, app_id, app_hash in zip(appointments, app_ids, hashes):
+        voce = noti.get(app_id)
+        if voce is None:
             to_create.append(app)
+        # Un hash vuoto marca un evento modificato su Google (vedi applica_modifiche_google): va sempre rielaborato
+        elif recnos_modificati is not None and app.get(COL_RECNO) not in recnos_modificati and voce[0]:
+            to_skip.append(app)
+        elif voce[0] != app_hash:
+            to_update.append((app, voce[1]))
+        else:
+            to_skip.append(app)
     return to_create, to_update, to_skip
@@ -1,8 +1,35 @@
 import logging
+import threading
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
 
 from config import TWILIO
+from config.constants import TWILIO_POOL_CONNESSIONI, TWILIO_TIMEOUT_SECONDI
+
+_client = {}
+_lock_client = threading.Lock()
+
+
+def client_twilio(account_sid, auth_token):
+    """
+    Client Twilio condiviso nel processo per l'account indicato.
+
+    Usa una sola sessione HTTP con connessioni keep-alive (pool di
+    TWILIO_POOL_CONNESSIONI connessioni, una per invio contemporaneo), così
+    promemoria e richiami dello stesso processo riusano le connessioni TLS
+    già aperte invece di rifare l'handshake per ogni messaggio.
+    """
+    with _lock_client:
+        client = _client.get(account_sid)
+        if client is None:
+            http_client = TwilioHttpClient(pool_connections=True, timeout=TWILIO_TIMEOUT_SECONDI)
+            adattatore = HTTPAdapter(pool_connections=1, pool_maxsize=TWILIO_POOL_CONNESSIONI)
+            http_client.session.mount('https://', adattatore)
+            client = _client[account_sid] = Client(account_sid, auth_token, http_client=http_client)
+        return client
+
 
 class TwilioWhatsAppClient:
     """
@@ -25,7 +52,7 @@ class TwilioWhatsAppClient:
 
             if sid and token:
                 try:
-                    self.client = Client(sid, token)
+                    self.client = client_twilio(sid, token)
                     logging.info("Client Twilio inizializzato correttamente.")
                 except Exception as e:
                     logging.error(f"Errore inizializzazione Twilio Client: {e}")
@@ -44,20 +71,34 @@ class TwilioWhatsAppClient:
         Returns:
             bool: True se l'invio (o simulazione) è avvenuto con successo, False altrimenti.
         """
+        return self.invia(numero, messaggio, id_riferimento)['ok']
+
+    def invia(self, numero, messaggio, id_riferimento="N/A"):
+        """
+        Come invia_messaggio, ma restituisce l'esito completo dell'invio.
+
+        Returns:
+            dict: 'ok', 'sid' (None se non inviato), 'errore' (testo o None),
+                'stato_http' (status della risposta Twilio in errore, altrimenti None)
+        """
+        esito = {'ok': False, 'sid': None, 'errore': None, 'stato_http': None}
         if not numero:
             logging.error(f"[Twilio] Numero non valido (riferimento {id_riferimento})")
-            return False
+            esito['errore'] = "Numero non valido"
+            return esito
 
         numero_destinazione = self.test_numero if self.test_numero else numero
         log_dest = f"{numero_destinazione} (riferimento: {id_riferimento})"
 
         if self.simula_invio:
             logging.info(f"[SIMULATO] Messaggio per {log_dest}: {messaggio}")
-            return True
+            esito['ok'] = True
+            return esito
 
         if not self.client:
             logging.warning(f"[Twilio] Client non disponibile. Messaggio non inviato a {log_dest}")
-            return False
+            esito['errore'] = "Client Twilio non disponibile"
+            return esito
 
         try:
             message = self.client.messages.create(
@@ -66,12 +107,14 @@ class TwilioWhatsAppClient:
                 body=messaggio
             )
             logging.info(f"[Twilio] Messaggio inviato a {log_dest}. SID: {message.sid}")
-            return True
+            esito.update({'ok': True, 'sid': message.sid})
         except TwilioRestException as e:
             logging.error(f"[Twilio] Errore Twilio: {e} | codice: {e.code}, msg: {e.msg}")
+            esito.update({'errore': f"{e.code}: {e.msg}", 'stato_http': e.status})
         except Exception as e:
             logging.error(f"[Twilio] Errore generico durante invio a {log_dest}: {e}")
-        return False
+            esito['errore'] = str(e)
+        return esito
 
     def test_config(self):
         """
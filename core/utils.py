@@ -72,7 +72,7 @@ def costruisci_messaggio_richiamo(richiamo):
     try:
         nome = richiamo.get('NOME', 'Gentile paziente')
         tipo = richiamo.get(col['tipo'], 'controllo')
-        data = richiamo.get(col['data1'])
+        data = richiamo.get('DATA_RICHIAMO') or richiamo.get(col['data1'])
 
         data_str = data.strftime('%d/%m/%Y') if isinstance(data, (datetime, date)) else 'una prossima data'
 
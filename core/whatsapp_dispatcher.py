@@ -0,0 +1,113 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config.constants import TWILIO, WHATSAPP_INVII_IN_VOLO, WHATSAPP_MESSAGGI_AL_SECONDO, WHATSAPP_TENTATIVI_MAX
+from core.rate_limiter import LimitatoreAdattivo
+
+_limitatori = {}
+_lock_limitatori = threading.Lock()
+
+
+def limitatore_mittente(numero_mittente, messaggi_al_secondo=None):
+    """Limitatore condiviso da tutti gli invii del processo dallo stesso numero mittente."""
+    with _lock_limitatori:
+        limitatore = _limitatori.get(numero_mittente)
+        if limitatore is None:
+            velocita = messaggi_al_secondo or WHATSAPP_MESSAGGI_AL_SECONDO
+            limitatore = _limitatori[numero_mittente] = LimitatoreAdattivo(velocita, massimo=velocita, nome=f"Twilio {numero_mittente}")
+        return limitatore
+
+
+class DispatcherWhatsApp:
+    """
+    Coda di invio WhatsApp con più messaggi in volo contemporaneamente.
+
+    I messaggi accodati vengono inviati da un pool di thread; il numero di
+    thread limita le richieste Twilio in corso, il limitatore del numero
+    mittente i messaggi al secondo. Una risposta 429 di Twilio riduce la
+    velocità di tutti gli invii e il messaggio viene ritentato dopo il backoff.
+    esito_callback, se indicata, riceve (dati, esito) di ogni messaggio nel
+    thread che lo ha inviato, appena l'invio si conclude.
+
+    Uso:
+        with DispatcherWhatsApp(twilio_client) as coda:
+            for ...:
+                coda.accoda(numero, messaggio, id_riferimento)
+        riepilogo = coda.riepilogo()
+    """
+
+    def __init__(self, twilio_client, invii_in_volo=None, messaggi_al_secondo=None, tentativi=None, progress_callback=None, esito_callback=None):
+        self.twilio_client = twilio_client
+        self.esito_callback = esito_callback
+        self.tentativi = tentativi or WHATSAPP_TENTATIVI_MAX
+        self.progress_callback = progress_callback
+        self.limitatore = limitatore_mittente(TWILIO['whatsapp_number'], messaggi_al_secondo)
+        self._pool = ThreadPoolExecutor(max_workers=invii_in_volo or WHATSAPP_INVII_IN_VOLO, thread_name_prefix="whatsapp")
+        self._futures = {}
+        self.risultati = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.attendi()
+        return False
+
+    def accoda(self, numero, messaggio, id_riferimento="N/A", **dati):
+        """
+        Accoda un messaggio; dati aggiuntivi (es. tipo di messaggio) vengono
+        riportati nel risultato dell'invio.
+        """
+        dati = dict(dati, numero=numero, id_riferimento=id_riferimento)
+        self._futures[self._pool.submit(self._esegui, numero, messaggio, dati)] = dati
+
+    def _esegui(self, numero, messaggio, dati):
+        try:
+            esito = self._invia(numero, messaggio, dati['id_riferimento'])
+        except Exception as e:
+            logging.error(f"[WhatsApp] Errore invio a {numero} (riferimento {dati['id_riferimento']}): {e}")
+            esito = {'ok': False, 'sid': None, 'errore': str(e), 'stato_http': None, 'tentativi': 1}
+        if self.esito_callback:
+            self.esito_callback(dati, esito)
+        return esito
+
+    def _invia(self, numero, messaggio, id_riferimento):
+        for tentativo in range(self.tentativi):
+            self.limitatore.acquisisci()
+            esito = self.twilio_client.invia(numero, messaggio, id_riferimento)
+            if esito['stato_http'] != 429 or tentativo == self.tentativi - 1:
+                if esito['ok']:
+                    self.limitatore.segnala_successo()
+                esito['tentativi'] = tentativo + 1
+                return esito
+            self.limitatore.segnala_limite(tentativo)
+
+    def attendi(self):
+        """
+        Attende la fine di tutti gli invii accodati.
+
+        Returns:
+            list[dict]: un risultato per messaggio, con i dati di accoda più
+                'ok', 'sid', 'errore', 'stato_http' e 'tentativi'
+        """
+        totale = len(self._futures)
+        for completati, future in enumerate(as_completed(self._futures), start=1):
+            risultato = self._futures[future]
+            try:
+                risultato.update(future.result())
+            except Exception as e:
+                # Solo un errore di esito_callback arriva fin qui: il messaggio è partito ma l'esito non è stato registrato
+                logging.error(f"[WhatsApp] Errore registrazione esito per {risultato['numero']} (riferimento {risultato['id_riferimento']}): {e}")
+                risultato.update({'ok': False, 'sid': None, 'errore': str(e), 'stato_http': None, 'tentativi': 1})
+            self.risultati.append(risultato)
+            if self.progress_callback:
+                self.progress_callback(completati, totale)
+        self._futures = {}
+        self._pool.shutdown(wait=True)
+        return self.risultati
+
+    def riepilogo(self):
+        """Conteggi 'inviati', 'falliti' e 'totali' dei messaggi elaborati."""
+        inviati = sum(1 for r in self.risultati if r['ok'])
+        return {'inviati': inviati, 'falliti': len(self.risultati) - inviati, 'totali': len(self.risultati)}
@@ -0,0 +1,246 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from config.constants import PATH_OUTBOX_DB, OUTBOX_TENTATIVI_MAX, OUTBOX_BACKOFF_SECONDI
+from core.whatsapp_dispatcher import DispatcherWhatsApp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messaggi (
+    id_paziente TEXT NOT NULL,
+    data_riferimento TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    testo TEXT NOT NULL,
+    riferimento TEXT,
+    stato TEXT NOT NULL,
+    sid TEXT,
+    tentativi INTEGER NOT NULL DEFAULT 0,
+    ultimo_errore TEXT,
+    prossimo_tentativo TEXT,
+    creato TEXT NOT NULL,
+    aggiornato TEXT NOT NULL,
+    PRIMARY KEY (id_paziente, data_riferimento, tipo)
+);
+CREATE INDEX IF NOT EXISTS idx_messaggi_stato ON messaggi(stato, prossimo_tentativo);
+"""
+
+# Stati di un messaggio: in coda, inviato (accettato da Twilio, con SID),
+# errore (da ritentare dopo prossimo_tentativo), fallito (definitivo)
+IN_CODA = 'in_coda'
+INVIATO = 'inviato'
+ERRORE = 'errore'
+FALLITO = 'fallito'
+
+
+def _adesso():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def errore_definitivo(esito):
+    """Errori che un nuovo tentativo non risolve: numero mancante o richiesta rifiutata da Twilio (4xx tranne 429)."""
+    stato = esito.get('stato_http')
+    if stato is not None:
+        return 400 <= stato < 500 and stato != 429
+    return esito.get('errore') == "Numero non valido"
+
+
+class OutboxWhatsApp:
+    """
+    Coda persistente dei messaggi WhatsApp su SQLite.
+
+    Ogni messaggio è identificato da (paziente, data di riferimento, tipo):
+    accodare di nuovo lo stesso messaggio non crea duplicati e un messaggio già
+    inviato non viene reinviato, così una rielaborazione dopo un'interruzione
+    contatta solo chi non ha ancora ricevuto il messaggio. L'esito di ogni invio
+    (SID Twilio o errore) viene salvato appena arriva.
+    """
+
+    def __init__(self, percorso_db):
+        self.percorso_db = percorso_db
+        if percorso_db != ':memory:':
+            os.makedirs(os.path.dirname(percorso_db) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def chiave(id_paziente, data_riferimento, tipo):
+        data = data_riferimento.isoformat() if hasattr(data_riferimento, 'isoformat') else str(data_riferimento)
+        return (str(id_paziente), data[:10], tipo)
+
+    def accoda(self, id_paziente, data_riferimento, tipo, numero, testo, riferimento=None):
+        """
+        Registra un messaggio da inviare. Se esiste già, numero e testo vengono
+        aggiornati solo finché il messaggio non è stato inviato; un messaggio
+        fallito torna in coda solo se il numero è cambiato.
+
+        Returns:
+            tuple | None: la chiave del messaggio, None se è già stato inviato
+        """
+        chiave = self.chiave(id_paziente, data_riferimento, tipo)
+        adesso = _adesso()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messaggi (id_paziente, data_riferimento, tipo, numero, testo, riferimento, stato, creato, aggiornato) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id_paziente, data_riferimento, tipo) DO UPDATE SET "
+                "stato = CASE WHEN stato = ? AND numero != excluded.numero THEN excluded.stato ELSE stato END, "
+                "tentativi = CASE WHEN stato = ? AND numero != excluded.numero THEN 0 ELSE tentativi END, "
+                "numero = excluded.numero, testo = excluded.testo, riferimento = excluded.riferimento, aggiornato = excluded.aggiornato "
+                "WHERE stato != ?",
+                (*chiave, numero, testo, riferimento, IN_CODA, adesso, adesso, FALLITO, FALLITO, INVIATO)
+            )
+            stato = self._conn.execute(
+                "SELECT stato FROM messaggi WHERE id_paziente = ? AND data_riferimento = ? AND tipo = ?", chiave
+            ).fetchone()[0]
+        return None if stato == INVIATO else chiave
+
+    def registra_esito(self, chiave, esito, tentativi_max=None):
+        """Salva l'esito di un invio (vedi TwilioWhatsAppClient.invia) e calcola l'eventuale nuovo tentativo."""
+        tentativi_max = tentativi_max or OUTBOX_TENTATIVI_MAX
+        with self._lock:
+            tentativi = self._conn.execute(
+                "SELECT tentativi FROM messaggi WHERE id_paziente = ? AND data_riferimento = ? AND tipo = ?", chiave
+            ).fetchone()[0] + 1
+            if esito['ok']:
+                stato, prossimo = INVIATO, None
+            elif errore_definitivo(esito) or tentativi >= tentativi_max:
+                stato, prossimo = FALLITO, None
+            else:
+                attesa = OUTBOX_BACKOFF_SECONDI * 2 ** (tentativi - 1)
+                stato, prossimo = ERRORE, (datetime.now() + timedelta(seconds=attesa)).isoformat(timespec='seconds')
+            self._conn.execute(
+                "UPDATE messaggi SET stato = ?, sid = ?, tentativi = ?, ultimo_errore = ?, prossimo_tentativo = ?, aggiornato = ? "
+                "WHERE id_paziente = ? AND data_riferimento = ? AND tipo = ?",
+                (stato, esito.get('sid'), tentativi, esito.get('errore'), prossimo, _adesso(), *chiave)
+            )
+        return stato
+
+    def da_inviare(self, chiavi=None):
+        """
+        Messaggi in coda o in errore con il nuovo tentativo già scaduto.
+
+        Args:
+            chiavi (iterable, opzionale): limita ai messaggi indicati
+
+        Returns:
+            list[dict]: righe della tabella messaggi
+        """
+        with self._lock:
+            cursore = self._conn.execute(
+                "SELECT * FROM messaggi WHERE stato = ? OR (stato = ? AND prossimo_tentativo <= ?)",
+                (IN_CODA, ERRORE, _adesso())
+            )
+            colonne = [c[0] for c in cursore.description]
+            righe = [dict(zip(colonne, r)) for r in cursore.fetchall()]
+        if chiavi is not None:
+            chiavi = set(chiavi)
+            righe = [r for r in righe if (r['id_paziente'], r['data_riferimento'], r['tipo']) in chiavi]
+        return righe
+
+    def prossimo_tentativo(self, chiavi=None):
+        """
+        Returns:
+            datetime | None: primo nuovo tentativo programmato tra i messaggi in errore
+        """
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT id_paziente, data_riferimento, tipo, prossimo_tentativo FROM messaggi WHERE stato = ?", (ERRORE,)
+            ).fetchall()
+        if chiavi is not None:
+            chiavi = set(chiavi)
+            righe = [r for r in righe if tuple(r[:3]) in chiavi]
+        return min((datetime.fromisoformat(r[3]) for r in righe), default=None)
+
+    def inviati(self, tipo):
+        """
+        Returns:
+            set[tuple]: (id_paziente, data_riferimento) dei messaggi del tipo indicato già inviati
+        """
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT id_paziente, data_riferimento FROM messaggi WHERE tipo = ? AND stato = ?", (tipo, INVIATO)
+            ).fetchall()
+        return set(righe)
+
+    def invia(self, twilio_client, chiavi=None, attendi_tentativi=True, progress_callback=None):
+        """
+        Invia i messaggi da inviare tramite DispatcherWhatsApp, registrando
+        ogni esito appena arriva. Con attendi_tentativi i messaggi in errore
+        vengono ritentati nella stessa esecuzione, dopo il backoff
+        (OUTBOX_BACKOFF_SECONDI raddoppiato a ogni tentativo), fino a
+        OUTBOX_TENTATIVI_MAX tentativi; altrimenti restano per la prossima esecuzione.
+
+        Returns:
+            dict: stato finale dei messaggi indicati, o di tutta l'outbox se chiavi è None
+                ('inviati', 'falliti' definitivi, 'in_errore' da ritentare), e numero di 'invii' effettuati
+        """
+        esito = {'invii': 0}
+        while True:
+            messaggi = self.da_inviare(chiavi)
+            if messaggi:
+                coda = DispatcherWhatsApp(twilio_client, progress_callback=progress_callback,
+                                          esito_callback=lambda dati, risultato: self.registra_esito(dati['chiave'], risultato))
+                with coda:
+                    for m in messaggi:
+                        coda.accoda(m['numero'], m['testo'], m['riferimento'] or m['id_paziente'],
+                                    chiave=(m['id_paziente'], m['data_riferimento'], m['tipo']))
+                esito['invii'] += len(messaggi)
+
+            prossimo = self.prossimo_tentativo(chiavi)
+            if prossimo is None or not attendi_tentativi:
+                break
+            attesa = (prossimo - datetime.now()).total_seconds()
+            if attesa > 0:
+                logging.info(f"[Outbox] Messaggi in errore: nuovo tentativo tra {attesa:.0f}s")
+                time.sleep(attesa)
+
+        esito.update({'inviati': self._conta(INVIATO, chiavi), 'falliti': self._conta(FALLITO, chiavi),
+                      'in_errore': self._conta(ERRORE, chiavi)})
+        logging.info(f"[Outbox] Invio completato: {esito}")
+        return esito
+
+    def _conta(self, stato, chiavi=None):
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT id_paziente, data_riferimento, tipo FROM messaggi WHERE stato = ?", (stato,)
+            ).fetchall()
+        if chiavi is not None:
+            chiavi = set(chiavi)
+            righe = [r for r in righe if r in chiavi]
+        return len(righe)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_outbox = {}
+_lock_outbox = threading.Lock()
+
+
+def outbox_whatsapp(percorso_db=PATH_OUTBOX_DB):
+    """Restituisce l'outbox condivisa per il database indicato (una connessione per processo)."""
+    chiave = percorso_db if percorso_db == ':memory:' else os.path.abspath(percorso_db)
+    with _lock_outbox:
+        outbox = _outbox.get(chiave)
+        if outbox is None:
+            outbox = _outbox[chiave] = OutboxWhatsApp(percorso_db)
+        return outbox
+
+
+def outbox_per_client(twilio_client):
+    """
+    Outbox da usare con il client indicato: in simulazione o con il numero di
+    test i messaggi non arrivano ai pazienti, quindi non devono risultare inviati
+    nell'outbox reale; si usa un'outbox in memoria, condivisa nel processo.
+    """
+    if twilio_client.simula_invio or twilio_client.test_numero:
+        return outbox_whatsapp(':memory:')
+    return outbox_whatsapp()
@@ -10,7 +10,7 @@ from threading import Thread
 # Aggiungi la root del progetto al path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from core.sync_utils import load_sync_map, save_sync_map, map_appointment, filter_appointments_for_sync, compute_appointment_hash
+from core.sync_utils import load_sync_map, save_sync_map, migra_chiavi_legacy
 
 # Assicurati che le variabili d'ambiente siano caricate per config.py
 from dotenv import load_dotenv
@@ -20,6 +20,9 @@ load_dotenv()
 from scripts.appointment_manager import AppointmentManager
 from config.constants import TIPO_RICHIAMI, PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, Environment, CURRENT_ENV
 from core.calendar_sync import GoogleCalendarSync
+from core.sync_executor import EsecutoreSync
+from core.sync_reconciler import riconcilia
+from core.db_handler import limiti_mese
 
 # --- Configurazione Logging per la GUI ---
 logger = logging.getLogger()
@@ -630,17 +633,19 @@ class GuiApp(tk.Tk):
             
             # Mostra dettagli richiami
             self.recall_test_result.insert(tk.END, "\n=== Dettagli Richiami ===\n")
-            for recall in results['recalls']:
-                self.recall_test_result.insert(tk.END, 
-                    f"\nPaziente: {recall['nome']}\n"
-                    f"Tipo: {recall['tipo_richiamo']}\n"
-                    f"Telefono: {recall['telefono']}\n"
-                    f"Ultima visita: {recall['ultima_visita']}\n"
-                    f"Data richiamo 1: {recall['data_richiamo1']}\n"
-                    f"Data richiamo 2: {recall['data_richiamo2']}\n"
-                    f"------------------------\n"
-                )
-                
+            # Un solo insert: con migliaia di richiami gli insert per riga rallentano il widget
+            self.recall_test_result.insert(tk.END, "".join(
+                f"\nPaziente: {recall['nome']}\n"
+                f"Tipo: {recall['tipo_richiamo']}\n"
+                f"Telefono: {recall['telefono']}\n"
+                f"Ultima visita: {recall['ultima_visita']}\n"
+                f"Data richiamo: {recall['data_richiamo']}\n"
+                f"Data richiamo 1: {recall['data_richiamo1']}\n"
+                f"Data richiamo 2: {recall['data_richiamo2']}\n"
+                f"------------------------\n"
+                for recall in results['recalls']
+            ))
+
         except Exception as e:
             logging.error(f"Errore durante il test dei richiami: {str(e)}")
             messagebox.showerror("Errore", f"Errore durante l'elaborazione: {str(e)}")
@@ -896,8 +901,10 @@ class GuiApp(tk.Tk):
         total_deleted = 0
         try:
             for studio, cal_id in self.studio_calendar_ids.items():
+                def update_progress(current, total, studio=studio):
+                    self.after(0, lambda: self.progress_var.set(f"Pulizia Studio {studio}... {current}/{total}"))
                 try:
-                    deleted = self.calendar_sync.delete_all_events(cal_id)
+                    deleted = self.calendar_sync.delete_all_events(cal_id, progress_callback=update_progress)
                     total_deleted += deleted
                     self.calendar_result.insert(tk.END, f"Eliminati {deleted} eventi dal calendario Studio {studio}\n")
                 except Exception as e:
@@ -1003,10 +1010,10 @@ class GuiApp(tk.Tk):
                 'colorId': '11'
             }
             try:
-                result = self.calendar_sync.calendar_service.events().insert(
+                result = self.calendar_sync.esegui_richiesta(self.calendar_sync.calendar_service.events().insert(
                     calendarId=calendar_id,
                     body=event
-                ).execute()
+                ))
                 messagebox.showinfo("Test Evento Singolo", f"Evento creato con successo!\nID: {result.get('id')}\nLink: {result.get('htmlLink')}")
                 logging.info(f"Evento di test creato su {calendar_id}: {result.get('id')}")
             except Exception as e:
@@ -1022,7 +1029,6 @@ class GuiApp(tk.Tk):
 
     def _threaded_send_debug_json_events(self):
         """Invia tutti gli eventi presenti in debug_appointment.json al calendario selezionato, loggando esito per ciascuno. Si ferma al primo errore non rate limit."""
-        import time
         from googleapiclient.errors import HttpError
         try:
             if not self.calendar_sync:
@@ -1034,30 +1040,17 @@ class GuiApp(tk.Tk):
                 events = json.load(f)
             for event in events:
                 summary = event.get('summary', 'N/D')
-                retry_count = 0
-                max_retries = 3
-                while retry_count < max_retries:
-                    try:
-                        result = self.calendar_sync.calendar_service.events().insert(
-                            calendarId=calendar_id,
-                            body=event
-                        ).execute()
-                        logging.info(f"Invio: {summary} - OK (ID: {result.get('id')})")
-                        break
-                    except HttpError as e:
-                        error_content = getattr(e, 'content', str(e))
-                        if e.resp.status == 403 and 'rateLimitExceeded' in str(e):
-                            retry_count += 1
-                            wait_time = min(2 ** retry_count, 10)
-                            logging.warning(f"Rate limit per {summary}, retry {retry_count} tra {wait_time}s...")
-                            time.sleep(wait_time)
-                        else:
-                            logging.error(f"Invio: {summary} - ERRORE: {e}\nDettaglio: {error_content}")
-                            self._show_error_async(f"Errore su: {summary}\n{e}\nDettaglio: {error_content}")
-                            return
-                else:
-                    logging.error(f"Invio: {summary} - ERRORE: superato numero massimo di retry per rate limit")
-                    self._show_error_async(f"Rate limit su: {summary} - superato numero massimo di retry")
+                try:
+                    # Il limitatore ritenta con backoff gli errori di quota
+                    result = self.calendar_sync.esegui_richiesta(self.calendar_sync.calendar_service.events().insert(
+                        calendarId=calendar_id,
+                        body=event
+                    ))
+                    logging.info(f"Invio: {summary} - OK (ID: {result.get('id')})")
+                except HttpError as e:
+                    error_content = getattr(e, 'content', str(e))
+                    logging.error(f"Invio: {summary} - ERRORE: {e}\nDettaglio: {error_content}")
+                    self._show_error_async(f"Errore su: {summary}\n{e}\nDettaglio: {error_content}")
                     return
             else:
                 self._show_info_async("Test completato. Controlla il log per i risultati dettagliate.")
@@ -1173,40 +1166,24 @@ class GuiApp(tk.Tk):
             # Applica filtro studio se necessario
             if studio:
                 appointments = [a for a in appointments if int(a.get('STUDIO', 0)) == studio]
-            # Carica mappatura locale
+            # Carica mappatura locale e calcola creazioni, modifiche ed eliminazioni del mese
             sync_map = load_sync_map()
-            to_create, to_update, to_skip = filter_appointments_for_sync(appointments, sync_map)
-            n_inserted, n_updated, errors = 0, 0, 0
-            # Crea nuovi eventi
-            for app in to_create:
-                try:
-                    mapped = map_appointment(app)
-                    event = self.calendar_sync.create_event(mapped, cal_id=calendar_id)
-                    # Aggiorna mappatura locale
-                    app_id = f"{app['DATA']}_{app['ORA_INIZIO']}_{app['STUDIO']}_{app.get('PAZIENTE','') or app.get('DESCRIZIONE','')}"
-                    app_hash = compute_appointment_hash(app)
-                    sync_map[app_id] = {'event_id': event['id'], 'hash': app_hash}
-                    n_inserted += 1
-                except Exception as e:
-                    errors += 1
-                    logging.warning(f"[SKIP] Appuntamento non valido: {e}")
-            # (Opzionale) Aggiorna eventi modificati (se implementato update_event)
-            # for app, eid in to_update:
-            #     try:
-            #         mapped = map_appointment(app)
-            #         self.calendar_sync.update_event(mapped, eid, cal_id=calendar_id)
-            #         app_id = f"{app['DATA']}_{app['ORA_INIZIO']}_{app['STUDIO']}_{app.get('PAZIENTE','') or app.get('DESCRIZIONE','')}
-            #         app_hash = compute_appointment_hash(app)
-            #         sync_map[app_id] = {'event_id': eid, 'hash': app_hash}
-            #         n_updated += 1
-            #     except Exception as e:
-            #         errors += 1
-            #         logging.warning(f"[SKIP] Appuntamento non aggiornato: {e}")
+            migra_chiavi_legacy(sync_map, self.manager.db_handler)
+            self.calendar_sync.scarica_modifiche(calendar_id, sync_map)
+            inizio, fine = limiti_mese(month, year)
+            piano = riconcilia(appointments, sync_map, calendar_id, inizio, fine, studi={studio} if studio else None)
+
+            def update_progress(current, total):
+                self.after(0, lambda: self.progress_var.set(f"Sincronizzazione in corso... {current}/{total}"))
+
+            # Operazioni inviate in batch paralleli (la mappatura locale viene aggiornata per ogni evento)
+            esito = EsecutoreSync(self.calendar_sync, progress_callback=update_progress).esegui({calendar_id: piano}, sync_map)
+            n_inserted, n_updated, n_deleted, errors = esito['creati'], esito['aggiornati'], esito['eliminati'], esito['errori']
             save_sync_map(sync_map)
-            if n_inserted == 0 and n_updated == 0:
-                msg = "Nessun evento da inserire o aggiornare: tutto già sincronizzato."
+            if n_inserted == 0 and n_updated == 0 and n_deleted == 0 and errors == 0:
+                msg = "Nessun evento da inserire, aggiornare o eliminare: tutto già sincronizzato."
             else:
-                msg = f"Sincronizzazione completata su {calendar_name}\nEventi inseriti: {n_inserted}\nAggiornati: {n_updated}\nErrori: {errors}"
+                msg = f"Sincronizzazione completata su {calendar_name}\nEventi inseriti: {n_inserted}\nAggiornati: {n_updated}\nEliminati: {n_deleted}\nErrori: {errors}"
             self.after(0, lambda: messagebox.showinfo("Sync completata", msg))
             self.after(0, lambda: self.calendar_result.insert(tk.END, msg + "\n"))
         except Exception as e:
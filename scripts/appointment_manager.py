@@ -1,8 +1,8 @@
-import pandas as pd
 import logging
 from datetime import date, timedelta
 
 from core.recall_manager import RecallManager
+from core.whatsapp_outbox import outbox_per_client
 from core.utils import normalizza_numero_telefono, costruisci_messaggio_promemoria
 from config.constants import COLONNE
 
@@ -20,38 +20,17 @@ class AppointmentManager:
         giorno_target = data_test if data_test else (date.today() + timedelta(days=1))
         logging.info(f"--- Inizio elaborazione promemoria per il {giorno_target.strftime('%Y-%m-%d')} ---")
 
-        appuntamenti_domani = self.db_handler.estrai_appuntamenti_domani(giorno_target)
-        if appuntamenti_domani.empty:
+        df_merged = self.db_handler.get_appuntamenti_con_pazienti(giorno_target)
+        if df_merged.empty:
             logging.info("Nessun appuntamento trovato. Fine elaborazione.")
             return
 
         col_id_paziente = COLONNE['appuntamenti']['id_paziente']
-        col_id_paz = COLONNE['pazienti']['id']
 
-        if col_id_paziente not in appuntamenti_domani.columns:
-            logging.error(f"Colonna '{col_id_paziente}' non trovata. Interruzione.")
-            return
-
-        lista_id_pazienti = appuntamenti_domani[col_id_paziente].unique().tolist()
-        df_pazienti = self.db_handler.recupera_dati_pazienti(lista_id_pazienti)
-
-        if df_pazienti.empty:
-            logging.warning("Nessun dato paziente recuperato.")
-            return
-
-        # Conversioni per merge
-        df_pazienti[col_id_paz] = df_pazienti[col_id_paz].astype(str)
-        appuntamenti_domani[col_id_paziente] = appuntamenti_domani[col_id_paziente].astype(str)
-
-        df_merged = pd.merge(
-            appuntamenti_domani,
-            df_pazienti,
-            left_on=col_id_paziente,
-            right_on=col_id_paz,
-            how='left'
-        )
-
-        messaggi_inviati = messaggi_falliti = appuntamenti_senza_numero = 0
+        appuntamenti_senza_numero = gia_inviati = 0
+        # L'outbox salta i pazienti già avvisati, ad esempio da un'esecuzione interrotta
+        outbox = outbox_per_client(self.twilio_client)
+        chiavi = []
 
         for _, appuntamento in df_merged.iterrows():
             id_app = appuntamento.get(col_id_paziente, 'N/A')
@@ -68,17 +47,24 @@ class AppointmentManager:
 
             messaggio = costruisci_messaggio_promemoria(appuntamento)
 
-            if self.twilio_client.invia_messaggio(numero, messaggio, id_app):
-                messaggi_inviati += 1
+            chiave = outbox.accoda(id_app, giorno_target, 'promemoria', numero, messaggio, riferimento=str(id_app))
+            if chiave is None:
+                logging.info(f"→ Promemoria già inviato a {nome}. Skipping.")
+                gia_inviati += 1
             else:
-                messaggi_falliti += 1
+                chiavi.append(chiave)
 
             if solo_primo:
                 logging.info("→ Solo primo attivo: interruzione.")
                 break
 
+        esito = outbox.invia(self.twilio_client, chiavi)
+
         # Riepilogo finale
-        logging.info(f"--- Fine promemoria --- Totali: {len(appuntamenti_domani)} | Inviati: {messaggi_inviati} | Falliti: {messaggi_falliti} | Senza numero: {appuntamenti_senza_numero}")
+        logging.info(f"--- Fine promemoria --- Totali: {len(df_merged)} | Inviati: {esito['inviati']} | Falliti: {esito['falliti']} | "
+                     f"Da ritentare: {esito['in_errore']} | Già inviati: {gia_inviati} | Senza numero: {appuntamenti_senza_numero}")
+        esito.update({'gia_inviati': gia_inviati, 'senza_numero': appuntamenti_senza_numero})
+        return esito
 
     def test_database_connection(self):
         """Test connessione DBF"""
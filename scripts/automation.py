@@ -44,7 +44,7 @@ def main(test_mode=False, debug_sync=False):
         except Exception as e:
             logging.error(f"Errore elaborazione promemoria: {e}", exc_info=True)
 
-        # --- 2. RICHIAMI (place holder per azione reale) ---
+        # --- 2. RICHIAMI: campagna distribuita sui giorni (vedi core.recall_campaign) ---
         try:
             if test_mode:
                 recalls = recall_manager.get_due_recalls(days_threshold=30)
@@ -53,8 +53,8 @@ def main(test_mode=False, debug_sync=False):
                         f.write(f"{recall}\n")
                 logging.info("[TEST] File test_richiami_30gg.txt generato.")
             else:
-                # TODO: implementa invio richiami automatici
-                logging.info("Funzione richiami non implementata in modalità reale.")
+                recall_manager.pianifica_campagna(days_threshold=30)
+                recall_manager.esegui_campagna()
         except Exception as e:
             logging.error(f"Errore gestione richiami: {e}", exc_info=True)
 
@@ -0,0 +1,40 @@
+import logging
+from datetime import date
+
+from config.constants import PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF
+from core.calendar_sync import GoogleCalendarSync
+from core.db_handler import DBHandler
+from core.sync_backfill import backfill
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def main(data_inizio, data_fine, giorni_per_blocco=None, ricomincia=False, simula=False):
+    db = DBHandler(PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF)
+    gcal = GoogleCalendarSync(db)
+    if not simula:
+        gcal.authenticate()
+
+    def stampa_avanzamento(giorni, totale):
+        print(f"Avanzamento: {giorni}/{totale} giorni")
+
+    esito = backfill(gcal, data_inizio, data_fine, giorni_per_blocco=giorni_per_blocco,
+                     riprendi=not ricomincia, simula=simula, progress_callback=stampa_avanzamento)
+    prefisso = "[SIMULAZIONE] " if simula else ""
+    print(f"{prefisso}Backfill {data_inizio} - {data_fine} completato in {esito['blocchi']} blocchi. "
+          f"Inseriti: {esito['creati']}, Aggiornati: {esito['aggiornati']}, "
+          f"Eliminati: {esito['eliminati']}, Errori: {esito['errori']}")
+    if esito['errori']:
+        print("Alcune operazioni non sono riuscite: rilanciare lo stesso comando per riprendere dal primo blocco con errori.")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Backfill storico Google Calendar su un intervallo di date")
+    parser.add_argument('--dal', required=True, type=date.fromisoformat, help='Data iniziale (AAAA-MM-GG)')
+    parser.add_argument('--al', required=True, type=date.fromisoformat, help='Data finale inclusa (AAAA-MM-GG)')
+    parser.add_argument('--giorni-blocco', type=int, default=None, help='Giorni per blocco/checkpoint')
+    parser.add_argument('--ricomincia', action='store_true', help="Ignora il checkpoint e riparte dall'inizio")
+    parser.add_argument('--simula', action='store_true', help='Calcola le operazioni senza chiamare Google')
+    args = parser.parse_args()
+    main(args.dal, args.al, args.giorni_blocco, args.ricomincia, args.simula)
@@ -1,9 +1,6 @@
 import argparse
 import logging
-import schedule
-import time
-from datetime import datetime
-import os
+from datetime import datetime, timedelta
 
 # Imposta il livello di logging prima di importare altri moduli che usano logging
 # Questa configurazione deve essere fatta all'inizio.
@@ -16,7 +13,56 @@ logging.basicConfig(
     ]
 )
 
+from config.constants import (
+    SCHEDULER_PROMEMORIA, SCHEDULER_SYNC_CALENDARIO, SCHEDULER_PIANIFICA_RICHIAMI,
+    SCHEDULER_INVIA_RICHIAMI, SCHEDULER_AGGIORNA_CACHE, SCHEDULER_RECUPERO_PROMEMORIA_ORE
+)
+from core.db_handler import DBHandler
+from core.twilio_client import TwilioWhatsAppClient
+from core.calendar_sync import GoogleCalendarSync
+from core.scheduler import Scheduler, Job
 from scripts.appointment_manager import AppointmentManager
+from scripts.sync_calendar_batch import sync_production
+
+
+def crea_scheduler(manager, data_test=None, solo_primo=False, sincronizza_calendario=True):
+    """
+    Dichiara i job periodici. Tutti condividono lo stesso DBHandler, client
+    Twilio e client Google, così indici e connessioni restano caldi tra le esecuzioni.
+    """
+    db_handler = manager.db_handler
+    scheduler = Scheduler()
+
+    scheduler.aggiungi(Job(
+        'promemoria',
+        lambda: manager.elabora_promemoria_giornalieri(data_test, solo_primo),
+        SCHEDULER_PROMEMORIA,
+        recupero=timedelta(hours=SCHEDULER_RECUPERO_PROMEMORIA_ORE),
+    ))
+
+    if sincronizza_calendario:
+        gcal = GoogleCalendarSync(db_handler)
+
+        def sincronizza():
+            if gcal.credentials is None:
+                gcal.authenticate()
+            sync_production(db_handler, gcal)
+
+        scheduler.aggiungi(Job('sync_calendario', sincronizza, SCHEDULER_SYNC_CALENDARIO))
+
+    scheduler.aggiungi(Job('pianifica_richiami', lambda: manager.recall_manager.pianifica_campagna(days_threshold=30),
+                           SCHEDULER_PIANIFICA_RICHIAMI))
+    scheduler.aggiungi(Job('invia_richiami', manager.recall_manager.esegui_campagna, SCHEDULER_INVIA_RICHIAMI,
+                           recupero=timedelta(0)))
+
+    def aggiorna_cache():
+        db_handler.aggiorna_snapshot()
+        db_handler.pazienti.aggiorna()
+        db_handler.richiami.aggiorna()
+
+    scheduler.aggiungi(Job('aggiorna_cache', aggiorna_cache, SCHEDULER_AGGIORNA_CACHE, recupero=timedelta(0)))
+    return scheduler
+
 
 def main():
     parser = argparse.ArgumentParser(description="Script per l'invio di promemoria appuntamenti via WhatsApp.")
@@ -36,6 +82,11 @@ def main():
                         help="Esegue l'elaborazione dei promemoria immediatamente, senza scheduling.")
     parser.add_argument('--solo-primo', action='store_true',
                         help="Invia il promemoria solo per il primo appuntamento trovato (utile per il debug).")
+    parser.add_argument('--job', type=str,
+                        help="Esegue subito il job indicato (promemoria, sync_calendario, pianifica_richiami, "
+                             "invia_richiami, aggiorna_cache) e termina.")
+    parser.add_argument('--stato-job', action='store_true',
+                        help="Mostra l'ultima esecuzione e l'esito di ogni job dello scheduler.")
     args = parser.parse_args()
 
     data_test = None
@@ -46,12 +97,13 @@ def main():
             logging.error("Formato data non valido per --test-data. Usa YYYY-MM-DD")
             return
 
-    # Inizializza il gestore degli appuntamenti, passando i parametri di test
-    manager = AppointmentManager(
+    # Componenti creati una sola volta e condivisi da tutti i job
+    twilio_client = TwilioWhatsAppClient(
         modalita_test=args.test,
         test_numero=args.test_numero,
         simula_invio=args.simula_invio
     )
+    manager = AppointmentManager(DBHandler(), twilio_client)
 
     if args.test_db:
         manager.test_database_connection()
@@ -65,16 +117,28 @@ def main():
         manager.elabora_promemoria_giornalieri(data_test, args.solo_primo)
         return
 
-    logging.info("Script avviato in modalità scheduling. I promemoria verranno inviati ogni giorno alle 18:30.")
-    schedule.every().day.at("18:30").do(
-        manager.elabora_promemoria_giornalieri,
-        data_test=data_test,
-        solo_primo=args.solo_primo
-    )
+    # In modalità test il calendario non viene sincronizzato: la sync scrive su Google
+    scheduler = crea_scheduler(manager, data_test, args.solo_primo, sincronizza_calendario=not args.test)
+
+    if args.stato_job:
+        for job in scheduler.stato.riepilogo():
+            print(f"{job['nome']}: ultima {job['ultima_prevista']} | fine {job['ultima_fine']} | esito {job['esito']}"
+                  + (f" ({job['errore']})" if job['errore'] else ""))
+        return
+
+    if args.job:
+        if args.job not in scheduler.jobs:
+            logging.error(f"Job sconosciuto: {args.job}. Disponibili: {', '.join(scheduler.jobs)}")
+            return
+        scheduler.esegui_ora(args.job)
+        return
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    logging.info(f"Script avviato in modalità scheduling. Job: {', '.join(scheduler.jobs)}")
+    try:
+        scheduler.avvia()
+    except KeyboardInterrupt:
+        logging.info("Interruzione richiesta dall'utente.")
+        scheduler.ferma()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
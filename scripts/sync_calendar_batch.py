@@ -1,22 +1,37 @@
+import os
+import glob
 import json
 import logging
 from datetime import datetime
 from core.calendar_sync import GoogleCalendarSync
-from core.db_handler import DBHandler
-from config import PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF
+from core.sync_executor import EsecutoreSync
+from core.sync_reconciler import piani_per_calendario
+from core.db_handler import DBHandler, limiti_mese
+from core.dbf_changes import TracciatoreModifiche
+from core.dbf_index import percorso_sidecar
+from config import PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF, GOOGLE
 from core.sync_utils import (
     filter_appointments_for_sync,
-    map_appointment,
-    compute_appointment_hash,
     load_sync_map,
+    migra_chiavi_legacy,
     save_sync_map
 )
 
+# Stato dell'archivio sync: ultimo mese sincronizzato da sync_production (AAAA-MM)
+CHIAVE_MESE_SYNC = 'sync_production:mese'
+
+
+def _rimuovi_stati_mensili(percorso_dbf):
+    """Elimina i sidecar dei vecchi tracciatori per mese (sync_AAAA_MM), sostituiti da quello unico."""
+    for percorso in glob.glob(percorso_sidecar(percorso_dbf, "sync_[0-9][0-9][0-9][0-9]_[0-9][0-9].chk")):
+        try:
+            os.remove(percorso)
+        except OSError as e:
+            logging.warning(f"Impossibile eliminare {percorso}: {e}")
+
 def test_sync(preview_only=True):
     db = DBHandler(PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF)
-    appointments_df = db.estrai_appuntamenti_mese(month=datetime.now().month, year=datetime.now().year)
-    print('Colonne appuntamenti:', appointments_df.columns.tolist())
-    appointments = appointments_df.to_dict(orient='records')
+    appointments = db.get_appointments(month=datetime.now().month, year=datetime.now().year)
     print('Primo appuntamento:', appointments[0] if appointments else 'Nessun appuntamento')
     sync_map = load_sync_map()
     to_create, to_update, to_skip = filter_appointments_for_sync(appointments, sync_map)
@@ -30,48 +45,76 @@ def test_sync(preview_only=True):
             print(f"OK (già sincronizzato): {app}")
     return to_create, to_update, to_skip
 
-def sync_production():
-    db = DBHandler(PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF)
-    appointments_df = db.estrai_appuntamenti_mese(month=datetime.now().month, year=datetime.now().year)
-    appointments = appointments_df.to_dict(orient='records')
+def sync_production(db=None, gcal=None):
+    """
+    Sincronizzazione incrementale del mese corrente: elabora solo i record
+    cambiati dall'ultima sync confermata. db e gcal possono essere riusati tra
+    esecuzioni (es. dallo scheduler) per tenere caldi indici e connessione.
+
+    Returns:
+        dict: esito di EsecutoreSync.esegui
+    """
+    db = db or DBHandler(PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF)
+    month, year = datetime.now().month, datetime.now().year
+    mese = f"{year}-{month:02d}"
+    # Un solo tracciatore per tutti i mesi: lo stato viene confermato solo dopo una sync riuscita
+    _rimuovi_stati_mensili(db.path_appuntamenti)
+    tracciatore = TracciatoreModifiche(db.path_appuntamenti, nome="sync")
+    modifiche = tracciatore.rileva()
+    appointments = db.get_appointments_frame(month=month, year=year)
     sync_map = load_sync_map()
-    to_create, to_update, to_skip = filter_appointments_for_sync(appointments, sync_map)
-    gcal = GoogleCalendarSync()
-    n_inserted, n_updated = 0, 0
-    for app in to_create:
-        try:
-            mapped = map_appointment(app)
-            event = gcal.create_event(mapped)
-            app_id = f"{app['DATA']}_{app['ORA_INIZIO']}_{app['STUDIO']}_{app.get('PAZIENTE','') or app.get('DESCRIZIONE','')}"
-            app_hash = compute_appointment_hash(app)
-            sync_map[app_id] = {'event_id': event['id'], 'hash': app_hash}
-            n_inserted += 1
-        except Exception as e:
-            print(f"[SKIP] Appuntamento non valido: {e}")
-    # (Opzionale) Aggiorna eventi modificati (se implementato update_event)
-    # for app, eid in to_update:
-    #     try:
-    #         mapped = map_appointment(app)
-    #         gcal.update_event(mapped, eid)
-    #         app_id = f"{app['DATA']}_{app['ORA_INIZIO']}_{app['STUDIO']}_{app.get('PAZIENTE','') or app.get('DESCRIZIONE','')}"
-    #         app_hash = compute_appointment_hash(app)
-    #         sync_map[app_id] = {'event_id': eid, 'hash': app_hash}
-    #         n_updated += 1
-    #     except Exception as e:
-    #         print(f"[SKIP] Appuntamento non aggiornato: {e}")
+    migra_chiavi_legacy(sync_map, db)
+    # Al cambio di mese il nuovo mese si riconcilia per intero (solo hash, nessuna rilettura
+    # del DBF): i suoi record cambiati quando era fuori ambito risultano già confermati
+    cambio_mese = sync_map.leggi_stato(CHIAVE_MESE_SYNC) != mese
+    recnos_modificati = None if modifiche.completo or cambio_mese else modifiche.da_elaborare
+    if modifiche.cancellati:
+        print(f"Record cancellati nel DBF dall'ultima sync: {len(modifiche.cancellati)}")
+
+    if gcal is None:
+        gcal = GoogleCalendarSync(db)
+        gcal.authenticate()
+    # Prima recepisce gli eventi cancellati o modificati a mano sul calendario
+    for calendar_id in set(GOOGLE['calendars_by_studio'].values()) | {GOOGLE['default_calendar']}:
+        gcal.scarica_modifiche(calendar_id, sync_map)
+
+    # Appuntamenti raggruppati e riconciliati per calendario di destinazione
+    lavori = piani_per_calendario(appointments, sync_map, GOOGLE['calendars_by_studio'], GOOGLE['default_calendar'],
+                                  *limiti_mese(month, year), recnos_modificati=recnos_modificati)
+
+    esito = EsecutoreSync(gcal).esegui(lavori, sync_map)
+    n_inserted, n_updated, n_deleted = esito['creati'], esito['aggiornati'], esito['eliminati']
     save_sync_map(sync_map)
-    if n_inserted == 0 and n_updated == 0:
-        print("Nessun evento da inserire o aggiornare: tutto già sincronizzato.")
+    if esito['errori'] == 0:
+        # Con errori lo stato resta da confermare, così i record non riusciti vengono rielaborati
+        tracciatore.conferma()
+        sync_map.scrivi_stato(CHIAVE_MESE_SYNC, mese)
+    if n_inserted == 0 and n_updated == 0 and n_deleted == 0:
+        print("Nessun evento da inserire, aggiornare o eliminare: tutto già sincronizzato.")
     else:
-        print(f"Sincronizzazione completata. Inseriti: {n_inserted}, Aggiornati: {n_updated}")
+        print(f"Sincronizzazione completata. Inseriti: {n_inserted}, Aggiornati: {n_updated}, Eliminati: {n_deleted}")
+    return esito
+
+def rebuild_sync_map():
+    """Ricostruisce la sync map dalle proprietà private degli eventi, senza toccare i calendari."""
+    db = DBHandler(PATH_APPUNTAMENTI_DBF, PATH_ANAGRAFICA_DBF)
+    sync_map = load_sync_map()
+    gcal = GoogleCalendarSync(db)
+    gcal.authenticate()
+    for calendar_id in set(GOOGLE['calendars_by_studio'].values()) | {GOOGLE['default_calendar']}:
+        esito = gcal.ricostruisci_sync_map(calendar_id, sync_map)
+        print(f"{calendar_id}: {esito['ricostruiti']} voci ricostruite, {esito['duplicati']} duplicati da eliminare")
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Sincronizzazione batch Google Calendar - TEST/PRODUZIONE")
     parser.add_argument('--test', action='store_true', help='Esegui solo il test (dry-run)')
     parser.add_argument('--sync', action='store_true', help='Esegui la sincronizzazione reale')
+    parser.add_argument('--ricostruisci-mappa', action='store_true', help='Ricostruisci la sync map dagli eventi Google')
     args = parser.parse_args()
-    if args.sync:
+    if args.ricostruisci_mappa:
+        rebuild_sync_map()
+    elif args.sync:
         sync_production()
     else:
         test_sync(preview_only=args.test)
@@ -17,7 +17,7 @@ from config import (
     COL_RICHAMI_DARICHIAMARE, COL_RICHAMI_PAZIENTE_ID, COL_PAZIENTI_NOME, COL_PAZIENTI_CELLULARE, COL_PAZIENTI_TELEFONO_FISSO,
     COL_RICHAMI_MESI_RICHIAMO, COL_RICHAMI_TIPO_RICHIAMI, COL_RICHAMI_DATA1, COL_RICHAMI_DATA2, COL_RICHAMI_ULTIMA_VISITA
 )
-import dbf
+from core.dbf_reader import TabellaDBF
 
 # Funzione di test connessione DBF
 
@@ -30,12 +30,12 @@ def test_connessione(path_appuntamenti=PATH_APPUNTAMENTI_DBF, path_anagrafica=PA
         appuntamenti_ok = False
         pazienti_ok = False
         try:
-            dbf.Table(path_appuntamenti, codepage='cp1252').open().close()
+            TabellaDBF(path_appuntamenti, codepage='cp1252').close()
             appuntamenti_ok = True
         except Exception:
             pass
         try:
-            dbf.Table(path_anagrafica, codepage='cp1252').open().close()
+            TabellaDBF(path_anagrafica, codepage='cp1252').close()
             pazienti_ok = True
         except Exception:
             pass
@@ -60,15 +60,14 @@ def debug_campi_dbf(percorso_file, file_type='appuntamenti'):
     """
     logging.info(f"--- DEBUG CAMPI DBF '{file_type.upper()}' ---")
     try:
-        dbf_table = dbf.Table(percorso_file, codepage='cp1252')
-        dbf_table.open()
-        logging.info(f"Colonne disponibili in '{percorso_file}': {[field.name for field in dbf_table.fields]}")
-        logging.info("Primi 3 record:")
-        for i, record in enumerate(dbf_table):
-            if i >= 3:
-                break
-            logging.info(f"Record {i+1}: {dict(record)}")
-        dbf_table.close()
+        with TabellaDBF(percorso_file, codepage='cp1252') as dbf_table:
+            logging.info(f"Colonne disponibili in '{percorso_file}': {dbf_table.field_names}")
+            logging.info(f"Record totali: {len(dbf_table)}")
+            logging.info("Primi 3 record:")
+            for i, record in enumerate(dbf_table):
+                if i >= 3:
+                    break
+                logging.info(f"Record {i+1}: {dict(record)}")
     except Exception as e:
         logging.error(f"Errore durante il debug del file DBF {file_type}: {e}")
     logging.info("----------------------------------")